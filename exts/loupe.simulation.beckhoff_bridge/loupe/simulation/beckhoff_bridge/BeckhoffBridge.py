@@ -8,13 +8,14 @@
 '''
 
 from typing import Callable
-import carb.events
-import omni.kit.app
 
-EVENT_TYPE_DATA_INIT = carb.events.type_from_string("loupe.simulation.beckhoff_bridge.DATA_INIT")
-EVENT_TYPE_DATA_READ = carb.events.type_from_string("loupe.simulation.beckhoff_bridge.DATA_READ")
-EVENT_TYPE_DATA_READ_REQ = carb.events.type_from_string("loupe.simulation.beckhoff_bridge.DATA_READ_REQ")
-EVENT_TYPE_DATA_WRITE_REQ = carb.events.type_from_string("loupe.simulation.beckhoff_bridge.DATA_WRITE_REQ")
+from .bridge_service import get_service
+from .dispatcher import Dispatcher, Subscriber, LATEST, DROP_OLDEST
+from .events import BridgeEvent, EVENT_TYPE_DATA_INIT, EVENT_TYPE_DATA_READ, EVENT_TYPE_DATA_READ_REQ, EVENT_TYPE_DATA_WRITE_REQ
+from .flat_data import ReadIndex, FlatSnapshot, split_plc_var_name, lookup_plc_var, snapshot_changed
+from .interpolation import LINEAR, DEFAULT_MAX_EXTRAPOLATION
+from .tracer import get_tracer
+from .trigger import RISING_EDGE
 
 class Manager:
     """
@@ -25,28 +26,80 @@ class Manager:
 
         register_init_callback( callback : Callable[[carb.events.IEvent], None] ): Registers a callback function for the DATA_INIT event.
     
-        register_data_callback( callback : Callable[[carb.events.IEvent], None] ): Registers a callback function for the DATA_READ event.
+        register_data_callback( callback : Callable[[carb.events.IEvent], None], policy : str, depth : int, variables : list[str] ): Registers a callback function for the DATA_READ event.
+
+        get_subscriber_stats(): Returns the delivery statistics of the registered data callbacks.
+
+        add_history( variable_name_array : list[str], depth : int, decimation : int ): Starts recording the values of variables.
+
+        get_history( name : str, window : float ): Returns the recorded timestamps and values of a variable.
+
+        add_interpolation( variable_name_array : list[str], mode : str, max_extrapolation : float ): Keeps timestamped samples of variables to evaluate them at frame time.
+
+        get_interpolated( names : list[str], frame_time : float, delay : float ): Returns the values of variables at the time of a frame.
+
+        add_stream( name : str, buffer : str, counter : str, dtype : numpy.dtype ): Starts reading a PLC-side ring buffer.
+
+        register_stream_callback( callback : Callable[[BridgeEvent], None] ): Registers a callback function for stream batches.
+
+        add_triggered_group( name : str, trigger : str, variables : list[str], mode : str ): Reads a group of variables only when a trigger fires.
+
+        register_group_callback( callback : Callable[[BridgeEvent], None] ): Registers a callback function for the reads of triggered groups.
         
         add_cyclic_read_variables( variable_name_array : list[str]): Adds variables to the cyclic read list.
         
         write_variable( name : str, value : any ): Writes a variable value to the Beckhoff Bridge.
+
+        write_variables( values : dict ): Writes several variable values to the Beckhoff Bridge in one batch.
+
+        write_array( name : str, values : numpy.ndarray, offset : int ): Writes a slice of a PLC array in one block write.
+
+    Inside Kit the Manager talks to the bridge through the message bus. In plain Python, where there is no message bus,
+    it talks directly to a BridgeService.
     """
 
-    def __init__(self):
+    def __init__(self, service = None):
         """
         Initializes the BeckhoffBridge object.
+
+        Args:
+            service (BridgeService, optional): The service to talk to directly instead of through the message bus.
+                Defaults to the registered service when there is no message bus.
         """
-        self._event_stream = omni.kit.app.get_app().get_message_bus_event_stream()
+        self._service = service
+        self._event_stream = None
         self._callbacks = []
+        self._data_subscribers = []
+        self._stream_subscribers = []
+        self._group_subscribers = []
+        self._dispatcher = None
+
+        if self._service is None:
+            try:
+                import omni.kit.app
+                self._event_stream = omni.kit.app.get_app().get_message_bus_event_stream()
+                self._dispatcher = Dispatcher()
+            except ImportError:
+                self._service = get_service()
+                if self._service is None:
+                    raise RuntimeError("There is no message bus outside of Kit. Pass a BridgeService to the Manager.")
 
     def __del__(self):
         """
         Cleans up the event subscriptions.
         """
         for callback in self._callbacks:
-            self._event_stream.remove_subscription(callback)
+            # Subset callbacks are subscribed to the registered service even when the Manager uses the message bus
+            if self._service is not None or isinstance(callback, Subscriber):
+                callback.unsubscribe()
+            else:
+                self._event_stream.remove_subscription(callback)
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+        for subscriber in self._stream_subscribers + self._group_subscribers:
+            subscriber.unsubscribe()
 
-    def register_init_callback( self, callback : Callable[[carb.events.IEvent], None] ):
+    def register_init_callback( self, callback : Callable[["carb.events.IEvent"], None] ):
         """
         Registers a callback function for the DATA_INIT event.
         The callback is triggered when the Beckhoff Bridge is initialized. 
@@ -59,16 +112,30 @@ class Manager:
         Returns:
             None
         """
-        self._callbacks.append(self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_INIT, callback))
+        if self._service is not None:
+            self._callbacks.append(self._service.subscribe_init(callback))
+        else:
+            self._callbacks.append(self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_INIT, callback))
         callback(None)
 
-    def register_data_callback( self, callback : Callable[[carb.events.IEvent], None] ):
+    def register_data_callback( self, callback : Callable[["carb.events.IEvent"], None], policy : str = LATEST, depth : int = 1, variables : list[str] = None ):
         """
         Registers a callback function for the DATA_READ event.
         The callback is triggered when the Beckhoff Bridge receives new data. The payload contains the updated variables.
 
+        The callback runs on its own thread, fed by a bounded queue, so a slow callback does not delay the PLC cycle
+        or other callbacks. If it falls behind, the LATEST policy skips to the newest data, and the DROP_OLDEST policy
+        keeps up to depth events and drops the oldest ones.
+
+        With variables, the payload only contains those variables instead of everything that is read, and the
+        callback is only triggered when one of them changed. The variables are added to the cyclic read list.
+
         Args:
             callback (Callable): The callback function to be registered.
+            policy (str, optional): LATEST or DROP_OLDEST.
+            depth (int, optional): The queue depth for DROP_OLDEST.
+            variables (list[str], optional): The variables to receive. Can contain wildcards when the bridge runs
+                in this process. ["MAIN.axis[*].position", "MAIN.state"]
 
         example callback:
             def on_message( event ):
@@ -77,20 +144,83 @@ class Manager:
         Returns:
             None
         """
-        self._callbacks.append(self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_READ, callback))
+        tracer = get_tracer()
+        name = getattr(callback, "__qualname__", repr(callback))
+
+        # Record the callback duration when tracing is enabled
+        def traced_callback(event):
+            with tracer.span(name, "subscriber"):
+                callback(event)
+
+        service = self._service
+        if service is None and variables is not None:
+            # Subsets are selected by the bridge itself when it runs in this process
+            service = get_service()
+
+        if service is not None:
+            subscriber = service.subscribe_data(traced_callback, policy, depth, variables)
+            self._callbacks.append(subscriber)
+        elif variables is not None:
+            if any('*' in name or '?' in name for name in variables):
+                raise ValueError("Wildcard variables can only be subscribed to when the bridge runs in this process")
+            subscriber = self._dispatcher.subscribe(traced_callback, policy, depth, name)
+            on_event = self._subset_filter(subscriber, variables)
+            self._callbacks.append(self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_READ, on_event))
+            self.add_cyclic_read_variables(variables)
+        else:
+            subscriber = self._dispatcher.subscribe(traced_callback, policy, depth, name)
+
+            # The message bus calls this on its publishing thread, so only queue the event there
+            def on_event(event):
+                subscriber.offer(BridgeEvent(event.type, {'data': event.payload['data']}))
+
+            self._callbacks.append(self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_READ, on_event))
+        self._data_subscribers.append(subscriber)
+
+    def _subset_filter(self, subscriber, variables):
+        """
+        Returns a message bus callback that only offers the variables to the subscriber, and only when they changed.
+        Used when the bridge does not run in this process, so the subset cannot be selected by the bridge.
+        """
+        index = ReadIndex(list(variables))
+        keys = [split_plc_var_name(name) for name in index.names]
+        last = [None]
+
+        def on_event(event):
+            data = event.payload['data']
+            subset = FlatSnapshot(index, [lookup_plc_var(data, variable_keys) for variable_keys in keys])
+            if snapshot_changed(last[0], subset):
+                last[0] = subset
+                subscriber.offer(BridgeEvent(event.type, {'data': subset.to_dict()}))
+
+        return on_event
+
+    def get_subscriber_stats(self):
+        """
+        Returns the delivery statistics of the data callbacks registered through this Manager.
+
+        Returns:
+            list[dict]: One entry per callback. {'name': 'on_message', 'delivered': 120, 'dropped': 3, 'mean_latency_ms': 0.2, ...}
+
+        """
+        return [subscriber.stats() for subscriber in self._data_subscribers]
 
     def add_cyclic_read_variables(self, variable_name_array : list[str]):
         """
         Adds variables to the cyclic read list.
         Variables in the cyclic read list are read from the Beckhoff Bridge at a fixed interval.
+        Names can contain wildcards, which are expanded against the PLC symbol table and again after every online change.
 
         Args:
-            variableList (list): List of variables to be added. ["MAIN.myStruct.myvar1", "MAIN.var2", ...]
+            variableList (list): List of variables to be added. ["MAIN.myStruct.myvar1", "MAIN.var2", "MAIN.axis[*].position", "GVL_Robot.*", ...]
 
         Returns:
             None
         """
-        self._event_stream.push(event_type=EVENT_TYPE_DATA_READ_REQ, payload={'variables': variable_name_array})
+        if self._service is not None:
+            self._service.add_read_variables(variable_name_array)
+        else:
+            self._event_stream.push(event_type=EVENT_TYPE_DATA_READ_REQ, payload={'variables': variable_name_array})
 
     def write_variable(self, name : str, value : any ):
         """
@@ -103,5 +233,196 @@ class Manager:
         Returns:
             None
         """
-        payload = {"variables": [{'name': name, 'value': value}]}
+        self.write_variables({name: value})
+
+    def write_variables(self, values : dict):
+        """
+        Writes several variable values to the Beckhoff Bridge. They are written together in the next cycle.
+
+        When the bridge runs in the same process, the values go straight into its write queue. The message bus is
+        only used when there is no bridge in this process to talk to.
+
+        Args:
+            values (dict): Variable names and values. {"MAIN.sensors[0]": True, "MAIN.part_x": 2.5, ...}
+
+        Returns:
+            None
+        """
+        service = self._service if self._service is not None else get_service()
+        if service is not None:
+            service.queue_writes(values)
+            return
+        payload = {"variables": [{'name': name, 'value': value} for name, value in values.items()]}
+        self._event_stream.push(event_type=EVENT_TYPE_DATA_WRITE_REQ, payload=payload)
+
+    def write_array(self, name : str, values, offset : int = 0):
+        """
+        Writes a contiguous slice of a PLC array in one block write, instead of one write per element.
+        The dtype of values is checked against the element type of the array on the PLC, and a mismatch is
+        reported in the bridge status instead of being converted.
+
+        Args:
+            name (str): The name of the array. "MAIN.trajectory"
+            values (numpy.ndarray): The elements to write. np.zeros(100, dtype='<f8') for an ARRAY OF LREAL
+            offset (int, optional): The position of the first written element, counted from the start of the array.
+
+        Returns:
+            None
+        """
+        service = self._service if self._service is not None else get_service()
+        if service is not None:
+            service.queue_array_write(name, values, offset)
+            return
+        import numpy as np
+        values = np.asarray(values)
+        payload = {"arrays": [{'name': name, 'values': values.reshape(-1).tolist(), 'dtype': values.dtype.str, 'offset': offset}]}
         self._event_stream.push(event_type=EVENT_TYPE_DATA_WRITE_REQ, payload=payload)
+
+    def _get_service(self):
+        service = self._service if self._service is not None else get_service()
+        if service is None:
+            raise RuntimeError("The Beckhoff Bridge extension is not running.")
+        return service
+
+    def add_history(self, variable_name_array : list[str], depth : int = 1000, decimation : int = 1):
+        """
+        Starts recording the values of variables, and adds them to the cyclic read list.
+        Each variable gets a preallocated ring buffer, so the memory used stays the same however long the bridge runs.
+
+        Args:
+            variable_name_array (list): Names of numeric or boolean variables. ["MAIN.axis[0].position", ...]
+            depth (int, optional): The number of samples kept per variable.
+            decimation (int, optional): Only every n-th read cycle is recorded.
+
+        Returns:
+            None
+        """
+        self._get_service().add_history(variable_name_array, depth, decimation)
+
+    def get_history(self, name : str, window : float = None):
+        """
+        Returns the recorded samples of a variable, oldest first.
+
+        Args:
+            name (str): The name of the variable. "MAIN.axis[0].position"
+            window (float, optional): Only return the samples of the last window seconds.
+
+        example:
+            times, values = beckhoff_bridge.get_history("MAIN.axis[0].position", window=5.0)
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: The timestamps (time.time()) and the values.
+        """
+        return self._get_service().get_history(name, window)
+
+    def add_interpolation(self, variable_name_array : list[str], mode : str = LINEAR, max_extrapolation : float = DEFAULT_MAX_EXTRAPOLATION):
+        """
+        Keeps the newest read cycles of variables with their timestamps, and adds them to the cyclic read list.
+        Their values can then be evaluated at the time of each rendered frame with get_interpolated(), so motion
+        looks smooth at any frame rate without reading the PLC more often.
+
+        Args:
+            variable_name_array (list): Names of the variables. ["MAIN.axis[0].position", ...]
+            mode (str, optional): "linear" to interpolate numbers and lists of numbers between read cycles, or "hold"
+                to keep the last value until the next read cycle. Other values are always held.
+            max_extrapolation (float, optional): The longest time in seconds past the newest read cycle that "linear"
+                values follow their last slope. After that, they stop.
+
+        Returns:
+            None
+        """
+        self._get_service().add_interpolation(variable_name_array, mode, max_extrapolation)
+
+    def get_interpolated(self, names : list[str], frame_time : float = None, delay : float = None):
+        """
+        Returns the values of variables at the time of a frame.
+
+        Args:
+            names (list): Names of variables added with add_interpolation(). ["MAIN.axis[0].position", ...]
+            frame_time (float, optional): The time.time() of the frame. By default, now.
+            delay (float, optional): How far in the past the values are evaluated, in seconds. By default one read
+                cycle, so that frames fall between two read cycles. With 0, frames past the newest read cycle are
+                extrapolated.
+
+        example:
+            values = beckhoff_bridge.get_interpolated(["MAIN.axis[0].position"])
+
+        Returns:
+            dict: The values keyed by name. Variables that were not read yet are None.
+        """
+        return self._get_service().get_interpolated(names, frame_time, delay)
+
+    def add_stream(self, name : str, buffer : str, counter : str, dtype, time_field : str = None, time_format : str = "filetime"):
+        """
+        Starts reading a ring buffer that the PLC fills every task cycle, to get data faster than the bridge polls.
+        The PLC writes each sample to buffer[counter MOD length], then increments counter. Each bridge cycle, only the
+        samples written since the last cycle are read, and delivered as one batch to the stream callbacks.
+
+        Args:
+            name (str): The name of the stream, used in the events. "encoder"
+            buffer (str): The name of the one-dimensional array on the PLC. "MAIN.buffer"
+            counter (str): The name of the UDINT write counter on the PLC. "MAIN.count"
+            dtype (numpy.dtype): The layout of one array element. np.dtype([('timestamp', '<u8'), ('position', '<f8')])
+            time_field (str, optional): The field of dtype that holds the PLC timestamp. "timestamp"
+            time_format (str, optional): "filetime" for F_GetSystemTime(), or "dc" for F_GetActualDcTime64().
+
+        Returns:
+            None
+        """
+        self._get_service().add_stream(name, buffer, counter, dtype, time_field, time_format)
+
+    def register_stream_callback(self, callback : Callable[["BridgeEvent"], None], depth : int = 64):
+        """
+        Registers a callback function for stream batches. Streams are only available in the same process as the bridge.
+
+        Args:
+            callback (Callable): The callback function to be registered.
+            depth (int, optional): The number of batches queued before the oldest are dropped.
+
+        example callback:
+            def on_stream( event ):
+                batch = event.payload['batch']
+                positions = batch.samples['position']
+                times = batch.timestamps
+
+        Returns:
+            None
+        """
+        self._stream_subscribers.append(self._get_service().subscribe_stream(callback, depth))
+
+    def add_triggered_group(self, name : str, trigger : str, variables : list[str], mode : str = RISING_EDGE):
+        """
+        Adds a group of variables that is only read when a trigger variable fires, e.g. a handshake flag for a recipe.
+        The trigger is read every cycle. In the cycle in which it fires, the group is read once and delivered to the
+        group callbacks, so large, rarely changing structures stay out of the cyclic read list.
+        Triggered groups are only available in the same process as the bridge.
+
+        Args:
+            name (str): The name of the group, used in the events. "recipe"
+            trigger (str): The name of the trigger variable on the PLC. "MAIN.recipe_ready"
+            variables (list[str]): The names of the variables to read. ["MAIN.recipe"]
+            mode (str, optional): "rising_edge" to read when a BOOL goes from FALSE to TRUE,
+                or "change" to read whenever the value changes, e.g. a counter the PLC increments.
+
+        Returns:
+            None
+        """
+        self._get_service().add_triggered_group(name, trigger, variables, mode)
+
+    def register_group_callback(self, callback : Callable[["BridgeEvent"], None], depth : int = 16):
+        """
+        Registers a callback function for the reads of triggered groups.
+
+        Args:
+            callback (Callable): The callback function to be registered.
+            depth (int, optional): The number of reads queued before the oldest are dropped.
+
+        example callback:
+            def on_group( event ):
+                if event.payload['group'] == 'recipe':
+                    recipe = event.payload['data']['MAIN']['recipe']
+
+        Returns:
+            None
+        """
+        self._group_subscribers.append(self._get_service().subscribe_groups(callback, depth))
@@ -8,4 +8,11 @@
 # license agreement from NVIDIA CORPORATION is strictly prohibited.
 #
 
-from .extension import *
+try:
+    import omni.ext
+except ImportError:
+    # Plain Python (e.g. batch simulations): only the headless API is available,
+    # BeckhoffBridge.Manager with a bridge_service.BridgeService.
+    pass
+else:
+    from .extension import *
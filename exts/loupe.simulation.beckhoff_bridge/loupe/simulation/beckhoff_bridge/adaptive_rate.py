@@ -0,0 +1,85 @@
+'''
+  File: **adaptive_rate.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+# Limits of the refresh rate in milliseconds, the same as for the fixed REFRESH_RATE
+MIN_RATE = 10
+MAX_RATE = 10000
+
+class AdaptiveRate():
+    """
+    Chooses the refresh rate of the bridge from the measured cycle cost and the demand for fresh data.
+
+    Every cycle, the controller is given the time the cycle took and whether there was demand, i.e. subscribers
+    and changing values, or writes. With demand it goes straight to min_rate; without it, it backs off by the
+    backoff factor per cycle up to max_rate. While the scene is paused it stays at max_rate. In every case, the
+    rate is kept slow enough that cycles take at most the budget fraction of the time, so a PLC or network that
+    gets slower is never saturated.
+
+    Args:
+        min_rate (float, optional): The fastest refresh rate in milliseconds.
+        max_rate (float, optional): The slowest refresh rate in milliseconds.
+        budget (float, optional): The largest fraction of the time the I/O cycles may take. 0.25
+        backoff (float, optional): The factor the rate is slowed down by per cycle without demand.
+        smoothing (float, optional): The weight of the newest cycle in the averaged cycle cost.
+
+    """
+
+    def __init__(self, min_rate : float = MIN_RATE, max_rate : float = 1000, budget : float = 0.25, backoff : float = 1.5, smoothing : float = 0.2):
+        if not 0 < budget <= 1:
+            raise ValueError("The budget must be a fraction between 0 and 1")
+        self.min_rate = min(max(min_rate, MIN_RATE), MAX_RATE)
+        self.max_rate = min(max(max_rate, self.min_rate), MAX_RATE)
+        self.budget = budget
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self._rate = self.min_rate
+        self._cost = None
+
+    @property
+    def rate(self):
+        """
+        The current refresh rate in milliseconds.
+        """
+        return self._rate
+
+    @property
+    def cost(self):
+        """
+        The averaged cycle cost in milliseconds.
+        """
+        return 0.0 if self._cost is None else self._cost
+
+    def update(self, cost : float, demand : bool, paused : bool = False):
+        """
+        Updates the rate after a cycle.
+
+        Args:
+            cost (float): The time the cycle took in milliseconds.
+            demand (bool): True if there are subscribers and the values changed, or values were written.
+            paused (bool, optional): True while the scene is paused.
+
+        Returns:
+            float: The refresh rate for the next cycle in milliseconds.
+
+        """
+        if self._cost is None:
+            self._cost = cost
+        else:
+            self._cost += self.smoothing * (cost - self._cost)
+
+        if paused:
+            rate = self.max_rate
+        elif demand:
+            rate = self.min_rate
+        else:
+            rate = self._rate * self.backoff
+        # Slow enough that cycles stay within the budget
+        rate = max(rate, self._cost / self.budget)
+        self._rate = min(max(rate, self.min_rate), self.max_rate)
+        return self._rate
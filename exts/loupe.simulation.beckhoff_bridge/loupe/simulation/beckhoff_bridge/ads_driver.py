@@ -7,46 +7,135 @@
   
 '''
 
-import pyads
+import logging
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .flat_data import ReadIndex, FlatSnapshot, split_plc_var_name, lookup_plc_var
+from .symbol_index import SymbolIndex, is_pattern, parse_array_bounds, parse_array_element_type, plc_type_dtype
+
+# Index group of the symbol table version, which changes on every online change
+ADSIGRP_SYM_VERSION = 0xF008
+
+# Minimum time between symbol table version checks, in seconds
+SYMBOL_VERSION_POLL_INTERVAL = 1.0
+
+# ADS port used for names without a port qualifier (pyads.PORT_TC3PLC1, the first TwinCAT 3 PLC runtime)
+DEFAULT_PORT = 851
+
+# Backends that carry the ADS requests: pyads through the TwinCAT router library, or the pure-Python AmsClient
+PYADS_BACKEND = "pyads"
+ASYNCIO_BACKEND = "asyncio"
+
+_PORT_QUALIFIER = re.compile(r"^(\d+):(.*)$")
+
+def split_port(name : str, default_port : int = DEFAULT_PORT):
+    """
+    Splits the optional ADS port qualifier from a variable name.
+
+    Args:
+        name (str): The variable name, optionally prefixed with a port. "852:MAIN.var"
+        default_port (int, optional): The port of names without a qualifier.
+
+    Returns:
+        tuple[int, str]: The port and the name without the qualifier. (852, "MAIN.var")
+
+    """
+    match = _PORT_QUALIFIER.match(name)
+    if match is None:
+        return default_port, name
+    return int(match.group(1)), match.group(2)
 
 class AdsDriver():
     """
     A class that represents an ADS driver. It contains a list of variables to read from the target device and provides methods to read and write data.
 
+    Variable names can be prefixed with an ADS port to reach other runtimes on the same target, e.g. "852:MAIN.var"
+    for the second PLC runtime. Reads and writes are grouped per port, the groups run concurrently over the same
+    AMS route, and the results are merged into one snapshot. Names keep their qualifier in the results.
+    exchange() combines the writes and the reads of a cycle.
+
+    With the asyncio backend, requests go through an AmsClient instead of pyads. It talks AMS/TCP to the target
+    directly, keeps all requests of a cycle in flight at once over one TCP connection, and caches the symbols, so
+    a cycle costs one network round trip. Structures then need to be read by their members.
+
     Args:
         ams_net_id (str): The AMS Net ID of the target device.
+        port (int, optional): The ADS port used for names without a port qualifier.
+        backend (str, optional): PYADS_BACKEND or ASYNCIO_BACKEND.
+        backend_options (dict, optional): Options of the AmsClient of the asyncio backend.
+            {'ip_address': '192.168.1.10', 'source_net_id': '192.168.1.20.1.1'}
 
     Attributes:
         ams_net_id (str): The AMS Net ID of the target device.
+        port (int): The ADS port used for names without a port qualifier.
         _read_names (list): A list of names for reading data.
         _read_struct_def (dict): A dictionary that maps names to structure definitions.
+        _read_patterns (list): Wildcard patterns to read, expanded against the symbol table.
+        _pattern_names (dict): Maps each pattern to the names it currently expands to.
+        _read_plan (tuple): The read names grouped per port and the precomputed ReadIndex of all of them, or None
+            until it is rebuilt after the read list changed.
+        _symbol_indexes (dict): The indexed symbol table of each port with patterns to expand.
+        _connections (dict): The open connection of each port.
 
     """
 
-    def __init__(self, ams_net_id):             
+    def __init__(self, ams_net_id, port = DEFAULT_PORT, backend = PYADS_BACKEND, backend_options = None):
         """
         Initializes an instance of the AdsDriver class.
 
         Args:
             ams_net_id (str): The AMS Net ID of the target device.
+            port (int, optional): The ADS port used for names without a port qualifier.
+            backend (str, optional): PYADS_BACKEND or ASYNCIO_BACKEND.
+            backend_options (dict, optional): Options of the AmsClient of the asyncio backend.
 
         """
+        if backend not in (PYADS_BACKEND, ASYNCIO_BACKEND):
+            raise ValueError(f"Unknown ADS backend: {backend}")
         self.ams_net_id = ams_net_id
+        self.port = port
+        self.backend = backend
+        self.backend_options = backend_options or dict()
+        self._ams_client = None
         self._read_names = list()
         self._read_struct_def = dict()
+        self._read_patterns = list()
+        self._pattern_names = dict()
+        self._read_plan = None
+        self._symbol_indexes = dict()
+        self._symbol_versions = dict()
+        self._symbol_check_time = 0
+        self._array_symbols = dict()
+        self._connections = dict()
+        self._executor = None
+        self._executor_workers = 0
 
     def add_read(self, name : str, structure_def = None):
         """
         Adds a variable to the list of data to read.
 
+        Names with wildcards are expanded against the PLC symbol table, and expanded again after every online change.
+        See SymbolIndex for the pattern syntax.
+
         Args:
-            name (str): The name of the data to be read. "my_struct.my_array[0].my_var"
+            name (str): The name of the data to be read. "my_struct.my_array[0].my_var", "MAIN.axis[*].position"
             structure_def (optional): The structure definition of the data.
 
         """
+        if is_pattern(name):
+            if name not in self._read_patterns:
+                self._read_patterns.append(name)
+                port, _ = split_port(name, self.port)
+                if port in self._symbol_indexes:
+                    self._pattern_names[name] = self._expand_pattern(name)
+                    self._read_plan = None
+            return
+
         if name not in self._read_names:
             self._read_names.append(name)
+            self._read_plan = None
 
         if structure_def is not None:
             if name not in self._read_struct_def:
@@ -62,7 +151,12 @@ class AdsDriver():
             data = {'MAIN.b_Execute': False, 'MAIN.str_TestString': 'Goodbye World', 'MAIN.r32_TestReal': 54.321}
 
         """
-        self._connection.write_list_by_name(data)
+        groups = dict()
+        for name, value in data.items():
+            port, bare_name = split_port(name, self.port)
+            groups.setdefault(port, dict())[bare_name] = value
+
+        self._run_per_port(lambda port: self._get_connection(port).write_list_by_name(groups[port]), list(groups))
 
     def read_data(self):
         """
@@ -72,15 +166,345 @@ class AdsDriver():
             dict: A dictionary containing the parsed data.
 
         """
-        if self._read_names.__len__() > 0:
-            data = self._connection.read_list_by_name(self._read_names, structure_defs=self._read_struct_def)
-            parsed_data = dict()
-            for name in data.keys():
-                parsed_data = self._parse_flat_plc_var_to_dict(parsed_data, name, data[name])
+        return self.read_table().to_dict()
+
+    def read_table(self):
+        """
+        Reads all variables from the cyclic read list into a flat value table.
+
+        Unlike read_data(), no nested dictionary is built. The nested form is available lazily through
+        the snapshot's view, so consumers that only touch a few paths never pay for the full tree.
+
+        Returns:
+            FlatSnapshot: The values, one per name in the read list.
+
+        """
+        groups, index = self._get_read_plan()
+        if len(index.names) > 0:
+            data = dict()
+            for group_data in self._run_per_port(self._read_group, groups):
+                data.update(group_data)
+            values = [data.get(name) for name in index.names]
         else:
-            parsed_data = dict()        
-        return parsed_data
-    
+            values = []
+        return FlatSnapshot(index, values)
+
+    @property
+    def combined_exchange(self):
+        """
+        True if exchange() writes and reads in one request, which is the case with the asyncio backend.
+        """
+        return self.backend == ASYNCIO_BACKEND
+
+    def exchange(self, values : dict):
+        """
+        Writes values and then reads all variables from the cyclic read list, in as few round trips as the backend
+        allows.
+
+        With the asyncio backend, the writes and reads of each port go out in one ADS sum read-write request, and the
+        ports are exchanged concurrently. A cycle costs one round trip, or two with writes, since the symbol version is
+        checked before anything is written. With pyads, the values are written and then read, as with write_data()
+        followed by read_table().
+
+        Args:
+            values (dict): The values to write. May be empty.
+
+        Returns:
+            tuple[FlatSnapshot, Exception]: The values read, one per name in the read list, and the error of the
+            writes, or None. A failed write does not fail the read.
+
+        """
+        if self.backend != ASYNCIO_BACKEND:
+            error = None
+            if values:
+                try:
+                    self.write_data(values)
+                except Exception as e:
+                    error = e
+            return self.read_table(), error
+
+        groups, index = self._get_read_plan()
+        writes = dict()
+        for name, value in values.items():
+            port, bare_name = split_port(name, self.port)
+            writes.setdefault(port, dict())[bare_name] = value
+        reads = dict(groups)
+
+        def exchange_port(port):
+            names = reads.get(port, [])
+            structure_defs = {bare_name: self._read_struct_def[name] for name, bare_name in names if name in self._read_struct_def}
+            data, error = self._get_connection(port).exchange(writes.get(port, {}), [bare_name for name, bare_name in names], structure_defs)
+            return {name: data.get(bare_name) for name, bare_name in names}, error
+
+        data = dict()
+        error = None
+        for port_data, port_error in self._run_per_port(exchange_port, list(dict.fromkeys(list(reads) + list(writes)))):
+            data.update(port_data)
+            error = error or port_error
+        return FlatSnapshot(index, [data.get(name) for name in index.names]), error
+
+    def read_values(self, names : list):
+        """
+        Reads variables once, outside of the cyclic read list, e.g. for triggered read groups.
+        Like cyclic reads, the names are grouped per port and the ports are read concurrently.
+
+        Args:
+            names (list[str]): The variable names. ["MAIN.recipe", "852:MAIN.batch_report"]
+
+        Returns:
+            list: The values, in the order of names.
+
+        """
+        groups = dict()
+        for name in names:
+            port, bare_name = split_port(name, self.port)
+            groups.setdefault(port, list()).append((name, bare_name))
+        data = dict()
+        for group_data in self._run_per_port(self._read_group, list(groups.items())):
+            data.update(group_data)
+        return [data.get(name) for name in names]
+
+    def _get_read_plan(self):
+        """
+        Returns the per-port read groups and the read index, rebuilding them if the read list changed.
+        The pair is read once, so a concurrent change of the read list cannot mix an old and a new half.
+        """
+        plan = self._read_plan
+        if plan is None:
+            plan = self._build_read_plan()
+        return plan
+
+    def _build_read_plan(self):
+        """
+        Rebuilds the read index and the per-port read groups after the read list changed.
+
+        Returns:
+            tuple[list, ReadIndex]: The (port, [(name, bare name)]) groups and the index of all read names.
+
+        """
+        names = self._get_read_names()
+        groups = dict()
+        for name in names:
+            port, bare_name = split_port(name, self.port)
+            groups.setdefault(port, list()).append((name, bare_name))
+        plan = (list(groups.items()), ReadIndex(names))
+        self._read_plan = plan
+        return plan
+
+    def _read_group(self, group):
+        """
+        Reads the names of one port, and returns their values keyed by the names as they were added.
+        """
+        port, names = group
+        bare_names = [bare_name for name, bare_name in names]
+        structure_defs = {bare_name: self._read_struct_def[name] for name, bare_name in names if name in self._read_struct_def}
+        data = self._get_connection(port).read_list_by_name(bare_names, structure_defs=structure_defs)
+        return {name: data.get(bare_name) for name, bare_name in names}
+
+    def _run_per_port(self, function, items):
+        """
+        Calls function for each per-port item, concurrently if there is more than one port.
+
+        Returns:
+            list: The results, in the order of items.
+
+        """
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        if self._executor is None or self._executor_workers < len(items):
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=len(items), thread_name_prefix="BeckhoffBridgePort")
+            self._executor_workers = len(items)
+        return list(self._executor.map(function, items))
+
+    def _get_connection(self, port):
+        """
+        Returns the connection to a port of the target device, opening it if necessary.
+        All connections share the AMS route to the target.
+        """
+        connection = self._connections.get(port)
+        if connection is None:
+            if self.backend == ASYNCIO_BACKEND:
+                # All ports share the TCP connection of one client
+                if self._ams_client is None:
+                    from .ams_client import SyncAmsClient
+                    client = SyncAmsClient(self.ams_net_id, **self.backend_options)
+                    client.open()
+                    self._ams_client = client
+                connection = self._ams_client.connection(port)
+            else:
+                # pyads is imported on first use, so the bridge can be loaded without it (e.g. with a different driver)
+                import pyads
+                connection = pyads.Connection(self.ams_net_id, port)
+            connection.open()
+            self._connections[port] = connection
+        return connection
+
+    def _get_read_names(self):
+        """
+        Returns the explicit read names followed by the current pattern expansions, without duplicates.
+        """
+        names = dict.fromkeys(self._read_names)
+        for pattern in self._read_patterns:
+            names.update(dict.fromkeys(self._pattern_names.get(pattern, ())))
+        return list(names)
+
+    def _expand_pattern(self, pattern):
+        """
+        Expands a pattern against the symbol table of its port, keeping the pattern's port qualifier on the names.
+        """
+        port, bare_pattern = split_port(pattern, self.port)
+        qualifier = pattern[:len(pattern) - len(bare_pattern)]
+        return [qualifier + name for name in self._symbol_indexes[port].expand(bare_pattern)]
+
+    def _get_pattern_ports(self):
+        return list(dict.fromkeys(split_port(pattern, self.port)[0] for pattern in self._read_patterns))
+
+    def refresh_symbols(self, ports = None):
+        """
+        Uploads the symbol table from the target device and expands all wildcard patterns against it.
+
+        Args:
+            ports (list[int], optional): The ports to upload. By default, every port that has patterns.
+
+        """
+        for port in (self._get_pattern_ports() if ports is None else ports):
+            symbols = self._get_connection(port).get_all_symbols()
+            self._symbol_indexes[port] = SymbolIndex((symbol.name, symbol.symbol_type) for symbol in symbols)
+        pattern_names = dict()
+        for pattern in self._read_patterns:
+            if split_port(pattern, self.port)[0] not in self._symbol_indexes:
+                continue
+            try:
+                pattern_names[pattern] = self._expand_pattern(pattern)
+            except Exception as e:
+                # One bad pattern must not drop the others, it keeps its previous expansion
+                logging.getLogger(__name__).error("Error expanding read pattern %s: %s", pattern, e)
+                if pattern in self._pattern_names:
+                    pattern_names[pattern] = self._pattern_names[pattern]
+        self._pattern_names = pattern_names
+        self._read_plan = None
+
+    def check_online_change(self):
+        """
+        Re-expands wildcard patterns if the symbol table changed since it was last uploaded.
+        This only talks to the target device if there are patterns, and at most once per SYMBOL_VERSION_POLL_INTERVAL.
+
+        Returns:
+            bool: True if the symbol table was uploaded again.
+
+        """
+        if not self._read_patterns or time.time() - self._symbol_check_time < SYMBOL_VERSION_POLL_INTERVAL:
+            return False
+        self._symbol_check_time = time.time()
+
+        import ctypes
+        versions = dict()
+        for port in self._get_pattern_ports():
+            # ctypes.c_uint8 is pyads.PLCTYPE_USINT
+            version = self._get_connection(port).read(ADSIGRP_SYM_VERSION, 0, ctypes.c_uint8)
+            if port not in self._symbol_indexes or version != self._symbol_versions.get(port):
+                versions[port] = version
+
+        if not versions:
+            return False
+        self.refresh_symbols(list(versions))
+        # Only recorded once the patterns are expanded, so a failed upload is retried on the next check
+        self._symbol_versions.update(versions)
+        return True
+
+    def get_array_length(self, name : str):
+        """
+        Returns the number of elements of a one-dimensional array symbol.
+
+        Args:
+            name (str): The array name, optionally with a port qualifier. "MAIN.buffer"
+
+        """
+        port, bare_name = split_port(name, self.port)
+        symbol = self._get_array_symbol(port, bare_name)
+        bounds = parse_array_bounds(symbol.symbol_type)
+        if bounds is None or len(bounds) != 1:
+            raise ValueError(f"{name} is not a one-dimensional array: {symbol.symbol_type}")
+        low, high = bounds[0]
+        return high - low + 1
+
+    def read_array_bytes(self, name : str, start : int, count : int, element_size : int):
+        """
+        Reads a contiguous range of array elements as raw bytes, in one ADS read.
+
+        Args:
+            name (str): The array name, optionally with a port qualifier. "MAIN.buffer"
+            start (int): The position of the first element, counted from the start of the array.
+            count (int): The number of elements.
+            element_size (int): The size of one element in bytes.
+
+        Returns:
+            bytes: count * element_size bytes.
+
+        """
+        import ctypes
+        port, bare_name = split_port(name, self.port)
+        symbol = self._get_array_symbol(port, bare_name)
+        data = self._get_connection(port).read(symbol.index_group, symbol.index_offset + start * element_size,
+                                               ctypes.c_ubyte * (count * element_size), return_ctypes=True)
+        return bytes(data)
+
+    def write_array(self, name : str, values, offset : int = 0):
+        """
+        Writes a contiguous slice of an array in one ADS write, instead of one write per element.
+
+        The dtype of values must match the element type of the array on the PLC, so values are never converted
+        silently. Arrays of structures need a structured dtype with the PLC's packing. Multi-dimensional arrays
+        are written in PLC memory order, so values are flattened and offset counts elements of the flat array.
+
+        Args:
+            name (str): The array name, optionally with a port qualifier. "MAIN.trajectory"
+            values (numpy.ndarray): The elements to write. np.zeros(100, dtype='<f8') for an ARRAY OF LREAL
+            offset (int, optional): The position of the first written element, counted from the start of the array.
+
+        Raises:
+            TypeError: If the dtype of values does not match the element type.
+            ValueError: If the name is not an array, or the slice does not fit into it.
+
+        """
+        import ctypes
+        import numpy as np
+        port, bare_name = split_port(name, self.port)
+        symbol = self._get_array_symbol(port, bare_name)
+        bounds = parse_array_bounds(symbol.symbol_type)
+        if bounds is None:
+            raise ValueError(f"{name} is not an array: {symbol.symbol_type}")
+
+        values = np.ascontiguousarray(values).reshape(-1)
+        element_type = parse_array_element_type(symbol.symbol_type)
+        dtype = plc_type_dtype(element_type)
+        if dtype is not None and values.dtype != np.dtype(dtype):
+            raise TypeError(f"Cannot write {values.dtype} to {name}, which is an {symbol.symbol_type}. Use values.astype('{dtype}')")
+        if dtype is None and values.dtype.names is None:
+            raise TypeError(f"{name} is an array of {element_type}, which needs a structured dtype, not {values.dtype}")
+
+        length = 1
+        for low, high in bounds:
+            length *= high - low + 1
+        if offset < 0 or offset + len(values) > length:
+            raise ValueError(f"Elements {offset} to {offset + len(values) - 1} do not fit into {name}, which has {length}")
+        if len(values) == 0:
+            return
+
+        data_type = ctypes.c_ubyte * values.nbytes
+        self._get_connection(port).write(symbol.index_group, symbol.index_offset + offset * values.itemsize,
+                                         data_type.from_buffer_copy(values), data_type)
+
+    def _get_array_symbol(self, port, name):
+        key = (port, name)
+        symbol = self._array_symbols.get(key)
+        if symbol is None:
+            symbol = self._get_connection(port).get_symbol(name)
+            self._array_symbols[key] = symbol
+        return symbol
+
     def _ensure_list_with_index_in_dict(self, list_name, _dict, _index):
         """
         Ensure that dictionary has a key of list_name, that it's value is a list,
@@ -181,15 +605,32 @@ class AdsDriver():
         if ams_net_id is not None:
             self.ams_net_id = ams_net_id
 
-        self._connection = pyads.Connection(self.ams_net_id, pyads.PORT_TC3PLC1)
-        self._connection.open()
+        # Close the connections of a previous connect, which may be broken
+        self.disconnect()
+        self._connection = self._get_connection(self.port)
+        self._symbol_versions = dict()
+        self._symbol_check_time = 0
+        self._array_symbols = dict()
 
     def disconnect(self):
         """
         Disconnects from the target device.
 
         """
-        self._connection.close()
+        connections = self._connections
+        self._connections = dict()
+        for connection in connections.values():
+            try:
+                connection.close()
+            except Exception:
+                # A broken connection must not keep the others open
+                pass
+        if self._ams_client is not None:
+            self._ams_client.close()
+            self._ams_client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
     def is_connected(self):
         """
@@ -0,0 +1,935 @@
+'''
+  File: **ams_client.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import asyncio
+import ctypes
+import functools
+import re
+import socket
+import struct
+import threading
+
+from .dispatcher import _log_error
+from .symbol_index import parse_array_bounds, parse_array_element_type, plc_type_dtype
+
+# The TCP port of the AMS router on the target device
+ADS_TCP_PORT = 48898
+DEFAULT_SOURCE_PORT = 32905
+
+# ADS commands
+ADSCOMMAND_READDEVICEINFO = 1
+ADSCOMMAND_READ = 2
+ADSCOMMAND_WRITE = 3
+ADSCOMMAND_READSTATE = 4
+ADSCOMMAND_WRITECTRL = 5
+ADSCOMMAND_ADDDEVICENOTE = 6
+ADSCOMMAND_DELDEVICENOTE = 7
+ADSCOMMAND_DEVICENOTE = 8
+ADSCOMMAND_READWRITE = 9
+
+# State flags of the AMS header
+STATE_REQUEST = 0x0004
+STATE_RESPONSE = 0x0005
+
+# Index groups of the PLC runtime
+ADSIGRP_SYM_HNDBYNAME = 0xF003
+ADSIGRP_SYM_VERSION = 0xF008
+ADSIGRP_SYM_INFOBYNAMEEX = 0xF009
+ADSIGRP_SYM_UPLOAD = 0xF00B
+ADSIGRP_SYM_UPLOADINFO2 = 0xF00F
+ADSIGRP_SUMUP_READ = 0xF080
+ADSIGRP_SUMUP_WRITE = 0xF081
+ADSIGRP_SUMUP_READWRITE = 0xF082
+
+# Notification transmission modes
+ADSTRANS_SERVERCYCLE = 3
+ADSTRANS_SERVERONCHA = 4
+
+# The most sub-commands the PLC accepts in one sum command
+MAX_SUM_ITEMS = 500
+
+# The bytes reserved for each symbol entry in a batched lookup. Longer entries have their comment cut off
+MAX_SYMBOL_ENTRY = 0x1000
+
+ADSERR_DEVICE_SRVNOTSUPP = 0x701
+
+STRING_ENCODING = "windows-1252"
+
+ADS_ERRORS = {
+    0x6: "Target port not found",
+    0x7: "Target machine not found",
+    0x701: "Service is not supported by the server",
+    0x702: "Invalid index group",
+    0x703: "Invalid index offset",
+    0x705: "Parameter size not correct",
+    0x706: "Invalid data values",
+    0x710: "Symbol not found",
+    0x714: "Notification handle is invalid",
+    0x745: "Timeout elapsed",
+}
+
+_TCP_HEADER = struct.Struct("<HI")
+_AMS_HEADER = struct.Struct("<6sH6sHHHIII")
+_RESULT = struct.Struct("<I")
+_RESULT_LENGTH = struct.Struct("<II")
+_STATE = struct.Struct("<IHH")
+_READ = struct.Struct("<III")
+_WRITE = struct.Struct("<III")
+_READ_WRITE = struct.Struct("<IIII")
+_SUM_ITEM = struct.Struct("<III")
+_SYMBOL_ENTRY = struct.Struct("<IIIIIIHHH")
+_UPLOAD_INFO = struct.Struct("<IIIIII")
+_ADD_NOTIFICATION = struct.Struct("<IIIIII16x")
+_NOTIFICATION_HEADER = struct.Struct("<II")
+_STAMP_HEADER = struct.Struct("<QI")
+_SAMPLE_HEADER = struct.Struct("<II")
+
+
+class AdsError(Exception):
+    """
+    An error code returned by an ADS device.
+
+    Attributes:
+        err_code (int): The ADS error code.
+
+    """
+
+    def __init__(self, err_code : int, context : str = None):
+        self.err_code = err_code
+        message = f"ADS error {err_code:#x}: {ADS_ERRORS.get(err_code, 'Unknown error')}"
+        if context:
+            message += f" ({context})"
+        super().__init__(message)
+
+
+def net_id_bytes(ams_net_id : str):
+    """
+    Converts an AMS Net ID to its six bytes. "5.80.201.232.1.1"
+    """
+    parts = ams_net_id.split(".")
+    if len(parts) != 6:
+        raise ValueError(f"Invalid AMS Net ID: {ams_net_id}")
+    return bytes(int(part) for part in parts)
+
+
+####################################
+# Values
+####################################
+
+# Struct codes of the NumPy dtypes in symbol_index.PLC_TYPE_DTYPES
+_STRUCT_CODES = {"?": "?", "u1": "B", "i1": "b", "<u2": "H", "<i2": "h", "<u4": "I", "<i4": "i",
+                 "<u8": "Q", "<i8": "q", "<f4": "f", "<f8": "d"}
+_WSTRING_TYPE = re.compile(r"^\s*WSTRING\s*(?:\(\s*(\d+)\s*\))?\s*$", re.IGNORECASE)
+
+
+class PlcCodec():
+    """
+    Decodes and encodes the values of one PLC type.
+    Values are decoded straight out of the received frame with struct, without copying it.
+
+    Attributes:
+        size (int): The size of a value in bytes.
+        decode (Callable[[memoryview, int], object]): Decodes the value at an offset of a buffer.
+        encode (Callable[[object], bytes]): Encodes a value.
+
+    """
+
+    __slots__ = ("size", "decode", "encode")
+
+    def __init__(self, size : int, decode, encode):
+        self.size = size
+        self.decode = decode
+        self.encode = encode
+
+
+@functools.lru_cache(maxsize=None)
+def plc_codec(symbol_type : str, size : int = None):
+    """
+    Returns the codec of a PLC type.
+
+    Elementary types and strings are decoded to Python values, and arrays of them to lists in PLC memory order.
+    Structures and other types are decoded to their raw bytes, so they need the size from the symbol table.
+
+    Args:
+        symbol_type (str): The type from the symbol table. "LREAL", "STRING(20)", "ARRAY [0..9] OF INT"
+        size (int, optional): The size from the symbol table.
+
+    Raises:
+        ValueError: If the type is unknown and there is no size.
+
+    """
+    bounds = parse_array_bounds(symbol_type)
+    if bounds is not None:
+        count = 1
+        for low, high in bounds:
+            count *= high - low + 1
+        element = plc_codec(parse_array_element_type(symbol_type), size // count if size else None)
+        code = _STRUCT_CODES.get(plc_type_dtype(parse_array_element_type(symbol_type)))
+        if code is not None:
+            packer = struct.Struct(f"<{count}{code}")
+            return PlcCodec(packer.size, lambda view, offset = 0: list(packer.unpack_from(view, offset)),
+                            lambda values: packer.pack(*values))
+        element_size = element.size
+
+        def decode_array(view, offset = 0):
+            return [element.decode(view, offset + i * element_size) for i in range(count)]
+
+        def encode_array(values):
+            if len(values) != count:
+                raise ValueError(f"{symbol_type} needs {count} values, not {len(values)}")
+            return b"".join(element.encode(value) for value in values)
+
+        return PlcCodec(element_size * count, decode_array, encode_array)
+
+    dtype = plc_type_dtype(symbol_type)
+    code = _STRUCT_CODES.get(dtype)
+    if code is not None:
+        packer = struct.Struct("<" + code)
+        return PlcCodec(packer.size, lambda view, offset = 0: packer.unpack_from(view, offset)[0], packer.pack)
+
+    if dtype is not None and dtype.startswith("S"):
+        length = int(dtype[1:])
+
+        def decode_string(view, offset = 0):
+            return bytes(view[offset:offset + length]).split(b"\0", 1)[0].decode(STRING_ENCODING)
+
+        def encode_string(value):
+            return value.encode(STRING_ENCODING)[:length - 1].ljust(length, b"\0")
+
+        return PlcCodec(length, decode_string, encode_string)
+
+    match = _WSTRING_TYPE.match(symbol_type)
+    if match is not None:
+        length = (int(match.group(1) or 80) + 1) * 2
+
+        def decode_wstring(view, offset = 0):
+            return bytes(view[offset:offset + length]).decode("utf-16-le").split("\0", 1)[0]
+
+        def encode_wstring(value):
+            return value.encode("utf-16-le")[:length - 2].ljust(length, b"\0")
+
+        return PlcCodec(length, decode_wstring, encode_wstring)
+
+    if size is None:
+        raise ValueError(f"Unknown PLC type: {symbol_type}")
+
+    def encode_raw(value):
+        value = bytes(value)
+        if len(value) != size:
+            raise ValueError(f"{symbol_type} needs {size} bytes, not {len(value)}")
+        return value
+
+    return PlcCodec(size, lambda view, offset = 0: bytes(view[offset:offset + size]), encode_raw)
+
+
+####################################
+# Symbols
+####################################
+
+class AmsSymbol():
+    """
+    An entry of the symbol table of a PLC runtime, with the attributes of a pyads AdsSymbol that the bridge uses.
+    """
+
+    __slots__ = ("name", "index_group", "index_offset", "size", "data_type", "flags", "symbol_type", "comment")
+
+    def __init__(self, name : str, index_group : int, index_offset : int, size : int, symbol_type : str,
+                 data_type : int = 0, flags : int = 0, comment : str = ""):
+        self.name = name
+        self.index_group = index_group
+        self.index_offset = index_offset
+        self.size = size
+        self.symbol_type = symbol_type
+        self.data_type = data_type
+        self.flags = flags
+        self.comment = comment
+
+    @property
+    def codec(self):
+        return plc_codec(self.symbol_type, self.size)
+
+    def pack(self):
+        """
+        Returns the symbol as an AdsSymbolEntry, as in the responses to symbol requests.
+        """
+        name, symbol_type, comment = (text.encode(STRING_ENCODING) for text in (self.name, self.symbol_type, self.comment))
+        strings = name + b"\0" + symbol_type + b"\0" + comment + b"\0"
+        return _SYMBOL_ENTRY.pack(_SYMBOL_ENTRY.size + len(strings), self.index_group, self.index_offset, self.size,
+                                  self.data_type, self.flags, len(name), len(symbol_type), len(comment)) + strings
+
+    @classmethod
+    def unpack_from(cls, view, offset : int = 0):
+        """
+        Parses an AdsSymbolEntry.
+
+        Returns:
+            tuple[AmsSymbol, int]: The symbol and the length of the entry.
+
+        """
+        (length, index_group, index_offset, size, data_type, flags,
+         name_length, type_length, comment_length) = _SYMBOL_ENTRY.unpack_from(view, offset)
+        position = offset + _SYMBOL_ENTRY.size
+        name = bytes(view[position:position + name_length]).decode(STRING_ENCODING)
+        position += name_length + 1
+        symbol_type = bytes(view[position:position + type_length]).decode(STRING_ENCODING)
+        position += type_length + 1
+        comment = bytes(view[position:position + comment_length]).decode(STRING_ENCODING)
+        return cls(name, index_group, index_offset, size, symbol_type, data_type, flags, comment), length
+
+
+####################################
+# Client
+####################################
+
+class AmsClient():
+    """
+    An asyncio ADS client that talks AMS/TCP to the router of the target device directly, without pyads or the
+    TwinCAT router library.
+
+    Requests are not serialized: each one gets its own invoke ID, and a reader task matches the responses to the
+    waiting requests, so any number of requests can be in flight at once and a batch of them costs one network
+    round trip. Notifications from the device are dispatched by the same reader task.
+
+    All ports of the target device share one TCP connection. The target needs a route to the source Net ID.
+
+    Args:
+        ams_net_id (str): The AMS Net ID of the target device.
+        ip_address (str, optional): The IP address of the target. Defaults to the first four parts of ams_net_id.
+        source_net_id (str, optional): The AMS Net ID of this client. Defaults to the local IP address with ".1.1".
+        source_port (int, optional): The AMS port of this client.
+        tcp_port (int, optional): The TCP port of the AMS router.
+        timeout (float, optional): Seconds to wait for a response.
+
+    e.g.
+        client = AmsClient('5.80.201.232.1.1')
+        await client.connect()
+        speed, count = await asyncio.gather(client.read(851, 0x4020, 0, 8), client.read(851, 0x4020, 8, 4))
+
+    """
+
+    def __init__(self, ams_net_id : str, ip_address : str = None, source_net_id : str = None,
+                 source_port : int = DEFAULT_SOURCE_PORT, tcp_port : int = ADS_TCP_PORT, timeout : float = 5.0):
+        self.ams_net_id = ams_net_id
+        self.ip_address = ip_address or ".".join(ams_net_id.split(".")[:4])
+        self.source_net_id = source_net_id
+        self.source_port = source_port
+        self.tcp_port = tcp_port
+        self.timeout = timeout
+
+        self._target = net_id_bytes(ams_net_id)
+        self._source = None
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._invoke_id = 0
+        self._pending = dict()
+        self._notifications = dict()
+        # The newest sample of handles whose notification arrived before add_notification() registered them
+        self._unclaimed = dict()
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def connect(self):
+        """
+        Opens the TCP connection to the AMS router of the target.
+        """
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.ip_address, self.tcp_port), self.timeout)
+        sock = self._writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.source_net_id is None:
+            self.source_net_id = self._writer.get_extra_info("sockname")[0] + ".1.1"
+        self._source = net_id_bytes(self.source_net_id)
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_frames())
+
+    async def close(self):
+        """
+        Closes the connection. Requests in flight fail with ConnectionError.
+        """
+        writer = self._writer
+        self._writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending(ConnectionError("The ADS connection was closed"))
+        self._notifications = dict()
+        self._unclaimed = dict()
+
+    def _fail_pending(self, error):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending = dict()
+
+    async def _read_frames(self):
+        """
+        Receives frames until the connection closes, and hands them to the waiting requests by invoke ID.
+        """
+        try:
+            while True:
+                _, length = _TCP_HEADER.unpack(await self._reader.readexactly(_TCP_HEADER.size))
+                frame = memoryview(await self._reader.readexactly(length))
+                (_, _, _, port, command, _, data_length, error, invoke_id) = _AMS_HEADER.unpack_from(frame, 0)
+                data = frame[_AMS_HEADER.size:_AMS_HEADER.size + data_length]
+                if command == ADSCOMMAND_DEVICENOTE:
+                    self._dispatch_notification(port, data)
+                    continue
+                future = self._pending.pop(invoke_id, None)
+                if future is None or future.done():
+                    continue
+                if error:
+                    future.set_exception(AdsError(error))
+                else:
+                    future.set_result(data)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            self._writer = None
+            self._fail_pending(ConnectionError(f"The ADS connection was lost: {e!r}"))
+
+    def _next_invoke_id(self):
+        self._invoke_id = self._invoke_id % 0xFFFFFFFF + 1
+        return self._invoke_id
+
+    async def request(self, port : int, command : int, payload : bytes = b""):
+        """
+        Sends a request and waits for its response, while other requests can be in flight.
+
+        Returns:
+            memoryview: The data of the response, a view of the received frame.
+
+        """
+        if self._writer is None:
+            raise ConnectionError("The ADS connection is not open")
+        invoke_id = self._next_invoke_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[invoke_id] = future
+        header = _AMS_HEADER.pack(self._target, port, self._source, self.source_port, command, STATE_REQUEST,
+                                  len(payload), 0, invoke_id)
+        self._writer.writelines((_TCP_HEADER.pack(0, len(header) + len(payload)), header, payload))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise AdsError(0x745, f"no response to command {command} on port {port}") from None
+        finally:
+            self._pending.pop(invoke_id, None)
+
+    ####################################
+    # ADS services
+    ####################################
+
+    async def read_state(self, port : int):
+        """
+        Returns the ADS state and the device state of a port.
+        """
+        data = await self.request(port, ADSCOMMAND_READSTATE)
+        result, ads_state, device_state = _STATE.unpack_from(data)
+        if result:
+            raise AdsError(result)
+        return ads_state, device_state
+
+    async def read(self, port : int, index_group : int, index_offset : int, length : int):
+        """
+        Reads length bytes.
+
+        Returns:
+            memoryview: The bytes, a view of the received frame.
+
+        """
+        data = await self.request(port, ADSCOMMAND_READ, _READ.pack(index_group, index_offset, length))
+        result, read_length = _RESULT_LENGTH.unpack_from(data)
+        if result:
+            raise AdsError(result, f"read of {index_group:#x}:{index_offset:#x}")
+        return data[_RESULT_LENGTH.size:_RESULT_LENGTH.size + read_length]
+
+    async def write(self, port : int, index_group : int, index_offset : int, data : bytes):
+        payload = _WRITE.pack(index_group, index_offset, len(data)) + bytes(data)
+        result = _RESULT.unpack_from(await self.request(port, ADSCOMMAND_WRITE, payload))[0]
+        if result:
+            raise AdsError(result, f"write of {index_group:#x}:{index_offset:#x}")
+
+    async def read_write(self, port : int, index_group : int, index_offset : int, read_length : int, data : bytes):
+        """
+        Writes data and reads up to read_length bytes in one request.
+
+        Returns:
+            memoryview: The bytes read, a view of the received frame.
+
+        """
+        payload = _READ_WRITE.pack(index_group, index_offset, read_length, len(data)) + bytes(data)
+        response = await self.request(port, ADSCOMMAND_READWRITE, payload)
+        result, length = _RESULT_LENGTH.unpack_from(response)
+        if result:
+            raise AdsError(result, f"read/write of {index_group:#x}:{index_offset:#x}")
+        return response[_RESULT_LENGTH.size:_RESULT_LENGTH.size + length]
+
+    async def sum_read(self, port : int, items : list):
+        """
+        Reads several memory areas in one request.
+
+        Args:
+            items (list[tuple[int, int, int]]): (index group, index offset, length) of each area.
+
+        Returns:
+            list: The bytes of each area as a memoryview of the received frame, or an AdsError if it failed.
+
+        """
+        payload = b"".join(_SUM_ITEM.pack(*item) for item in items)
+        read_length = _RESULT.size * len(items) + sum(length for _, _, length in items)
+        data = await self.read_write(port, ADSIGRP_SUMUP_READ, len(items), read_length, payload)
+        results = []
+        offset = _RESULT.size * len(items)
+        for i, (_, _, length) in enumerate(items):
+            error = _RESULT.unpack_from(data, i * _RESULT.size)[0]
+            results.append(AdsError(error) if error else data[offset:offset + length])
+            offset += length
+        return results
+
+    async def sum_write(self, port : int, items : list):
+        """
+        Writes several memory areas in one request.
+
+        Args:
+            items (list[tuple[int, int, bytes]]): (index group, index offset, data) of each area.
+
+        Returns:
+            list[int]: The ADS error code of each area, 0 if it was written.
+
+        """
+        headers = b"".join(_SUM_ITEM.pack(index_group, index_offset, len(data)) for index_group, index_offset, data in items)
+        payload = headers + b"".join(bytes(data) for _, _, data in items)
+        data = await self.read_write(port, ADSIGRP_SUMUP_WRITE, len(items), _RESULT.size * len(items), payload)
+        return [_RESULT.unpack_from(data, i * _RESULT.size)[0] for i in range(len(items))]
+
+    async def sum_read_write(self, port : int, items : list):
+        """
+        Runs several read-write commands in one request. A sub-command with read length 0 is a write, and one
+        without data is a read, so writes and reads can share the request.
+
+        Args:
+            items (list[tuple[int, int, int, bytes]]): (index group, index offset, read length, data) of each command.
+
+        Returns:
+            list: The bytes read by each command as a memoryview of the received frame, or an AdsError if it failed.
+
+        """
+        headers = b"".join(_READ_WRITE.pack(index_group, index_offset, read_length, len(data))
+                           for index_group, index_offset, read_length, data in items)
+        payload = headers + b"".join(bytes(data) for _, _, _, data in items)
+        read_length = _RESULT_LENGTH.size * len(items) + sum(read_length for _, _, read_length, _ in items)
+        data = await self.read_write(port, ADSIGRP_SUMUP_READWRITE, len(items), read_length, payload)
+        results = []
+        offset = _RESULT_LENGTH.size * len(items)
+        for i in range(len(items)):
+            error, length = _RESULT_LENGTH.unpack_from(data, i * _RESULT_LENGTH.size)
+            results.append(AdsError(error) if error else data[offset:offset + length])
+            offset += length
+        return results
+
+    async def add_notification(self, port : int, index_group : int, index_offset : int, length : int, callback,
+                               mode : int = ADSTRANS_SERVERONCHA, max_delay_ms : int = 0, cycle_time_ms : int = 0):
+        """
+        Asks the device to send a memory area when it changes, or cyclically.
+
+        Args:
+            callback (Callable[[int, int, memoryview], None]): Called on the event loop as
+                callback(handle, timestamp, data), with the FILETIME timestamp of the device.
+            mode (int, optional): ADSTRANS_SERVERONCHA or ADSTRANS_SERVERCYCLE.
+            max_delay_ms (int, optional): The longest time the device may collect changes before sending them.
+            cycle_time_ms (int, optional): The interval in which the device checks the area.
+
+        Returns:
+            int: The notification handle.
+
+        """
+        payload = _ADD_NOTIFICATION.pack(index_group, index_offset, length, mode, max_delay_ms, cycle_time_ms)
+        result, handle = _RESULT_LENGTH.unpack_from(await self.request(port, ADSCOMMAND_ADDDEVICENOTE, payload))
+        if result:
+            raise AdsError(result, f"notification of {index_group:#x}:{index_offset:#x}")
+        self._notifications[(port, handle)] = callback
+        # The device sends the current value right away, which may have been received before the response was handled
+        sample = self._unclaimed.pop((port, handle), None)
+        if sample is not None:
+            self._notify(callback, handle, *sample)
+        return handle
+
+    async def delete_notification(self, port : int, handle : int):
+        self._notifications.pop((port, handle), None)
+        self._unclaimed.pop((port, handle), None)
+        result = _RESULT.unpack_from(await self.request(port, ADSCOMMAND_DELDEVICENOTE, _RESULT.pack(handle)))[0]
+        if result:
+            raise AdsError(result, f"notification handle {handle}")
+
+    def _dispatch_notification(self, port, data):
+        _, stamps = _NOTIFICATION_HEADER.unpack_from(data)
+        offset = _NOTIFICATION_HEADER.size
+        for _ in range(stamps):
+            timestamp, samples = _STAMP_HEADER.unpack_from(data, offset)
+            offset += _STAMP_HEADER.size
+            for _ in range(samples):
+                handle, size = _SAMPLE_HEADER.unpack_from(data, offset)
+                offset += _SAMPLE_HEADER.size
+                callback = self._notifications.get((port, handle))
+                if callback is not None:
+                    self._notify(callback, handle, timestamp, data[offset:offset + size])
+                else:
+                    self._unclaimed[(port, handle)] = (timestamp, data[offset:offset + size])
+                offset += size
+
+    def _notify(self, callback, handle, timestamp, data):
+        # An exception must not end the reader task
+        try:
+            callback(handle, timestamp, data)
+        except Exception as e:
+            _log_error(f"Beckhoff Bridge notification callback raised an exception: {e}")
+
+
+class SyncAmsClient():
+    """
+    Runs an AmsClient on an event loop in a background thread, for synchronous callers such as AdsDriver.
+    The callers block until their request is answered, while the requests of other threads stay in flight.
+
+    Args: See AmsClient.
+    """
+
+    def __init__(self, ams_net_id : str, **options):
+        self.client = AmsClient(ams_net_id, **options)
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="BeckhoffBridgeAms", daemon=True)
+            self._thread.start()
+        try:
+            self.run(self.client.connect())
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            loop = self._loop
+            self._loop = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.close(), loop).result(self.client.timeout)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+        self._thread = None
+
+    @property
+    def connected(self):
+        return self._loop is not None and self.client.connected
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the event loop of the client, and returns its result.
+        """
+        loop = self._loop
+        if loop is None:
+            coroutine.close()
+            raise ConnectionError("The ADS connection is not open")
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    def connection(self, port : int):
+        """
+        Returns an AmsConnection to a port of the target, on this client's TCP connection.
+        """
+        return AmsConnection(self.client.ams_net_id, port, client=self)
+
+
+def _chunks(items):
+    return [items[start:start + MAX_SUM_ITEMS] for start in range(0, len(items), MAX_SUM_ITEMS)]
+
+
+class AmsConnection():
+    """
+    A connection to one ADS port with the methods of pyads.Connection that AdsDriver uses, on top of an AmsClient.
+
+    Symbols are looked up once, in sum read-write commands, and cached. Every read and write by name is pipelined
+    with a read of the symbol version, so the cache is dropped and the request repeated after an online change,
+    without an extra round trip. The sub-commands of large sum commands are sent as concurrent requests.
+
+    exchange() writes and reads in one sum read-write command. Targets that do not accept read-write commands on
+    PLC memory get a sum write and a sum read instead, sent back to back, which still costs one round trip.
+
+    Args:
+        ams_net_id (str): The AMS Net ID of the target device.
+        port (int, optional): The ADS port.
+        client (SyncAmsClient, optional): The client to share. By default the connection opens its own.
+        **options: The options of a new AmsClient.
+
+    """
+
+    def __init__(self, ams_net_id : str, port : int = 851, client : SyncAmsClient = None, **options):
+        self.ams_net_id = ams_net_id
+        self.port = port
+        self._owns_client = client is None
+        self._client = client if client is not None else SyncAmsClient(ams_net_id, **options)
+        self._symbols = dict()
+        self._symbol_version = None
+        self._notification_handles = dict()
+        self._combined_writes = True
+
+    def open(self):
+        self._client.open()
+
+    def close(self):
+        self._symbols = dict()
+        self._symbol_version = None
+        if self._owns_client:
+            self._client.close()
+
+    @property
+    def is_open(self):
+        return self._client.connected
+
+    def read_state(self):
+        return self._client.run(self._client.client.read_state(self.port))
+
+    def read(self, index_group : int, index_offset : int, plc_datatype, return_ctypes : bool = False):
+        """
+        Reads a value of a ctypes type, like pyads.Connection.read().
+        """
+        data = self._client.run(self._client.client.read(self.port, index_group, index_offset, ctypes.sizeof(plc_datatype)))
+        value = plc_datatype.from_buffer_copy(data)
+        if return_ctypes or not hasattr(value, "value"):
+            return value
+        return value.value
+
+    def write(self, index_group : int, index_offset : int, value, plc_datatype):
+        """
+        Writes a value of a ctypes type, like pyads.Connection.write().
+        """
+        if not isinstance(value, (ctypes._SimpleCData, ctypes.Array, ctypes.Structure)):
+            value = plc_datatype(value)
+        self._client.run(self._client.client.write(self.port, index_group, index_offset, bytes(value)))
+
+    def get_symbol(self, name : str):
+        """
+        Returns the symbol table entry of a variable.
+        """
+        return self._client.run(self._resolve([name]))[name]
+
+    def get_all_symbols(self):
+        """
+        Uploads the symbol table.
+
+        Returns:
+            list[AmsSymbol]: Every symbol of the port.
+
+        """
+        return self._client.run(self._upload_symbols())
+
+    def read_list_by_name(self, names : list, structure_defs : dict = None):
+        """
+        Reads variables by name in sum reads, like pyads.Connection.read_list_by_name().
+        Structures are read as raw bytes: structure definitions are not supported.
+
+        Returns:
+            dict: The values keyed by name.
+
+        """
+        if structure_defs:
+            raise ValueError("Structure definitions are only supported by the pyads backend")
+        return self._client.run(self._exchange(dict(), list(names)))[0]
+
+    def write_list_by_name(self, data : dict):
+        """
+        Writes variables by name in sum writes, like pyads.Connection.write_list_by_name().
+        """
+        _, error = self._client.run(self._exchange(data, []))
+        if error is not None:
+            raise error
+
+    def exchange(self, data : dict, names : list, structure_defs : dict = None):
+        """
+        Writes variables and then reads variables, by name, in one round trip.
+
+        Args:
+            data (dict): The values to write. May be empty.
+            names (list[str]): The variables to read. May be empty.
+            structure_defs (dict, optional): Not supported, as in read_list_by_name().
+
+        Returns:
+            tuple[dict, AdsError]: The values read keyed by name, and the error of the first variable that could
+            not be written, or None. A failed write does not fail the read.
+
+        """
+        if structure_defs:
+            raise ValueError("Structure definitions are only supported by the pyads backend")
+        return self._client.run(self._exchange(data, list(names)))
+
+    def add_notification(self, name : str, callback, cycle_time_ms : int = 0, max_delay_ms : int = 0):
+        """
+        Asks the PLC to send a variable whenever it changes.
+
+        Args:
+            name (str): The variable name.
+            callback (Callable[[str, int, object], None]): Called as callback(name, timestamp, value) on the
+                thread of the client, with the FILETIME timestamp of the PLC. It must return quickly.
+            cycle_time_ms (int, optional): The interval in which the PLC checks for changes.
+            max_delay_ms (int, optional): The longest time the PLC may collect changes before sending them.
+
+        Returns:
+            int: The notification handle.
+
+        """
+        return self._client.run(self._add_notification(name, callback, cycle_time_ms, max_delay_ms))
+
+    def del_notification(self, handle : int):
+        self._notification_handles.pop(handle, None)
+        self._client.run(self._client.client.delete_notification(self.port, handle))
+
+    ####################################
+    # Coroutines, run on the event loop of the client
+    ####################################
+
+    async def _resolve(self, names : list, errors : dict = None):
+        """
+        Returns the symbols of names, looking up the missing ones with concurrent requests.
+
+        Args:
+            names (list[str]): The variable names.
+            errors (dict, optional): If given, names that cannot be looked up are left out and their AdsError is
+                stored here, instead of raising the first one.
+
+        """
+        missing = [name for name in dict.fromkeys(names) if name not in self._symbols]
+        if missing:
+            client = self._client.client
+            chunks = [missing[start:start + MAX_SUM_ITEMS] for start in range(0, len(missing), MAX_SUM_ITEMS)]
+            results = await asyncio.gather(*(client.sum_read_write(self.port, [(ADSIGRP_SYM_INFOBYNAMEEX, 0, MAX_SYMBOL_ENTRY, name.encode(STRING_ENCODING) + b"\0")
+                                                                            for name in chunk]) for chunk in chunks))
+            for chunk, chunk_results in zip(chunks, results):
+                for name, result in zip(chunk, chunk_results):
+                    if isinstance(result, AdsError):
+                        if errors is None:
+                            raise AdsError(result.err_code, name)
+                        errors[name] = AdsError(result.err_code, name)
+                        continue
+                    self._symbols[name] = AmsSymbol.unpack_from(result)[0]
+        return {name: self._symbols[name] for name in names if name in self._symbols}
+
+    async def _upload_symbols(self):
+        client = self._client.client
+        info = await client.read(self.port, ADSIGRP_SYM_UPLOADINFO2, 0, _UPLOAD_INFO.size)
+        count, size = _UPLOAD_INFO.unpack_from(info)[:2]
+        data = await client.read(self.port, ADSIGRP_SYM_UPLOAD, 0, size)
+        symbols = []
+        offset = 0
+        for _ in range(count):
+            symbol, length = AmsSymbol.unpack_from(data, offset)
+            symbols.append(symbol)
+            offset += length
+        return symbols
+
+    async def _read_version(self):
+        return (await self._client.client.read(self.port, ADSIGRP_SYM_VERSION, 0, 1))[0]
+
+    def _update_version(self, version : int):
+        """
+        Records the symbol version, and forgets the symbols if it changed since the last one, since an online change
+        may have moved the variables. Returns True if it changed.
+        """
+        if version == self._symbol_version:
+            return False
+        changed = self._symbol_version is not None
+        self._symbol_version = version
+        if changed:
+            self._symbols = dict()
+        return changed
+
+    async def _exchange(self, data : dict, names : list, retry : bool = True):
+        client = self._client.client
+        if data:
+            # Writes land at the addresses they were looked up at, so an online change has to be seen before they
+            # are sent, instead of with them. Cycles without writes keep the version read in their round trip.
+            self._update_version(await self._read_version())
+        # Resolve each write apart from the reads and the other writes, so an unknown variable only fails itself
+        write_errors = dict()
+        write_symbols, symbols = await asyncio.gather(self._resolve(list(data), write_errors), self._resolve(names))
+        write_names = [name for name in data if name in write_symbols]
+        write_error = next(iter(write_errors.values()), None)
+        writes = [(write_symbols[name].index_group, write_symbols[name].index_offset, write_symbols[name].codec.encode(data[name]))
+                  for name in write_names]
+        reads = [(symbols[name].index_group, symbols[name].index_offset, symbols[name].size) for name in names]
+
+        # The AMS router serves the requests of a port in order, so the writes land before the reads
+        combined = self._combined_writes and len(writes) > 0
+        if combined:
+            items = [(index_group, index_offset, 0, value) for index_group, index_offset, value in writes]
+            items += [(index_group, index_offset, length, b"") for index_group, index_offset, length in reads]
+            requests = [client.sum_read_write(self.port, chunk) for chunk in _chunks(items)]
+        else:
+            requests = [client.sum_write(self.port, chunk) for chunk in _chunks(writes)]
+            requests += [client.sum_read(self.port, chunk) for chunk in _chunks(reads)]
+        if not data:
+            requests.insert(0, self._read_version())
+        try:
+            results = await asyncio.gather(*requests)
+        except AdsError as e:
+            if not combined or e.err_code != ADSERR_DEVICE_SRVNOTSUPP:
+                raise
+            self._combined_writes = False
+            return await self._exchange(data, names, retry)
+
+        if not data and self._update_version(results.pop(0)) and retry:
+            # An online change may have moved the variables, so look them up again and repeat the reads
+            return await self._exchange(data, names, retry=False)
+
+        if combined:
+            results = [result for chunk_results in results for result in chunk_results]
+            write_results = [result.err_code if isinstance(result, AdsError) else 0 for result in results[:len(writes)]]
+            read_results = results[len(writes):]
+            if ADSERR_DEVICE_SRVNOTSUPP in write_results:
+                # The target does not write through read-write commands
+                self._combined_writes = False
+                return await self._exchange(data, names, retry)
+        else:
+            write_chunks = len(_chunks(writes))
+            write_results = [error for chunk_results in results[:write_chunks] for error in chunk_results]
+            read_results = [result for chunk_results in results[write_chunks:] for result in chunk_results]
+
+        for name, error in zip(write_names, write_results):
+            if error and write_error is None:
+                write_error = AdsError(error, name)
+        values = dict()
+        for name, result in zip(names, read_results):
+            if isinstance(result, AdsError):
+                raise AdsError(result.err_code, name)
+            values[name] = symbols[name].codec.decode(result)
+        return values, write_error
+
+    async def _add_notification(self, name, callback, cycle_time_ms, max_delay_ms):
+        symbol = (await self._resolve([name]))[name]
+        codec = symbol.codec
+
+        def on_notification(handle, timestamp, data):
+            callback(name, timestamp, codec.decode(data))
+
+        handle = await self._client.client.add_notification(self.port, symbol.index_group, symbol.index_offset, symbol.size,
+                                                            on_notification, ADSTRANS_SERVERONCHA, max_delay_ms, cycle_time_ms)
+        self._notification_handles[handle] = name
+        return handle
@@ -0,0 +1,1065 @@
+'''
+  File: **bridge_service.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import threading
+from threading import RLock
+import time
+
+from .adaptive_rate import AdaptiveRate
+from .ads_driver import AdsDriver, PYADS_BACKEND
+from .dispatcher import Dispatcher, LATEST, DROP_OLDEST
+from .events import BridgeEvent, EVENT_TYPE_DATA_READ, EVENT_TYPE_DATA_READ_REQ, EVENT_TYPE_DATA_WRITE_REQ, EVENT_TYPE_DATA_INIT, EVENT_TYPE_DATA_STREAM, EVENT_TYPE_DATA_GROUP
+from .flat_data import FlatSnapshot, ReadIndex, SnapshotSubset, snapshot_changed
+from .global_variables import EXTENSION_NAME
+from .interpolation import Interpolator, LINEAR, DEFAULT_MAX_EXTRAPOLATION
+from .latency_probe import CycleTiming, LatencyProbe
+from .tracer import get_tracer
+from .trigger import TriggeredGroup, RISING_EDGE, DEFAULT_RETRY_INTERVAL
+
+class Settings():
+    """
+    Persistent settings of the bridge.
+
+    Inside Kit the values are stored in carb.settings under /persistent/loupe.simulation.beckhoff_bridge/, so they
+    can also be given on the command line of headless jobs. In plain Python they are kept in a dictionary.
+
+    Args:
+        values (dict, optional): Initial values, which take precedence over stored ones. {'ENABLE_COMMUNICATION': True}
+        persistent (bool, optional): Set to False to keep the values in a dictionary even inside Kit.
+
+    """
+
+    def __init__(self, values : dict = None, persistent : bool = True):
+        self._interface = None
+        if persistent:
+            try:
+                from carb.settings import get_settings
+                self._interface = get_settings()
+            except ImportError:
+                pass
+        self._values = dict()
+        for name, value in (values or {}).items():
+            self.set(name, value)
+
+    def _path(self, name):
+        return "/persistent/" + EXTENSION_NAME + "/" + name
+
+    def get(self, name : str, default_value = None):
+        """
+        Returns a setting, storing default_value first if the setting does not exist yet.
+        """
+        if self._interface is None:
+            return self._values.setdefault(name, default_value)
+        setting = self._interface.get(self._path(name))
+        if setting is None:
+            setting = default_value
+            self._interface.set(self._path(name), setting)
+        return setting
+
+    def set(self, name : str, value):
+        if self._interface is None:
+            self._values[name] = value
+        else:
+            self._interface.set(self._path(name), value)
+
+
+class _Subscription():
+    """
+    Handle returned by the subscribe functions of BridgeService.
+    """
+
+    __slots__ = ("_subscribers", "_callback")
+
+    def __init__(self, subscribers : list, callback):
+        self._subscribers = subscribers
+        self._callback = callback
+        subscribers.append(callback)
+
+    def unsubscribe(self):
+        if self._callback in self._subscribers:
+            self._subscribers.remove(self._callback)
+
+
+class BridgeService():
+    """
+    The communication engine of the bridge: settings, connection state, the read list, the write queue and the
+    I/O thread. It has no UI, so it runs the same in the Kit UI, in headless Kit, and in plain Python.
+
+    The I/O thread is only created once the service is started, communication is enabled, and there is something
+    to read or write. While any of those stop being true, it blocks without waking until they change again.
+
+    Read data is handed to subscribers through a Dispatcher, so subscriber callbacks run on their own threads and
+    never stretch the I/O cycle.
+
+    Inside Kit the service also serves the message bus requests of BeckhoffBridge.Manager and publishes the data
+    there. In plain Python, subscribe through subscribe_init()/subscribe_data(), or construct a Manager with the
+    service.
+
+    Args:
+        settings (Settings, optional): The settings to use. By default the persistent extension settings.
+        driver (optional): The driver to use. By default an AdsDriver for the PLC_AMS_NET_ID and PLC_PORT settings,
+            or a ProcessDriver that runs it in a worker process if the WORKER_PROCESS setting is True. The ADS_BACKEND
+            setting selects "pyads" or the pure-Python "asyncio" client, which connects to PLC_IP_ADDRESS if it is set.
+        message_bus (bool, optional): Set to False to not serve or publish on the Kit message bus.
+
+    e.g.
+        service = BridgeService(Settings({'PLC_AMS_NET_ID': '5.80.201.232.1.1', 'ENABLE_COMMUNICATION': True}))
+        service.add_read_variables(['MAIN.custom_struct.var1'])
+        service.subscribe_data(lambda event: print(event.payload['data']))
+        service.start()
+
+    """
+
+    def __init__(self, settings : Settings = None, driver = None, message_bus : bool = True):
+        self.settings = settings if settings is not None else Settings()
+
+        # Internal status flags.
+        self._thread = None
+        self._thread_is_alive = False
+        self._started = False
+        self._has_reads = False
+        self._communication_initialized = False
+
+        # Wakes the I/O thread when there is work, and ends its sleep when it is stopped
+        # (or, with the adaptive rate, when there is something to write)
+        self._wake = threading.Condition()
+        self._stop_event = threading.Event()
+
+        # Configuration parameters
+        self._enable_communication = self.settings.get( 'ENABLE_COMMUNICATION', False )
+        self._refresh_rate = self.settings.get( 'REFRESH_RATE', 20 )
+
+        # Optional adaptive refresh rate, and the rate and cost of the last cycle in milliseconds
+        self._adaptive_rate = None
+        self._paused = False
+        self._effective_rate = self._refresh_rate
+        self._cycle_cost = 0.0
+
+        backend = self.settings.get( 'ADS_BACKEND', PYADS_BACKEND )
+        backend_options = dict()
+        if self.settings.get( 'PLC_IP_ADDRESS', '' ):
+            backend_options['ip_address'] = self.settings.get( 'PLC_IP_ADDRESS', '' )
+        if driver is None and self.settings.get( 'WORKER_PROCESS', False ):
+            # Run ADS I/O and decoding in a separate process, away from the GIL of Kit
+            from .process_worker import ProcessDriver
+            driver = ProcessDriver(self.settings.get( 'PLC_AMS_NET_ID', '127.0.0.1.1.1'), self.settings.get( 'PLC_PORT', 851 ), self._refresh_rate/1000,
+                                   backend=backend, backend_options=backend_options)
+        elif driver is None:
+            driver = AdsDriver(self.settings.get( 'PLC_AMS_NET_ID', '127.0.0.1.1.1'), self.settings.get( 'PLC_PORT', 851 ), backend, backend_options)
+        self._ads_connector = driver
+        self.adaptive_rate = self.settings.get( 'ADAPTIVE_RATE', False )
+
+        # Optional timeline tracing of bridge cycles, exported in Chrome trace-event format
+        self._tracer = get_tracer()
+        self._tracer.capacity = self.settings.get( 'TRACE_CAPACITY', 100000 )
+        self._tracer.enabled = self.settings.get( 'TRACE_ENABLED', False )
+
+        # State published to the UI and subscribers
+        self._status = "Disabled"
+        self._status_hold_time = 0.0
+        # The nested dictionary and the snapshot it was built from, built on demand
+        self._data_cache = (None, dict())
+        self._snapshot = None
+        self._snapshot_time = 0.0
+        self._cycle_count = 0
+
+        # Opt-in per-variable history, created when the first variable is recorded
+        self._history = None
+        # The ReadIndex of the recorded variables that are read outside of the cyclic read list, or None
+        self._history_reads = None
+        self._history_retry_time = 0.0
+
+        # Timestamped samples of variables that are evaluated at frame time, created when the first one is added
+        self._interpolator = None
+
+        # PLC-side ring buffers read every cycle, keyed by stream name
+        self._streams = dict()
+        self._stream_dispatcher = Dispatcher()
+
+        # Groups of variables only read when their trigger fires, keyed by group name
+        self._groups = dict()
+        self._group_dispatcher = Dispatcher()
+
+        self.write_queue = dict()
+        # Block writes of array slices, as (name, values, offset) in the order they were queued
+        self.array_write_queue = list()
+        self.write_lock = RLock()
+
+        self._init_subscribers = list()
+        self._dispatcher = Dispatcher()
+        # Variable subsets of the subscribers that only receive some variables, keyed by their names.
+        # They are the dispatcher topics of those subscribers.
+        self._subsets = dict()
+
+        # Called on the I/O thread after every read, with the snapshot and the CycleTiming of the cycle
+        self._cycle_observers = list()
+        self._latency_probe = None
+
+        # Message bus, only available inside Kit
+        self._event_stream = None
+        if message_bus:
+            try:
+                import omni.kit.app
+                self._event_stream = omni.kit.app.get_app().get_message_bus_event_stream()
+            except ImportError:
+                pass
+
+        if self._event_stream is not None:
+            self.read_req = self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_READ_REQ, self.on_read_req_event)
+            self.write_req = self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_WRITE_REQ, self.on_write_req_event)
+            # Push subscriptions of the message bus run synchronously, so the data is pushed from a delivery thread
+            self._dispatcher.subscribe(self._push_data_event, name="message_bus")
+            self._group_dispatcher.subscribe(self._push_group_event, DROP_OLDEST, 64, name="message_bus")
+
+    ####################################
+    # Lifecycle
+    ####################################
+
+    def start(self):
+        """
+        Starts the service, and announces the bridge to init subscribers.
+        The I/O thread is started as soon as there is work for it.
+        """
+        self._started = True
+        self.push_init()
+        self._notify()
+
+    def stop(self):
+        """
+        Stops the I/O thread and waits for it to finish.
+        """
+        with self._wake:
+            self._started = False
+            self._thread_is_alive = False
+            self._stop_event.set()
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _has_work(self):
+        return self._enable_communication and (self._has_reads or bool(self.write_queue) or bool(self.array_write_queue))
+
+    def _notify(self):
+        """
+        Wakes the I/O thread after a change that may give it work, creating the thread if it does not exist yet.
+        """
+        with self._wake:
+            if not self._enable_communication:
+                self._set_status("Disabled")
+            elif not self._has_work():
+                self._set_status("Idle")
+
+            if self._started and self._has_work() and (self._thread is None or not self._thread.is_alive()):
+                self._thread_is_alive = True
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._update_plc_data, name="BeckhoffBridge", daemon=True)
+                self._thread.start()
+            self._wake.notify_all()
+
+    def cleanup(self):
+        """
+        Stops the I/O thread and removes the message bus subscriptions.
+        """
+        if self._event_stream is not None:
+            self.read_req.unsubscribe()
+            self.write_req.unsubscribe()
+        self.stop_latency_probe()
+        self.stop()
+        self._init_subscribers.clear()
+        self._dispatcher.close()
+        self._stream_dispatcher.close()
+        self._group_dispatcher.close()
+        if hasattr(self._ads_connector, 'close'):
+            self._ads_connector.close()
+
+    def push_init(self):
+        """
+        Sends the DATA_INIT event, so subscribers can (re)register their cyclic read variables.
+        """
+        event = BridgeEvent(EVENT_TYPE_DATA_INIT, {'data': {}})
+        for callback in list(self._init_subscribers):
+            callback(event)
+        if self._event_stream is not None:
+            self._event_stream.push(event_type=EVENT_TYPE_DATA_INIT, payload={'data': {}})
+
+    ####################################
+    # Configuration
+    ####################################
+
+    @property
+    def enable_communication(self):
+        return self._enable_communication
+
+    @enable_communication.setter
+    def enable_communication(self, enable : bool):
+        self._enable_communication = enable
+        if not enable:
+            self._communication_initialized = False
+            self._data_cache = (self._snapshot, dict())
+        self._notify()
+
+    @property
+    def refresh_rate(self):
+        """
+        The cycle time of the I/O thread in milliseconds.
+        """
+        return self._refresh_rate
+
+    @refresh_rate.setter
+    def refresh_rate(self, refresh_rate : int):
+        self._refresh_rate = refresh_rate
+        if hasattr(self._ads_connector, 'cycle_time'):
+            # A worker process reads on its own clock
+            self._ads_connector.cycle_time = refresh_rate/1000
+
+    @property
+    def adaptive_rate(self):
+        """
+        True if the refresh rate adapts to the cycle cost and the demand for data, instead of being fixed.
+        The limits and the budget are read from the ADAPTIVE_MIN_RATE, ADAPTIVE_MAX_RATE and ADAPTIVE_BUDGET settings.
+        """
+        return self._adaptive_rate is not None
+
+    @adaptive_rate.setter
+    def adaptive_rate(self, enable : bool):
+        if enable and self._adaptive_rate is None:
+            self._adaptive_rate = AdaptiveRate(self.settings.get( 'ADAPTIVE_MIN_RATE', 10 ),
+                                               self.settings.get( 'ADAPTIVE_MAX_RATE', 1000 ),
+                                               self.settings.get( 'ADAPTIVE_BUDGET', 0.25 ))
+        elif not enable:
+            self._adaptive_rate = None
+            self._effective_rate = self._refresh_rate
+            if hasattr(self._ads_connector, 'cycle_time'):
+                self._ads_connector.cycle_time = self._refresh_rate/1000
+
+    @property
+    def paused(self):
+        """
+        True while the scene is paused. With the adaptive rate, the bridge then reads at its slowest rate.
+        """
+        return self._paused
+
+    @paused.setter
+    def paused(self, paused : bool):
+        self._paused = paused
+        if not paused and self._adaptive_rate is not None:
+            # Do not wait out a long paused cycle
+            self._stop_event.set()
+
+    @property
+    def ams_net_id(self):
+        return self._ads_connector.ams_net_id
+
+    @ams_net_id.setter
+    def ams_net_id(self, ams_net_id : str):
+        self._ads_connector.ams_net_id = ams_net_id
+        self._communication_initialized = False
+
+    @property
+    def tracer(self):
+        return self._tracer
+
+    def save_settings(self):
+        self.settings.set('REFRESH_RATE', self._refresh_rate)
+        self.settings.set('PLC_AMS_NET_ID', self._ads_connector.ams_net_id)
+        self.settings.set('ENABLE_COMMUNICATION', self._enable_communication)
+        self.settings.set('TRACE_ENABLED', self._tracer.enabled)
+        self.settings.set('ADAPTIVE_RATE', self.adaptive_rate)
+
+    def load_settings(self):
+        self.refresh_rate = self.settings.get('REFRESH_RATE')
+        self._ads_connector.ams_net_id = self.settings.get('PLC_AMS_NET_ID')
+        self._tracer.enabled = self.settings.get('TRACE_ENABLED', False)
+        self.adaptive_rate = False
+        self.adaptive_rate = self.settings.get('ADAPTIVE_RATE', False)
+        self._communication_initialized = False
+        self.enable_communication = self.settings.get('ENABLE_COMMUNICATION')
+
+    ####################################
+    # State
+    ####################################
+
+    @property
+    def status(self):
+        """
+        A human-readable connection status. "Disabled", "Idle", "Connected", "Attempting to connect...", or an error.
+        """
+        return self._status
+
+    @property
+    def data(self):
+        """
+        The nested dictionary of the last read cycle. It is only built when a full-data subscriber or a caller needs it.
+        """
+        snapshot = self._snapshot
+        built_from, data = self._data_cache
+        if snapshot is not None and snapshot is not built_from:
+            data = snapshot.to_dict()
+            self._data_cache = (snapshot, data)
+        return data
+
+    @property
+    def snapshot(self):
+        """
+        The FlatSnapshot of the last read cycle, or None if nothing has been read yet.
+        """
+        return self._snapshot
+
+    @property
+    def snapshot_time(self):
+        """
+        The time.time() at which the last snapshot was read.
+        """
+        return self._snapshot_time
+
+    @property
+    def history(self):
+        """
+        The History of recorded variables, or None if no variable is recorded.
+        """
+        return self._history
+
+    @property
+    def interpolator(self):
+        """
+        The Interpolator of the variables evaluated at frame time, or None if there are none.
+        """
+        return self._interpolator
+
+    @property
+    def effective_rate(self):
+        """
+        The refresh rate the I/O thread currently runs at in milliseconds. With the adaptive rate, this changes
+        from cycle to cycle; otherwise it is the refresh rate.
+        """
+        return self._effective_rate
+
+    @property
+    def cycle_cost(self):
+        """
+        The time the last I/O cycle took in milliseconds.
+        """
+        return self._cycle_cost
+
+    @property
+    def cycle_count(self):
+        """
+        The number of completed read cycles. Can be compared between polls to detect new data.
+        """
+        return self._cycle_count
+
+    ####################################
+    # Requests
+    ####################################
+
+    def subscribe_init(self, callback):
+        """
+        Subscribes an in-process callback to the DATA_INIT event.
+
+        Returns:
+            A subscription handle with an unsubscribe() method.
+
+        """
+        return _Subscription(self._init_subscribers, callback)
+
+    def subscribe_data(self, callback, policy : str = LATEST, depth : int = 1, variables : list = None):
+        """
+        Subscribes an in-process callback to the DATA_READ event. The callback runs on its own delivery thread.
+
+        With variables, the callback only receives those variables, and is skipped in the cycles in which none of
+        them changed. Each distinct set of variables is selected once per cycle, however many callbacks share it.
+
+        Args:
+            callback (Callable): Called with each delivered event.
+            policy (str, optional): dispatcher.LATEST to skip to the newest data when the callback falls behind,
+                or dispatcher.DROP_OLDEST to queue up to depth events and drop the oldest when the queue is full.
+            depth (int, optional): The queue depth for DROP_OLDEST.
+            variables (list[str], optional): The variable names or wildcard patterns to receive. They are added
+                to the cyclic read list. ["MAIN.axis[*].position", "MAIN.state"]
+
+        Returns:
+            Subscriber: A subscription handle with unsubscribe() and stats() methods.
+
+        """
+        if variables is None:
+            return self._dispatcher.subscribe(callback, policy, depth)
+
+        topic = tuple(variables)
+        subset = self._subsets.get(topic)
+        if subset is None:
+            # Drop the subsets whose subscribers are all gone, so churning subscribers do not pile them up
+            topics = self._dispatcher.topics()
+            subset = SnapshotSubset(topic)
+            self._subsets = {**{key: value for key, value in self._subsets.items() if key in topics}, topic: subset}
+        subscriber = self._dispatcher.subscribe(callback, policy, depth, topic=topic)
+        # Deliver the current values to the new subscriber in the next cycle, even if they do not change
+        subset.reset()
+        self.add_read_variables(list(topic))
+        return subscriber
+
+    def subscriber_stats(self):
+        """
+        Returns the delivery statistics of every data subscriber, including the message bus.
+
+        Returns:
+            list[dict]: See dispatcher.Subscriber.stats().
+
+        """
+        return self._dispatcher.stats()
+
+    def add_read_variables(self, variables : list):
+        """
+        Adds variables to the cyclic read list.
+        """
+        for name in variables:
+            self._ads_connector.add_read(name)
+        if variables:
+            self._has_reads = True
+            self._notify()
+
+    def queue_write(self, name : str, value):
+        """
+        Queues a variable to be written in the next cycle. Later values of the same variable replace earlier ones.
+        """
+        with self.write_lock:
+            self.write_queue[name] = value
+        self._wake_for_write()
+
+    def queue_writes(self, values : dict):
+        """
+        Queues several variables to be written in the next cycle, as one batch.
+
+        Args:
+            values (dict): Variable names and values. {'MAIN.sensors[0]': True, 'MAIN.sensors[1]': False}
+
+        """
+        if not values:
+            return
+        with self.write_lock:
+            self.write_queue.update(values)
+        self._wake_for_write()
+
+    def queue_array_write(self, name : str, values, offset : int = 0):
+        """
+        Queues a slice of a PLC array to be written in the next cycle, as one block write.
+        Array writes run before the variable writes of the same cycle, so a flag written after a table is
+        only set once the table is complete.
+
+        Args:
+            name (str): The array name. "MAIN.trajectory"
+            values (numpy.ndarray): The elements, with the dtype of the PLC elements. They are copied.
+            offset (int, optional): The position of the first written element.
+
+        """
+        import numpy as np
+        values = np.array(values, copy=True)
+        with self.write_lock:
+            self.array_write_queue.append((name, values, offset))
+        self._wake_for_write()
+
+    def add_history(self, variables : list, depth : int = 1000, decimation : int = 1, cyclic : bool = True):
+        """
+        Starts recording the values of variables into fixed-size ring buffers, and adds them to the cyclic read list.
+
+        Args:
+            variables (list[str]): Flat names of numeric or boolean variables. ["MAIN.axis[0].position"]
+            depth (int, optional): The number of samples kept per variable.
+            decimation (int, optional): Only every n-th read cycle is recorded.
+            cyclic (bool, optional): If False, the variables are not added to the cyclic read list, but read in a
+                request of their own after every cycle until remove_history(). A variable that does not exist then
+                only fails its own history, e.g. a name typed into the Trend field.
+
+        """
+        if self._history is None:
+            # NumPy is only needed once history is used
+            from .history import History
+            self._history = History()
+        for name in variables:
+            self._history.add(name, depth, decimation)
+        if cyclic:
+            self.add_read_variables(variables)
+            return
+        names = list(self._history_reads.names) if self._history_reads is not None else []
+        names.extend(name for name in variables if name not in names)
+        self._history_reads = ReadIndex(names)
+        self._history_retry_time = 0.0
+        if not self._has_reads:
+            self._has_reads = True
+            self._notify()
+
+    def remove_history(self, variables : list):
+        """
+        Stops recording variables and frees their samples. Variables added with cyclic=False are no longer read,
+        those in the cyclic read list keep being read.
+
+        Args:
+            variables (list[str]): Flat variable names.
+
+        """
+        if self._history is None:
+            return
+        for name in variables:
+            self._history.remove(name)
+        if self._history_reads is not None:
+            names = [name for name in self._history_reads.names if name not in variables]
+            self._history_reads = ReadIndex(names) if names else None
+
+    def get_history(self, name : str, window : float = None):
+        """
+        Returns the recorded samples of a variable.
+
+        Args:
+            name (str): The flat variable name.
+            window (float, optional): Only return the samples of the last window seconds.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: The timestamps (time.time()) and the values, oldest first.
+
+        Raises:
+            KeyError: If the variable is not recorded.
+
+        """
+        if self._history is None:
+            raise KeyError(name)
+        return self._history.get(name, window)
+
+    def add_interpolation(self, variables : list, mode : str = LINEAR, max_extrapolation : float = DEFAULT_MAX_EXTRAPOLATION):
+        """
+        Starts keeping the newest timestamped samples of variables, so they can be evaluated at frame time with
+        get_interpolated(), and adds them to the cyclic read list.
+
+        Args:
+            variables (list[str]): Flat variable names. ["MAIN.axis[0].position"]
+            mode (str, optional): LINEAR or HOLD.
+            max_extrapolation (float, optional): The longest time past the newest sample that LINEAR values are extrapolated.
+
+        """
+        if self._interpolator is None:
+            self._interpolator = Interpolator()
+        for name in variables:
+            self._interpolator.add(name, mode, max_extrapolation)
+        self.add_read_variables(variables)
+
+    def get_interpolated(self, names : list, frame_time : float = None, delay : float = None):
+        """
+        Returns the values of variables at the time of a frame, between or shortly after the read cycles.
+
+        Args:
+            names (list[str]): Flat variable names added with add_interpolation().
+            frame_time (float, optional): The time.time() of the frame. By default, now.
+            delay (float, optional): How far in the past the values are evaluated, in seconds. By default one read
+                cycle, so frames fall between two samples instead of past the newest one.
+
+        Returns:
+            dict: The values keyed by name. Variables that were not read yet are None.
+
+        Raises:
+            KeyError: If a variable was not added.
+
+        """
+        if self._interpolator is None:
+            raise KeyError(names[0] if names else None)
+        if frame_time is None:
+            frame_time = time.time()
+        if delay is None:
+            delay = self._effective_rate / 1000
+        return self._interpolator.sample(names, frame_time - delay)
+
+    def add_stream(self, name : str, buffer : str, counter : str, dtype, time_field : str = None, time_format : str = "filetime"):
+        """
+        Starts reading a ring buffer that the PLC fills faster than the bridge polls. See stream.StreamReader.
+
+        Args:
+            name (str): The name of the stream, used in the events.
+            buffer (str): The name of the one-dimensional array on the PLC. "MAIN.buffer"
+            counter (str): The name of the UDINT write counter on the PLC. "MAIN.count"
+            dtype (numpy.dtype): The layout of one array element.
+            time_field (str, optional): The field of dtype that holds the PLC timestamp.
+            time_format (str, optional): "filetime" or "dc".
+
+        """
+        # NumPy is only needed once streams are used
+        from .stream import StreamReader
+        self._streams[name] = StreamReader(name, buffer, counter, dtype, time_field, time_format)
+        self.add_read_variables([counter])
+
+    def subscribe_stream(self, callback, depth : int = 64):
+        """
+        Subscribes an in-process callback to stream batches. The callback runs on its own delivery thread, with a
+        DROP_OLDEST queue, so batches are only dropped when depth of them are waiting.
+
+        The event payload is {'stream': name, 'batch': StreamBatch}.
+
+        Returns:
+            Subscriber: A subscription handle with unsubscribe() and stats() methods.
+
+        """
+        return self._stream_dispatcher.subscribe(callback, DROP_OLDEST, depth)
+
+    def add_triggered_group(self, name : str, trigger : str, variables : list, mode : str = RISING_EDGE):
+        """
+        Adds a group of variables that is only read when a trigger variable fires, instead of every cycle.
+        See trigger.TriggeredGroup. The trigger is added to the cyclic read list, the variables are not.
+
+        Args:
+            name (str): The name of the group, used in the events.
+            trigger (str): The name of the trigger variable on the PLC. "MAIN.recipe_ready"
+            variables (list[str]): The names of the variables to read. ["MAIN.recipe"]
+            mode (str, optional): trigger.RISING_EDGE or trigger.CHANGE.
+
+        """
+        self._groups = {**self._groups, name: TriggeredGroup(name, trigger, variables, mode)}
+        self.add_read_variables([trigger])
+
+    def remove_triggered_group(self, name : str):
+        """
+        Stops watching the trigger of a group. The trigger stays in the cyclic read list.
+        """
+        self._groups = {key: group for key, group in self._groups.items() if key != name}
+
+    def subscribe_groups(self, callback, depth : int = 16):
+        """
+        Subscribes an in-process callback to the reads of triggered groups. The callback runs on its own delivery
+        thread, with a DROP_OLDEST queue, so reads are only dropped when depth of them are waiting.
+
+        The event payload is {'group': name, 'trigger': value, 'data': {...}}, with the data in the nested form of
+        the DATA_READ events. Inside Kit, the same payload is pushed on the message bus as a DATA_GROUP event.
+
+        Returns:
+            Subscriber: A subscription handle with unsubscribe() and stats() methods.
+
+        """
+        return self._group_dispatcher.subscribe(callback, DROP_OLDEST, depth)
+
+    def add_cycle_observer(self, observer):
+        """
+        Adds a function that is called on the I/O thread after every read, as observer(snapshot, timing).
+        It must return quickly, as it delays the cycle.
+
+        Args:
+            observer (Callable[[FlatSnapshot, CycleTiming], None]): The function to call.
+
+        """
+        self._cycle_observers = self._cycle_observers + [observer]
+
+    def remove_cycle_observer(self, observer):
+        self._cycle_observers = [o for o in self._cycle_observers if o != observer]
+
+    @property
+    def latency_probe(self):
+        """
+        The LatencyProbe, or None if it was never started.
+        """
+        return self._latency_probe
+
+    def start_latency_probe(self, write_variable : str = None, echo_variable : str = None):
+        """
+        Starts measuring the round-trip latency through the PLC. See LatencyProbe.
+
+        Args:
+            write_variable (str, optional): The DINT variable the tokens are written to.
+                Defaults to the LATENCY_PROBE_WRITE_VARIABLE setting.
+            echo_variable (str, optional): The variable the PLC copies the token to.
+                Defaults to the LATENCY_PROBE_ECHO_VARIABLE setting, or write_variable.
+
+        Returns:
+            LatencyProbe: The running probe.
+
+        """
+        write_variable = write_variable or self.settings.get('LATENCY_PROBE_WRITE_VARIABLE', '')
+        echo_variable = echo_variable or self.settings.get('LATENCY_PROBE_ECHO_VARIABLE', '')
+        if not write_variable:
+            raise ValueError("The latency probe needs a variable to write to")
+        self.stop_latency_probe()
+        self._latency_probe = LatencyProbe(self, write_variable, echo_variable)
+        self._latency_probe.start()
+        return self._latency_probe
+
+    def stop_latency_probe(self):
+        if self._latency_probe is not None:
+            self._latency_probe.stop()
+
+    def _wake_for_write(self):
+        if not self._has_reads:
+            self._notify()
+        elif self._adaptive_rate is not None:
+            # The rate may have backed off while nothing changed, so write now instead of after the sleep
+            self._stop_event.set()
+
+    def on_read_req_event(self, event ):
+        event_data = event.payload
+        variables : list = event_data['variables']
+        self.add_read_variables(variables)
+
+    def on_write_req_event(self, event ):
+        variables = event.payload.get("variables", [])
+        self.queue_writes({variable['name']: variable['value'] for variable in variables})
+        arrays = event.payload.get("arrays", [])
+        if arrays:
+            import numpy as np
+            for array in arrays:
+                self.queue_array_write(array['name'], np.array(array['values'], dtype=array['dtype']), array['offset'])
+
+    ####################################
+    # I/O thread
+    ####################################
+
+    def _set_status(self, status : str):
+        self._status = status
+
+    def _report_error(self, message : str):
+        # Errors stay in the status for a second before the connection state replaces them
+        self._set_status(message)
+        self._status_hold_time = time.time() + 1
+
+    def _publish(self, snapshot, timestamp : float):
+        tracer = self._tracer
+        self._snapshot = snapshot
+        self._snapshot_time = timestamp
+        self._cycle_count += 1
+
+        if self._history is not None:
+            with tracer.span("history", "cycle"):
+                self._history.record(snapshot, timestamp)
+
+        if self._interpolator is not None:
+            self._interpolator.record(snapshot, timestamp)
+
+        with tracer.span("publish", "cycle"):
+            if len(self._dispatcher):
+                topics = self._dispatcher.topics()
+                if None in topics:
+                    # Only full-data subscribers, e.g. the message bus, need the whole nested dictionary
+                    with tracer.span("parse", "cycle", {"count": len(snapshot.values)}):
+                        data = snapshot.to_dict()
+                    self._data_cache = (snapshot, data)
+                    self._dispatcher.publish(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': data}))
+                for topic in topics:
+                    # The subset may be removed by an unsubscribe on another thread
+                    subset_selector = self._subsets.get(topic)
+                    if topic is None or subset_selector is None:
+                        continue
+                    subset = subset_selector.select(snapshot)
+                    if subset is not None:
+                        self._dispatcher.publish(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': subset.to_dict()}), topic)
+
+    def _update_rate(self, cost : float, changed : bool, wrote : bool):
+        self._cycle_cost = cost
+        adaptive_rate = self._adaptive_rate
+        if adaptive_rate is None:
+            self._effective_rate = self._refresh_rate
+            return
+        active = len(self._dispatcher) > 0 or bool(self._streams) or bool(self._groups)
+        rate = adaptive_rate.update(cost, (active and changed) or wrote, self._paused)
+        if rate != self._effective_rate:
+            self._effective_rate = rate
+            if hasattr(self._ads_connector, 'cycle_time'):
+                self._ads_connector.cycle_time = rate/1000
+
+    def _push_data_event(self, event):
+        self._event_stream.push(event_type=EVENT_TYPE_DATA_READ, payload=event.payload)
+
+    def _push_group_event(self, event):
+        self._event_stream.push(event_type=EVENT_TYPE_DATA_GROUP, payload=event.payload)
+
+    def _poll_groups(self, snapshot):
+        events = []
+        with self._tracer.span("groups", "cycle"):
+            for group in self._groups.values():
+                value = snapshot.get(group.trigger)
+                # A failing group keeps its error and backs off, without failing the cycle of everything else
+                try:
+                    data = group.poll(value, self._ads_connector)
+                except Exception as e:
+                    self._tracer.instant("error", "groups", {"group": group.name, "error": repr(e)})
+                    self._report_error(f"Error reading group {group.name}: {e}")
+                    continue
+                if data is not None:
+                    events.append(BridgeEvent(EVENT_TYPE_DATA_GROUP, {'group': group.name, 'trigger': value, 'data': data.to_dict()}))
+        return events
+
+    def _read_history(self, timestamp : float):
+        """
+        Reads and records the history variables that are outside of the cyclic read list. A failed read backs off
+        without failing the cycle.
+        """
+        index = self._history_reads
+        if index is None or time.monotonic() < self._history_retry_time:
+            return
+        with self._tracer.span("history", "cycle", {"reads": len(index.names)}):
+            try:
+                values = self._ads_connector.read_values(list(index.names))
+            except Exception as e:
+                self._history_retry_time = time.monotonic() + DEFAULT_RETRY_INTERVAL
+                self._tracer.instant("error", "history", {"error": repr(e)})
+                self._report_error(f"Error reading history variables: {e}")
+                return
+            self._history.record(FlatSnapshot(index, values), timestamp)
+
+    def _poll_streams(self, snapshot):
+        batches = []
+        with self._tracer.span("streams", "cycle"):
+            for stream in list(self._streams.values()):
+                # A failing stream resets itself and waits before it is opened again, without failing the cycle
+                try:
+                    batch = stream.poll(snapshot.get(stream.counter), self._ads_connector)
+                except Exception as e:
+                    self._tracer.instant("error", "streams", {"stream": stream.name, "error": repr(e)})
+                    self._report_error(f"Error reading stream {stream.name}: {e}")
+                    continue
+                if batch is not None:
+                    batches.append(batch)
+        return batches
+
+    def _update_plc_data(self):
+
+        thread_start_time = time.time()
+        cycle_ok = False
+        tracer = self._tracer
+
+        while self._thread_is_alive:
+
+            # Block without a timeout while disabled or while there is nothing to read or write
+            with self._wake:
+                was_idle = not self._has_work()
+                while self._thread_is_alive and not self._has_work():
+                    self._set_status("Idle" if self._enable_communication else "Disabled")
+                    tracer.instant("idle", "cycle")
+                    self._wake.wait()
+            if not self._thread_is_alive:
+                break
+
+            # Sleep for the refresh rate, unless the thread just woke up from idle
+            if not was_idle:
+                rate = self._effective_rate if self._adaptive_rate is not None else self._refresh_rate
+                sleepy_time = rate/1000 - (time.time() - thread_start_time)
+                self._stop_event.wait(sleepy_time if sleepy_time > 0 else 0.1)
+                if not self._thread_is_alive:
+                    break
+                self._stop_event.clear()
+
+            thread_start_time = time.time()
+
+            # Catch exceptions and log them to the status field
+            try:
+                with tracer.span("cycle", "cycle"):
+                    # Start the communication if it is not initialized
+                    if (not self._communication_initialized) and (self._enable_communication):
+                        with tracer.span("connect", "connection"):
+                            self._ads_connector.connect()
+                        self._communication_initialized = True
+                    # A successful cycle proves the connection, so it is only probed after a failed one
+                    connected = cycle_ok
+                    if (not cycle_ok) and (self._communication_initialized):
+                        connected = self._ads_connector.is_connected()
+                        if not connected:
+                            tracer.instant("disconnect", "connection")
+                            self._ads_connector.disconnect()
+                    cycle_ok = False
+
+                    if self._status_hold_time < time.time():
+                        if connected:
+                            self._set_status("Connected")
+                        else:
+                            self._set_status("Attempting to connect...")
+
+                    timing = CycleTiming()
+
+                    values = dict()
+                    if self.write_queue or self.array_write_queue:
+                        with self.write_lock:
+                            values = self.write_queue
+                            arrays = self.array_write_queue
+                            self.write_queue = dict()
+                            self.array_write_queue = list()
+                        timing.write_start = time.perf_counter()
+                        timing.written = values
+
+                        # Block writes of arrays go first, on their own
+                        # If there is an exception, log it to the status field but continue reading data
+                        try:
+                            if arrays:
+                                with tracer.span("write", "cycle", {"arrays": len(arrays)}):
+                                    for name, array, offset in arrays:
+                                        self._ads_connector.write_array(name, array, offset)
+                        except Exception as e:
+                            self._report_error(f"Error writing data to PLC: {e}")
+                        timing.write_end = time.perf_counter()
+
+                    # Re-expand wildcard subscriptions after an online change
+                    with tracer.span("symbols", "cycle"):
+                        if self._ads_connector.check_online_change():
+                            for stream in self._streams.values():
+                                stream.reset()
+
+                    # Write the queued values and read data from the PLC, in one round trip where the driver can.
+                    # Otherwise the values are written on their own, so the write and the read are timed separately.
+                    timing.exchanged = bool(values) and getattr(self._ads_connector, 'combined_exchange', False)
+                    if values and not timing.exchanged:
+                        try:
+                            with tracer.span("write", "cycle", {"count": len(values)}):
+                                self._ads_connector.write_data(values)
+                        except Exception as e:
+                            self._report_error(f"Error writing data to PLC: {e}")
+                        timing.write_end = time.perf_counter()
+                        values = dict()
+                    with tracer.span("read", "cycle", {"writes": len(values)}):
+                        timing.read_start = time.perf_counter()
+                        snapshot, write_error = self._ads_connector.exchange(values)
+                        timing.read_end = time.perf_counter()
+                    read_time = time.time()
+                    if timing.exchanged:
+                        timing.write_end = timing.read_end
+                    if write_error is not None:
+                        self._report_error(f"Error writing data to PLC: {write_error}")
+
+                    for observer in self._cycle_observers:
+                        observer(snapshot, timing)
+
+                    # Fetch the new entries of PLC-side ring buffers
+                    batches = self._poll_streams(snapshot) if self._streams else ()
+
+                    # Read the groups whose trigger fired
+                    group_events = self._poll_groups(snapshot) if self._groups else ()
+
+                    # Publish the data to subscribers and the event stream
+                    previous = self._snapshot
+                    self._publish(snapshot, read_time)
+                    if self._history_reads is not None:
+                        self._read_history(read_time)
+                    for batch in batches:
+                        self._stream_dispatcher.publish(BridgeEvent(EVENT_TYPE_DATA_STREAM, {'stream': batch.stream, 'batch': batch}))
+                    for event in group_events:
+                        self._group_dispatcher.publish(event)
+
+                    changed = bool(batches) or bool(group_events) or snapshot_changed(previous, snapshot)
+                    self._update_rate((time.time() - thread_start_time) * 1000, changed, timing.write_end > 0.0)
+                    cycle_ok = True
+
+            except Exception as e:
+                tracer.instant("error", "connection", {"error": repr(e)})
+                self._report_error(f"Error reading data from PLC: {e}")
+                self._stop_event.wait(1)
+
+
+_service = None
+
+def get_service():
+    """
+    Returns the BridgeService registered by the extension, or None outside of Kit.
+    """
+    return _service
+
+def set_service(service : BridgeService):
+    """
+    Registers the BridgeService used by BeckhoffBridge.Manager when it is constructed without one.
+    """
+    global _service
+    _service = service
@@ -0,0 +1,242 @@
+'''
+  File: **dispatcher.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import logging
+import threading
+import time
+from collections import deque
+
+try:
+    import carb
+except ImportError:
+    carb = None
+
+# Queue policies of a subscriber
+LATEST = "latest"
+DROP_OLDEST = "drop_oldest"
+
+def _log_error(message : str):
+    """
+    Logs an error from an except block, with its traceback when running outside of Kit.
+    """
+    if carb is not None:
+        carb.log_error(message)
+    else:
+        logging.getLogger(__name__).exception(message)
+
+
+class Subscriber():
+    """
+    One subscriber of a Dispatcher, with its own bounded queue and delivery thread.
+    Also the subscription handle returned by Dispatcher.subscribe().
+
+    With the LATEST policy the queue holds one event, and a new event replaces one that was not delivered yet.
+    With the DROP_OLDEST policy the queue holds up to depth events, and the oldest is dropped when it is full.
+    Either way publishing never waits for the callback.
+
+    Args:
+        dispatcher (Dispatcher): The dispatcher that publishes to this subscriber.
+        callback (Callable): Called with each delivered event, on the delivery thread.
+        policy (str): LATEST or DROP_OLDEST.
+        depth (int): The queue depth for DROP_OLDEST.
+        name (str): The name shown in the statistics and on the delivery thread.
+        topic (optional): The topic the subscriber receives events of. None for the events published without a topic.
+
+    """
+
+    def __init__(self, dispatcher, callback, policy : str, depth : int, name : str, topic = None):
+        if policy not in (LATEST, DROP_OLDEST):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        if depth < 1:
+            raise ValueError("The queue depth must be at least 1")
+
+        self.name = name
+        self.policy = policy
+        self.topic = topic
+        self._dispatcher = dispatcher
+        self._callback = callback
+        self._queue = deque(maxlen=1 if policy == LATEST else depth)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+        # Statistics
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._latency_sum = 0.0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.max_duration = 0.0
+
+    def offer(self, event, timestamp : float = None):
+        """
+        Queues an event for delivery without waiting for the callback.
+
+        Args:
+            event: The event to deliver.
+            timestamp (float, optional): The time.perf_counter() at which the event was published, for the latency.
+
+        """
+        with self._condition:
+            if self._closed:
+                return
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append((event, time.perf_counter() if timestamp is None else timestamp))
+
+            # The delivery thread is only started once there is something to deliver
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"BeckhoffBridgeSubscriber-{self.name}", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def unsubscribe(self):
+        """
+        Stops delivering events to the callback. Events that were not delivered yet are discarded.
+        """
+        self._dispatcher._remove(self)
+        with self._condition:
+            self._closed = True
+            self._queue.clear()
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    @property
+    def pending(self):
+        """
+        The number of events waiting for delivery.
+        """
+        return len(self._queue)
+
+    def stats(self):
+        """
+        Returns the delivery statistics of this subscriber.
+
+        Returns:
+            dict: {'name', 'policy', 'delivered', 'dropped', 'errors', 'pending', 'last_latency_ms', 'mean_latency_ms',
+                'max_latency_ms', 'max_duration_ms', 'last_error'}
+                Latency is the time from publishing an event to the start of its callback.
+
+        """
+        return {
+            'name': self.name,
+            'policy': self.policy,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'pending': self.pending,
+            'last_latency_ms': self.last_latency * 1000,
+            'mean_latency_ms': self._latency_sum / self.delivered * 1000 if self.delivered else 0.0,
+            'max_latency_ms': self.max_latency * 1000,
+            'max_duration_ms': self.max_duration * 1000,
+            'last_error': self.last_error,
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                event, timestamp = self._queue.popleft()
+
+            start = time.perf_counter()
+            latency = start - timestamp
+            try:
+                self._callback(event)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = repr(e)
+                _log_error(f"Beckhoff Bridge subscriber {self.name} raised an exception: {e}")
+            duration = time.perf_counter() - start
+
+            self.delivered += 1
+            self._latency_sum += latency
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.max_duration = max(self.max_duration, duration)
+
+
+class Dispatcher():
+    """
+    Hands events to subscribers through bounded per-subscriber queues, so a slow subscriber cannot stretch the
+    cycle of the thread that publishes them, or delay the other subscribers.
+
+    e.g.
+        dispatcher = Dispatcher()
+        subscription = dispatcher.subscribe(on_data, policy=DROP_OLDEST, depth=16)
+        dispatcher.publish(event)
+        subscription.stats()['dropped']
+
+    """
+
+    def __init__(self):
+        self._subscribers = list()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, callback, policy : str = LATEST, depth : int = 1, name : str = None, topic = None):
+        """
+        Subscribes a callback, which runs on its own delivery thread.
+
+        Args:
+            callback (Callable): Called with each delivered event.
+            policy (str, optional): LATEST to only deliver the newest event, or DROP_OLDEST to queue up to depth events.
+            depth (int, optional): The queue depth for DROP_OLDEST.
+            name (str, optional): The name in the statistics. Defaults to the qualified name of the callback.
+            topic (optional): A hashable topic, to only receive the events published with it.
+
+        Returns:
+            Subscriber: The subscription handle, with unsubscribe() and stats() methods.
+
+        """
+        if name is None:
+            name = getattr(callback, "__qualname__", repr(callback))
+        subscriber = Subscriber(self, callback, policy, depth, name, topic)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+        return subscriber
+
+    def publish(self, event, topic = None):
+        """
+        Queues an event for every subscriber of the topic and returns immediately.
+        """
+        timestamp = time.perf_counter()
+        for subscriber in self._subscribers:
+            if subscriber.topic == topic:
+                subscriber.offer(event, timestamp)
+
+    def topics(self):
+        """
+        Returns the set of topics that have subscribers, including None for the subscribers without a topic.
+        """
+        return {subscriber.topic for subscriber in self._subscribers}
+
+    def stats(self):
+        """
+        Returns the statistics of every subscriber. See Subscriber.stats().
+        """
+        return [subscriber.stats() for subscriber in self._subscribers]
+
+    def close(self):
+        """
+        Unsubscribes every subscriber and stops the delivery threads.
+        """
+        for subscriber in list(self._subscribers):
+            subscriber.unsubscribe()
+
+    def _remove(self, subscriber):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
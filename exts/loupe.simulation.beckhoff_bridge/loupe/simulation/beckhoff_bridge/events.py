@@ -0,0 +1,44 @@
+'''
+  File: **events.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+try:
+    import carb.events
+except ImportError:
+    # Plain Python: there is no message bus, event types are only used to tag in-process events
+    carb = None
+
+def _event_type(name : str):
+    if carb is None:
+        return name
+    return carb.events.type_from_string(name)
+
+EVENT_TYPE_DATA_INIT = _event_type("loupe.simulation.beckhoff_bridge.DATA_INIT")
+EVENT_TYPE_DATA_READ = _event_type("loupe.simulation.beckhoff_bridge.DATA_READ")
+EVENT_TYPE_DATA_READ_REQ = _event_type("loupe.simulation.beckhoff_bridge.DATA_READ_REQ")
+EVENT_TYPE_DATA_WRITE_REQ = _event_type("loupe.simulation.beckhoff_bridge.DATA_WRITE_REQ")
+# Stream batches hold NumPy arrays, so they are only delivered in-process and never pushed on the message bus
+EVENT_TYPE_DATA_STREAM = _event_type("loupe.simulation.beckhoff_bridge.DATA_STREAM")
+EVENT_TYPE_DATA_GROUP = _event_type("loupe.simulation.beckhoff_bridge.DATA_GROUP")
+
+class BridgeEvent():
+    """
+    An event delivered directly to in-process subscribers.
+    It has the same type and payload attributes as the carb.events.IEvent delivered through the message bus.
+
+    Args:
+        event_type: One of the EVENT_TYPE_* constants.
+        payload (dict): The event payload. {'data': {...}}
+
+    """
+
+    __slots__ = ("type", "payload")
+
+    def __init__(self, event_type, payload : dict):
+        self.type = event_type
+        self.payload = payload
@@ -11,17 +11,12 @@
 import weakref
 import asyncio
 import gc
-import omni
-import omni.ui as ui
-import omni.usd
-import omni.timeline
-import omni.kit.commands
-from omni.kit.menu.utils import add_menu_items, remove_menu_items, MenuItemDescription
-from omni.usd import StageEventType
-import omni.physx as _physx
-
-from .global_variables import EXTENSION_TITLE, EXTENSION_DESCRIPTION
-from .ui_builder import UIBuilder
+import carb
+import carb.settings
+import omni.ext
+
+from .global_variables import EXTENSION_TITLE, EXTENSION_DESCRIPTION, EXTENSION_NAME
+from .bridge_service import BridgeService, set_service
 
 """
 This file serves as a basic template for the standard boilerplate operations
@@ -38,13 +33,66 @@ This class sets up standard useful callback functions in UIBuilder:
     on_stage_event: Called when stage is opened or closed
     cleanup: Called when resources such as physics subscriptions should be cleaned up
     build_ui: User function that creates the UI they want.
+
+The communication itself runs in a BridgeService, which is started whether or not there is a UI.
+In headless Kit (or with the /exts/loupe.simulation.beckhoff_bridge/headless setting) no window,
+menu or UI modules are loaded at all.
 """
 
 
+def _is_headless():
+    settings = carb.settings.get_settings()
+    if settings.get("/exts/" + EXTENSION_NAME + "/headless") or settings.get("/app/window/hideUi"):
+        return True
+    try:
+        import omni.ui
+        import omni.kit.menu.utils
+    except ImportError:
+        return True
+    return False
+
+
 class TestExtension(omni.ext.IExt):
     def on_startup(self, ext_id: str):
         """Initialize extension and UI elements"""
 
+        # Communication engine, shared by the UI and BeckhoffBridge.Manager
+        self._service = BridgeService()
+        set_service(self._service)
+
+        # Declarative PLC-to-USD bindings
+        from .usd_bindings import UsdBindingEngine
+        self._binding_engine = UsdBindingEngine()
+        bindings_file = self._service.settings.get('BINDINGS_FILE', '')
+        if bindings_file:
+            try:
+                self._binding_engine.load_bindings_file(bindings_file)
+            except Exception as e:
+                carb.log_error(f"Error loading Beckhoff Bridge bindings file {bindings_file}: {e}")
+
+        self._service.start()
+
+        # Let the adaptive refresh rate back off while the timeline is paused
+        self._timeline_pause_sub = None
+        try:
+            import omni.timeline
+        except ImportError:
+            pass
+        else:
+            stream = omni.timeline.get_timeline_interface().get_timeline_event_stream()
+            self._timeline_pause_sub = stream.create_subscription_to_pop(self._on_timeline_pause)
+
+        self._window = None
+        self.ui_builder = None
+        if _is_headless():
+            return
+
+        import omni.ui as ui
+        import omni.usd
+        import omni.timeline
+        from omni.kit.menu.utils import add_menu_items, MenuItemDescription
+        from .ui_builder import UIBuilder
+
         # Events
         self._usd_context = omni.usd.get_context()
 
@@ -63,24 +111,35 @@ class TestExtension(omni.ext.IExt):
         add_menu_items(self._menu_items, EXTENSION_TITLE)
 
         # Filled in with User Functions
-        self.ui_builder = UIBuilder()
+        self.ui_builder = UIBuilder(self._service, self._binding_engine)
 
         # Events
-        self._usd_context = omni.usd.get_context()
-        self._physxIFace = _physx.acquire_physx_interface()
-        self._physx_subscription = None
         self._stage_event_sub = None
         self._timeline = omni.timeline.get_timeline_interface()
 
     def on_shutdown(self):
-        self._models = {}
-        remove_menu_items(self._menu_items, EXTENSION_TITLE)
+        if self.ui_builder is not None:
+            from omni.kit.menu.utils import remove_menu_items
+            self._models = {}
+            remove_menu_items(self._menu_items, EXTENSION_TITLE)
+            self.ui_builder.cleanup()
         if self._window:
             self._window = None
-        self.ui_builder.cleanup()
+        self._timeline_pause_sub = None
+        self._binding_engine.cleanup()
+        self._service.cleanup()
+        set_service(None)
         gc.collect()
 
+    def _on_timeline_pause(self, event):
+        import omni.timeline
+        if event.type == int(omni.timeline.TimelineEventType.PAUSE):
+            self._service.paused = True
+        elif event.type in (int(omni.timeline.TimelineEventType.PLAY), int(omni.timeline.TimelineEventType.STOP)):
+            self._service.paused = False
+
     def _on_window(self, visible):
+        import omni.usd
         if self._window.visible:
             # Subscribe to Stage and Timeline Events
             self._usd_context = omni.usd.get_context()
@@ -96,6 +155,9 @@ class TestExtension(omni.ext.IExt):
             self._timeline_event_sub = None
 
     def _build_ui(self):
+        import omni.ui as ui
+        import omni.kit.app
+
         with self._window.frame:
             with ui.VStack(spacing=5, height=0):
                 self._build_extension_ui()
@@ -127,10 +189,6 @@ class TestExtension(omni.ext.IExt):
         self.ui_builder.on_timeline_event(event)
 
     def _on_stage_event(self, event):
-        if event.type == int(StageEventType.OPENED) or event.type == int(StageEventType.CLOSED):
-            # stage was opened or closed, cleanup
-            self._physx_subscription = None
-
         self.ui_builder.on_stage_event(event)
 
     def _build_extension_ui(self):
@@ -0,0 +1,332 @@
+'''
+  File: **flat_data.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import re
+from collections.abc import Mapping, Sequence
+
+def split_plc_var_name(plc_var : str):
+    """
+    Splits a flat PLC variable name into the sequence of keys used to reach it in the parsed data.
+
+    Args:
+        plc_var (str): The variable name in flattened string form ("MAIN.myStruct.myArray[3].myVar")
+
+    Returns:
+        tuple: The keys in order, with array indices as ints. ('MAIN', 'myStruct', 'myArray', 3, 'myVar')
+               Each dimension of a multi-dimensional index is a separate key.
+
+    """
+    keys = []
+    for part in re.split('[.]', plc_var):
+        if '[' in part:
+            # Multi-dimensional indices ("grid[1,2]") become one key per dimension
+            array_name, array_index = part.split("[")
+            keys.append(array_name)
+            keys.extend(int(index) for index in array_index[:-1].split(','))
+        else:
+            keys.append(part)
+    return tuple(keys)
+
+def lookup_plc_var(data : dict, keys : tuple):
+    """
+    Looks up a value in parsed PLC data using keys from split_plc_var_name.
+
+    Args:
+        data (dict): The parsed data, as published in the DATA_READ event.
+        keys (tuple): The keys of the variable.
+
+    Returns:
+        any: The value, or None if the variable is not present in the data.
+
+    """
+    value = data
+    for key in keys:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+class _Node():
+    """
+    A node in the precomputed name tree of a ReadIndex.
+
+    A node is either a leaf (slot is the index of its value in the value table), a struct (children keyed by
+    member name), or a list (children keyed by array index, length is the highest index + 1).
+    """
+
+    __slots__ = ("children", "slot", "is_list", "length")
+
+    def __init__(self, is_list = False):
+        self.children = dict()
+        self.slot = None
+        self.is_list = is_list
+        self.length = 0
+
+
+class ReadIndex():
+    """
+    Precomputed layout of a set of flat PLC variable names.
+
+    The index is built once when the read list changes. Every cycle only a flat table of values is produced,
+    and the nested structure is reached lazily through the index.
+
+    Args:
+        names (list[str]): The flat variable names, in the order of the value table.
+
+    Attributes:
+        names (tuple): The flat variable names.
+        slots (dict): Maps each flat name to its position in the value table.
+        root (_Node): The root of the name tree.
+
+    """
+
+    __slots__ = ("names", "slots", "root")
+
+    def __init__(self, names : list):
+        self.names = tuple(names)
+        self.slots = {name: slot for slot, name in enumerate(self.names)}
+        self.root = _Node()
+        for slot, name in enumerate(self.names):
+            self._insert(split_plc_var_name(name), slot)
+
+    def _insert(self, keys, slot):
+        # Later names replace conflicting earlier ones, the same way _parse_flat_plc_var_to_dict overwrites
+        node = self.root
+        for depth, key in enumerate(keys):
+            if isinstance(key, int):
+                node.length = max(node.length, key + 1)
+            is_last = depth == len(keys) - 1
+            child_is_list = (not is_last) and isinstance(keys[depth + 1], int)
+            child = node.children.get(key)
+            if is_last:
+                child = _Node()
+                child.slot = slot
+                node.children[key] = child
+            elif child is None or child.slot is not None or child.is_list != child_is_list:
+                child = _Node(child_is_list)
+                node.children[key] = child
+            node = child
+
+
+def _resolve(node : _Node, values : list):
+    if node.slot is not None:
+        return values[node.slot]
+    if node.is_list:
+        return LazyListView(node, values)
+    return LazyDataView(node, values)
+
+def _materialize(value):
+    if isinstance(value, (LazyDataView, LazyListView)):
+        return value.to_dict()
+    return value
+
+
+class LazyDataView(Mapping):
+    """
+    Read-only mapping over a flat value table, shaped like the nested dictionary returned by read_data().
+
+    Nested views are created on access, so only the paths that are actually used cost anything.
+    e.g.  view['MAIN']['custom_struct']['var_array'][1]
+
+    """
+
+    __slots__ = ("_node", "_values")
+
+    def __init__(self, node : _Node, values : list):
+        self._node = node
+        self._values = values
+
+    def __getitem__(self, key):
+        return _resolve(self._node.children[key], self._values)
+
+    def __iter__(self):
+        return iter(self._node.children)
+
+    def __len__(self):
+        return len(self._node.children)
+
+    def __contains__(self, key):
+        return key in self._node.children
+
+    def __repr__(self):
+        return f"LazyDataView({self.to_dict()!r})"
+
+    def to_dict(self):
+        """
+        Builds the full nested dictionary, identical to what read_data() returns.
+        """
+        return {key: _materialize(_resolve(child, self._values)) for key, child in self._node.children.items()}
+
+
+class LazyListView(Sequence):
+    """
+    Read-only sequence view of a PLC array in a LazyDataView. Elements that are not being read are None.
+    """
+
+    __slots__ = ("_node", "_values")
+
+    def __init__(self, node : _Node, values : list):
+        self._node = node
+        self._values = values
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("list index out of range")
+        child = self._node.children.get(index)
+        return None if child is None else _resolve(child, self._values)
+
+    def __len__(self):
+        return self._node.length
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, LazyListView)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"LazyListView({self.to_dict()!r})"
+
+    def to_dict(self):
+        """
+        Builds the full nested list, identical to what read_data() returns.
+        """
+        return [_materialize(value) for value in self]
+
+
+class FlatSnapshot():
+    """
+    The values of one read cycle, stored as a flat table aligned with a ReadIndex.
+
+    Args:
+        index (ReadIndex): The layout of the values.
+        values (list): One value per name in the index.
+
+    """
+
+    __slots__ = ("index", "values")
+
+    def __init__(self, index : ReadIndex, values : list):
+        self.index = index
+        self.values = values
+
+    def get(self, name : str, default = None):
+        """
+        Returns the value of a flat variable name, or default if it is not being read.
+        """
+        slot = self.index.slots.get(name)
+        return default if slot is None else self.values[slot]
+
+    def items(self):
+        """
+        Iterates over (flat name, value) pairs.
+        """
+        return zip(self.index.names, self.values)
+
+    @property
+    def view(self):
+        """
+        A lazy nested mapping over the values. e.g. snapshot.view['MAIN']['custom_struct']
+        """
+        return LazyDataView(self.index.root, self.values)
+
+    def to_dict(self):
+        """
+        Builds the full nested dictionary, identical to what read_data() returns.
+        """
+        return self.view.to_dict()
+
+
+def snapshot_changed(previous, current):
+    """
+    Returns True if the values of a snapshot differ from those of the previous one.
+
+    Args:
+        previous (FlatSnapshot): The previous snapshot, or None.
+        current (FlatSnapshot): The current snapshot.
+
+    """
+    if previous is None or previous.index is not current.index:
+        return True
+    if previous is current or previous.values is current.values:
+        return False
+    try:
+        return bool(previous.values != current.values)
+    except ValueError:
+        # Values that do not compare to a single bool, e.g. NumPy arrays
+        return True
+
+
+class SnapshotSubset():
+    """
+    Selects a few variables out of every snapshot, for a subscriber that only needs those.
+
+    The names may be wildcard patterns, which are matched against the names in the snapshot, case-insensitively.
+    The layout of the subset is only rebuilt when the layout of the snapshots changes.
+
+    Args:
+        variables (list[str]): The flat variable names or patterns. ["MAIN.axis[*].position", "MAIN.state"]
+
+    """
+
+    def __init__(self, variables : list):
+        self.variables = tuple(variables)
+        self._patterns = [_compile_pattern(name) if '*' in name or '?' in name else None for name in self.variables]
+        self._source_index = None
+        self._index = None
+        self._slots = []
+        self._last = None
+
+    def reset(self):
+        """
+        Forgets the last selected values, so the next select() reports a change.
+        """
+        self._last = None
+
+    def select(self, snapshot : FlatSnapshot):
+        """
+        Selects the variables out of a snapshot.
+
+        Args:
+            snapshot (FlatSnapshot): The snapshot of the read cycle.
+
+        Returns:
+            FlatSnapshot: The selected values, or None if they did not change since the last call.
+
+        """
+        if snapshot.index is not self._source_index:
+            self._build(snapshot.index)
+        values = snapshot.values
+        subset = FlatSnapshot(self._index, [values[slot] for slot in self._slots])
+        if not snapshot_changed(self._last, subset):
+            return None
+        self._last = subset
+        return subset
+
+    def _build(self, source_index : ReadIndex):
+        names = []
+        for name, pattern in zip(self.variables, self._patterns):
+            if pattern is None:
+                candidates = [name] if name in source_index.slots else []
+            else:
+                candidates = [candidate for candidate in source_index.names if pattern.fullmatch(candidate)]
+            names.extend(candidate for candidate in candidates if candidate not in names)
+        self._source_index = source_index
+        self._index = ReadIndex(names)
+        self._slots = [source_index.slots[name] for name in names]
+        self._last = None
+
+
+def _compile_pattern(pattern : str):
+    expression = re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.')
+    return re.compile(expression, re.IGNORECASE)
@@ -0,0 +1,171 @@
+'''
+  File: **history.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+from threading import Lock
+
+import numpy as np
+
+DEFAULT_DEPTH = 1000
+
+class HistoryBuffer():
+    """
+    A fixed-size ring of timestamped samples of one numeric variable.
+    The memory is allocated once, so it stays the same however long the bridge runs.
+
+    Args:
+        depth (int): The number of samples kept. The oldest samples are overwritten first.
+        decimation (int, optional): Only every n-th appended sample is stored.
+
+    """
+
+    def __init__(self, depth : int = DEFAULT_DEPTH, decimation : int = 1):
+        if depth < 1:
+            raise ValueError("The history depth must be at least 1")
+        if decimation < 1:
+            raise ValueError("The history decimation must be at least 1")
+        self.decimation = decimation
+        self._times = np.zeros(depth, dtype=np.float64)
+        self._values = np.zeros(depth, dtype=np.float64)
+        self._next = 0
+        self._count = 0
+        self._skipped = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def depth(self):
+        return len(self._times)
+
+    def append(self, timestamp : float, value):
+        """
+        Stores one sample, unless it is skipped by the decimation.
+
+        Args:
+            timestamp (float): The time of the sample in seconds. time.time()
+            value (int | float | bool): The value of the sample.
+
+        """
+        if self._skipped:
+            self._skipped = (self._skipped + 1) % self.decimation
+            return
+        self._skipped = 1 % self.decimation
+        self._times[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % len(self._times)
+        if self._count < len(self._times):
+            self._count += 1
+
+    def get(self, window : float = None):
+        """
+        Returns the stored samples in chronological order.
+
+        Args:
+            window (float, optional): Only return the samples of the last window seconds before the newest sample.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: Copies of the timestamps and the values.
+
+        """
+        if self._count < len(self._times):
+            times = self._times[:self._count].copy()
+            values = self._values[:self._count].copy()
+        else:
+            times = np.roll(self._times, -self._next)
+            values = np.roll(self._values, -self._next)
+        if window is not None and len(times):
+            start = np.searchsorted(times, times[-1] - window, side="left")
+            times = times[start:]
+            values = values[start:]
+        return times, values
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+        self._skipped = 0
+
+
+class History():
+    """
+    Opt-in history of read variables, one HistoryBuffer per variable.
+    Samples are recorded on the I/O thread after every read cycle and can be queried from any thread.
+
+    Only numeric and boolean variables can be recorded. Other values, and variables that were not read, are skipped.
+    """
+
+    def __init__(self):
+        self._buffers = dict()
+        self._lock = Lock()
+
+    @property
+    def names(self):
+        return list(self._buffers)
+
+    @property
+    def capacity(self):
+        """
+        The number of samples all buffers can hold together, which bounds the memory of the history.
+        """
+        with self._lock:
+            return sum(buffer.depth for buffer in self._buffers.values())
+
+    def add(self, name : str, depth : int = DEFAULT_DEPTH, decimation : int = 1):
+        """
+        Starts recording a variable. If it is already recorded with another depth or decimation, its samples are dropped.
+
+        Args:
+            name (str): The flat variable name. "MAIN.axis[0].position"
+            depth (int, optional): The number of samples kept.
+            decimation (int, optional): Only every n-th read cycle is stored.
+
+        """
+        with self._lock:
+            buffer = self._buffers.get(name)
+            if buffer is None or buffer.depth != depth or buffer.decimation != decimation:
+                self._buffers[name] = HistoryBuffer(depth, decimation)
+
+    def remove(self, name : str):
+        """
+        Stops recording a variable and frees its samples.
+        """
+        with self._lock:
+            self._buffers.pop(name, None)
+
+    def record(self, snapshot, timestamp : float):
+        """
+        Appends the values of one read cycle.
+
+        Args:
+            snapshot (FlatSnapshot): The values of the cycle.
+            timestamp (float): The time of the cycle in seconds.
+
+        """
+        with self._lock:
+            for name, buffer in self._buffers.items():
+                value = snapshot.get(name)
+                if isinstance(value, (int, float)):
+                    buffer.append(timestamp, value)
+
+    def get(self, name : str, window : float = None):
+        """
+        Returns the recorded samples of a variable in chronological order.
+
+        Args:
+            name (str): The flat variable name.
+            window (float, optional): Only return the samples of the last window seconds.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: The timestamps and the values.
+
+        Raises:
+            KeyError: If the variable is not recorded.
+
+        """
+        with self._lock:
+            return self._buffers[name].get(window)
@@ -0,0 +1,202 @@
+'''
+  File: **interpolation.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+from collections import deque
+from threading import Lock
+
+# Values between two samples lie on the straight line between them
+LINEAR = "linear"
+# Values keep the last sample until the next one, e.g. for states and counters
+HOLD = "hold"
+INTERPOLATION_MODES = (LINEAR, HOLD)
+
+# The longest time past the newest sample that LINEAR values are extrapolated, in seconds
+DEFAULT_MAX_EXTRAPOLATION = 0.1
+
+# The number of samples kept per variable
+DEFAULT_DEPTH = 8
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _lerp(start, end, fraction):
+    """
+    Returns the point at fraction of the way from start to end, per element for sequences.
+    Values that are not numbers, or sequences of numbers of the same length, are held at start.
+    """
+    if _is_number(start) and _is_number(end):
+        return start + (end - start) * fraction
+    if (isinstance(start, (list, tuple)) and isinstance(end, (list, tuple)) and len(start) == len(end)
+            and all(_is_number(a) and _is_number(b) for a, b in zip(start, end))):
+        return [a + (b - a) * fraction for a, b in zip(start, end)]
+    return start
+
+
+class SampleTrack():
+    """
+    The newest timestamped samples of one variable, evaluated at any time in between or shortly after them.
+
+    Args:
+        mode (str, optional): LINEAR or HOLD. Booleans, strings and structures are always held.
+        max_extrapolation (float, optional): The longest time past the newest sample that LINEAR values follow the
+            slope of the last two samples. After that, the value stays where the extrapolation stopped.
+        depth (int, optional): The number of samples kept.
+
+    """
+
+    def __init__(self, mode : str = LINEAR, max_extrapolation : float = DEFAULT_MAX_EXTRAPOLATION, depth : int = DEFAULT_DEPTH):
+        if mode not in INTERPOLATION_MODES:
+            raise ValueError(f"Unknown interpolation mode: {mode}")
+        if max_extrapolation < 0:
+            raise ValueError("The maximum extrapolation cannot be negative")
+        if depth < 2:
+            raise ValueError("An interpolated variable needs at least 2 samples")
+        self.mode = mode
+        self.max_extrapolation = max_extrapolation
+        self._samples = deque(maxlen=depth)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def append(self, timestamp : float, value):
+        """
+        Stores one sample. Samples that are not newer than the newest one are dropped.
+        """
+        samples = self._samples
+        if samples and timestamp <= samples[-1][0]:
+            return
+        samples.append((timestamp, value))
+
+    def sample(self, timestamp : float):
+        """
+        Returns the value at a time.
+
+        Before the oldest sample, the oldest value is returned.
+
+        Args:
+            timestamp (float): The time in seconds, in the clock of the samples.
+
+        Returns:
+            The value, or None if there are no samples.
+
+        """
+        samples = self._samples
+        if not samples:
+            return None
+        newest_time, newest = samples[-1]
+        if timestamp >= newest_time:
+            if self.mode == HOLD or len(samples) < 2:
+                return newest
+            # Follow the slope of the last two samples, for at most max_extrapolation
+            previous_time, previous = samples[-2]
+            ahead = min(timestamp - newest_time, self.max_extrapolation)
+            return _lerp(newest, previous, -ahead / (newest_time - previous_time))
+
+        # Walk back from the newest sample, since frames are rendered close to it
+        for i in range(len(samples) - 2, -1, -1):
+            start_time, start = samples[i]
+            if start_time <= timestamp:
+                if self.mode == HOLD:
+                    return start
+                end_time, end = samples[i + 1]
+                return _lerp(start, end, (timestamp - start_time) / (end_time - start_time))
+        return samples[0][1]
+
+    def clear(self):
+        self._samples.clear()
+
+
+class Interpolator():
+    """
+    Keeps the newest read cycles of some variables with their timestamps, so their values can be evaluated at the
+    time of a rendered frame instead of jumping once per read cycle.
+
+    Samples are recorded on the I/O thread after every read cycle and can be evaluated from any thread.
+    """
+
+    def __init__(self):
+        self._tracks = dict()
+        self._lock = Lock()
+        self._last_snapshot = None
+
+    @property
+    def names(self):
+        return list(self._tracks)
+
+    def add(self, name : str, mode : str = LINEAR, max_extrapolation : float = DEFAULT_MAX_EXTRAPOLATION):
+        """
+        Starts keeping samples of a variable. If it is already kept with another mode or extrapolation, its
+        samples are kept, and the new settings apply from now on.
+
+        Args:
+            name (str): The flat variable name. "MAIN.axis[0].position"
+            mode (str, optional): LINEAR or HOLD.
+            max_extrapolation (float, optional): The longest time past the newest sample that LINEAR values are extrapolated.
+
+        """
+        # Checks the settings before anything is changed
+        track = SampleTrack(mode, max_extrapolation)
+        with self._lock:
+            existing = self._tracks.get(name)
+            if existing is None:
+                self._tracks[name] = track
+            else:
+                existing.mode = mode
+                existing.max_extrapolation = max_extrapolation
+
+    def remove(self, name : str):
+        """
+        Stops keeping samples of a variable.
+        """
+        with self._lock:
+            self._tracks.pop(name, None)
+
+    def record(self, snapshot, timestamp : float):
+        """
+        Appends the values of one read cycle. A snapshot that was already recorded is skipped, so a driver that
+        returns its last snapshot again when nothing new was read does not stretch the samples in time.
+
+        Args:
+            snapshot (FlatSnapshot): The values of the cycle.
+            timestamp (float): The time of the cycle in seconds.
+
+        """
+        with self._lock:
+            if snapshot is self._last_snapshot:
+                return
+            self._last_snapshot = snapshot
+            for name, track in self._tracks.items():
+                value = snapshot.get(name)
+                if value is not None:
+                    track.append(timestamp, value)
+
+    def sample(self, names : list, timestamp : float):
+        """
+        Returns the values of variables at a time.
+
+        Args:
+            names (list[str]): The flat variable names.
+            timestamp (float): The time in seconds, in the clock of the recorded cycles.
+
+        Returns:
+            dict: The values keyed by name. Variables without samples are None.
+
+        Raises:
+            KeyError: If a variable is not kept.
+
+        """
+        with self._lock:
+            return {name: self._tracks[name].sample(timestamp) for name in names}
+
+    def clear(self):
+        with self._lock:
+            for track in self._tracks.values():
+                track.clear()
+            self._last_snapshot = None
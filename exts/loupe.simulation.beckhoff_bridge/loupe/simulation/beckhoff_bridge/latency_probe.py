@@ -0,0 +1,214 @@
+'''
+  File: **latency_probe.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import math
+import time
+from collections import deque
+from threading import Lock
+
+from .flat_data import split_plc_var_name, lookup_plc_var
+
+# Stages of one round trip, in order. A round trip either has write and read, or, if the driver wrote the token in
+# the same request as a read, exchange.
+STAGES = ("queue", "write", "exchange", "turnaround", "read", "delivery")
+
+# Tokens are written to a DINT, so they wrap around before its maximum
+MAX_TOKEN = 2**31 - 1
+
+def percentile(sorted_values : list, fraction : float):
+    """
+    Returns a percentile of sorted values by the nearest-rank method.
+
+    Args:
+        sorted_values (list[float]): The values, sorted ascending.
+        fraction (float): The percentile as a fraction. 0.99
+
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class CycleTiming():
+    """
+    The time.perf_counter() timestamps of the stages of one I/O cycle, passed to cycle observers of the BridgeService.
+
+    Attributes:
+        written (dict): The values written in the cycle. Empty if nothing was written.
+        exchanged (bool): True if the values were written in the same request as the read, so the write ends
+            with the read.
+
+    """
+
+    __slots__ = ("write_start", "write_end", "read_start", "read_end", "written", "exchanged")
+
+    def __init__(self):
+        self.write_start = 0.0
+        self.write_end = 0.0
+        self.read_start = 0.0
+        self.read_end = 0.0
+        self.written = {}
+        self.exchanged = False
+
+
+class LatencyProbe():
+    """
+    Measures the round trip from Kit to the PLC and back through the normal write and read paths.
+
+    The probe writes an incrementing token to a PLC variable, waits until the token comes back in an echo variable,
+    and then writes the next one. On the PLC, the echo is a single assignment in a task, e.g.
+        MAIN.echo_out := MAIN.echo_in;
+    If the echo variable is the written variable itself, the round trip does not include a PLC task cycle.
+
+    Each round trip is split into stages:
+        queue:      from queuing the write until the I/O thread starts writing it
+        write:      the ADS write
+        exchange:   instead of write, the request that wrote the token together with a read, if the driver combines them
+        turnaround: from the end of the write until the end of the read that returned the token, which includes
+                    the PLC task cycle and waiting for the next bridge cycle
+        read:       the ADS read that returned the token, if it was not part of the exchange
+        delivery:   from the end of that read until a data subscriber received it
+    stats() only reports the stages that were measured.
+
+    Args:
+        service (BridgeService): The service to measure.
+        write_variable (str): The DINT variable the tokens are written to. "MAIN.echo_in"
+        echo_variable (str, optional): The variable the PLC copies the token to. Defaults to write_variable.
+        capacity (int, optional): The number of round trips kept for the percentiles.
+        timeout (float, optional): Seconds after which a token that did not come back is counted as lost.
+
+    """
+
+    def __init__(self, service, write_variable : str, echo_variable : str = None, capacity : int = 1000, timeout : float = 2.0):
+        self._service = service
+        self.write_variable = write_variable
+        self.echo_variable = echo_variable or write_variable
+        self._echo_keys = split_plc_var_name(self.echo_variable)
+        self.timeout = timeout
+
+        self._lock = Lock()
+        self._round_trips = deque(maxlen=capacity)
+        self._stages = {stage: deque(maxlen=capacity) for stage in STAGES}
+        self.lost = 0
+
+        self._token = 0
+        self._pending = None
+        self._subscription = None
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """
+        Starts sending tokens. The echo variable is added to the cyclic read list.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._service.add_read_variables([self.echo_variable])
+        self._service.add_cycle_observer(self._on_cycle)
+        self._subscription = self._service.subscribe_data(self._on_data)
+        self._send()
+
+    def stop(self):
+        """
+        Stops sending tokens. The results are kept until clear() is called.
+        """
+        self._running = False
+        self._service.remove_cycle_observer(self._on_cycle)
+        if self._subscription is not None:
+            self._subscription.unsubscribe()
+            self._subscription = None
+        self._pending = None
+
+    def clear(self):
+        """
+        Removes the recorded round trips.
+        """
+        with self._lock:
+            self._round_trips.clear()
+            for samples in self._stages.values():
+                samples.clear()
+            self.lost = 0
+
+    def _send(self):
+        self._token = self._token % MAX_TOKEN + 1
+        # token, queued, write start, write end, read start, read end, exchanged
+        self._pending = [self._token, time.perf_counter(), None, None, None, None, False]
+        self._service.queue_write(self.write_variable, self._token)
+
+    def _on_cycle(self, snapshot, timing):
+        # Called on the I/O thread after every read
+        pending = self._pending
+        if pending is None:
+            return
+        if pending[2] is None and timing.written.get(self.write_variable) == pending[0]:
+            pending[2] = timing.write_start
+            pending[3] = timing.write_end
+            pending[6] = timing.exchanged
+        if pending[2] is not None and pending[4] is None and snapshot.get(self.echo_variable) == pending[0]:
+            pending[4] = timing.read_start
+            pending[5] = timing.read_end
+        elif time.perf_counter() - pending[1] > self.timeout:
+            with self._lock:
+                self.lost += 1
+            self._send()
+
+    def _on_data(self, event):
+        # Called on a delivery thread once a data subscriber received the data
+        delivered = time.perf_counter()
+        pending = self._pending
+        if pending is None or pending[5] is None or lookup_plc_var(event.payload['data'], self._echo_keys) != pending[0]:
+            return
+        token, queued, write_start, write_end, read_start, read_end, exchanged = pending
+        with self._lock:
+            self._round_trips.append(delivered - queued)
+            self._stages["queue"].append(write_start - queued)
+            if exchanged:
+                # The write ended with the read of its request, so the read is part of the exchange and the turnaround
+                self._stages["exchange"].append(write_end - write_start)
+            else:
+                self._stages["write"].append(write_end - write_start)
+                self._stages["read"].append(read_end - read_start)
+            self._stages["turnaround"].append(read_end - write_end)
+            self._stages["delivery"].append(delivered - read_end)
+        if self._running:
+            self._send()
+
+    def stats(self):
+        """
+        Returns the round-trip latency percentiles and the timings of the measured stages in milliseconds.
+
+        Returns:
+            dict: {'samples': 120, 'lost': 0,
+                   'round_trip': {'p50': 21.3, 'p90': 24.0, 'p99': 31.2, 'max': 40.1},
+                   'stages': {'queue': {...}, 'write': {...}, 'turnaround': {...}, 'read': {...}, 'delivery': {...}}}
+
+        """
+        with self._lock:
+            round_trips = sorted(self._round_trips)
+            stages = {stage: sorted(samples) for stage, samples in self._stages.items()}
+            lost = self.lost
+        return {
+            'samples': len(round_trips),
+            'lost': lost,
+            'round_trip': self._summarize(round_trips),
+            'stages': {stage: self._summarize(samples) for stage, samples in stages.items() if samples},
+        }
+
+    def _summarize(self, sorted_values):
+        return {
+            'p50': percentile(sorted_values, 0.5) * 1000,
+            'p90': percentile(sorted_values, 0.9) * 1000,
+            'p99': percentile(sorted_values, 0.99) * 1000,
+            'max': (sorted_values[-1] if sorted_values else 0.0) * 1000,
+        }
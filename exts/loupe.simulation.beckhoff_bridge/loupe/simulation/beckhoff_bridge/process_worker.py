@@ -0,0 +1,429 @@
+'''
+  File: **process_worker.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import multiprocessing
+import os
+import pickle
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+from threading import RLock
+
+from .ads_driver import AdsDriver, DEFAULT_PORT, PYADS_BACKEND
+from .flat_data import ReadIndex, FlatSnapshot
+
+# Snapshot header: sequence, cycle count, timestamp, payload length, index version, connected
+_HEADER = struct.Struct("<QQdIIB")
+_SEQUENCE = struct.Struct("<Q")
+_PAYLOAD_OFFSET = 64
+
+# Initial size of the shared snapshot memory. It is replaced by a larger one when a snapshot does not fit.
+DEFAULT_SNAPSHOT_SIZE = 1 << 20
+
+def _python_executable():
+    """
+    Returns the Python interpreter used for the worker process.
+    Inside Kit, sys.executable is the Kit executable, so the interpreter is looked up next to the Python library.
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    for candidate in ("python.exe", os.path.join("bin", "python3"), "python3", "python"):
+        path = os.path.join(sys.prefix, candidate)
+        if os.path.isfile(path):
+            return path
+    return sys.executable
+
+
+class _SnapshotWriter():
+    """
+    Publishes snapshots into shared memory under a sequence lock: the sequence is odd while a snapshot is written,
+    so a reader that sees an odd or changed sequence retries instead of waiting on a lock.
+    """
+
+    def __init__(self, size : int):
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self._sequence = 0
+
+    def write(self, payload : bytes, cycle : int, index_version : int, connected : bool):
+        buffer = self.memory.buf
+        self._sequence += 1
+        _SEQUENCE.pack_into(buffer, 0, self._sequence)
+        buffer[_PAYLOAD_OFFSET:_PAYLOAD_OFFSET + len(payload)] = payload
+        _HEADER.pack_into(buffer, 0, self._sequence, cycle, time.time(), len(payload), index_version, connected)
+        self._sequence += 1
+        _SEQUENCE.pack_into(buffer, 0, self._sequence)
+
+    def fits(self, payload : bytes):
+        return _PAYLOAD_OFFSET + len(payload) <= self.memory.size
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def _worker_main(control, notify, driver_factory, snapshot_size, cycle_time):
+    """
+    The main loop of the worker process. It owns the driver, and runs the write and read cycles on its own clock.
+
+    Commands arrive on the control pipe as (command, *args), and each gets a ("ok", result) or ("error", exception)
+    reply. Index changes, online changes, read errors and new shared memory are announced on the notify pipe.
+    """
+    driver = driver_factory()
+    writer = _SnapshotWriter(snapshot_size)
+    notify.send(("memory", writer.memory.name))
+
+    connected = False
+    has_reads = False
+    cycle = 0
+    index = None
+    index_version = 0
+    next_cycle = time.perf_counter()
+
+    try:
+        while True:
+            # Serve commands until the next cycle is due
+            timeout = next_cycle - time.perf_counter()
+            if control.poll(max(timeout, 0)):
+                command, *args = control.recv()
+                if command == "stop":
+                    control.send(("ok", None))
+                    return
+                try:
+                    if command == "connect":
+                        driver.connect(*args)
+                        connected = True
+                        result = None
+                    elif command == "disconnect":
+                        driver.disconnect()
+                        connected = False
+                        result = None
+                    elif command == "add_read":
+                        driver.add_read(*args)
+                        has_reads = True
+                        result = None
+                    elif command == "cycle_time":
+                        cycle_time = args[0]
+                        result = None
+                    else:
+                        # write_data, read_values, get_array_length, read_array_bytes, ...
+                        result = getattr(driver, command)(*args)
+                    control.send(("ok", result))
+                except Exception as e:
+                    try:
+                        control.send(("error", e))
+                    except Exception:
+                        # The exception could not be pickled
+                        control.send(("error", RuntimeError(repr(e))))
+                continue
+
+            next_cycle = max(next_cycle + cycle_time, time.perf_counter())
+            if not connected or not has_reads:
+                continue
+
+            try:
+                if driver.check_online_change():
+                    notify.send(("online_change",))
+                snapshot = driver.read_table()
+                if snapshot.index is not index:
+                    index = snapshot.index
+                    index_version += 1
+                    notify.send(("index", index_version, index.names))
+                cycle += 1
+                payload = pickle.dumps(snapshot.values, protocol=pickle.HIGHEST_PROTOCOL)
+                if not writer.fits(payload):
+                    old_writer = writer
+                    writer = _SnapshotWriter(max(len(payload) * 2, old_writer.memory.size * 2))
+                    notify.send(("memory", writer.memory.name))
+                    old_writer.close()
+                # The read just succeeded, so the connection is not probed again
+                writer.write(payload, cycle, index_version, True)
+            except Exception as e:
+                notify.send(("read_error", repr(e)))
+    finally:
+        driver.disconnect()
+        writer.close()
+
+
+class ProcessDriver():
+    """
+    Runs a driver and its read plan in a separate worker process, so that ADS calls and decoding do not compete for
+    the GIL with Kit's Python scripts and UI.
+
+    The worker reads on its own clock and publishes every snapshot into shared memory under a sequence lock.
+    read_table() only copies the newest snapshot out of shared memory, so it never waits for the PLC. Writes and
+    configuration go through a pipe to the worker. The worker process is started on the first connect().
+
+    Implements the driver interface of AdsDriver, so the BridgeService and the Manager API work unchanged.
+
+    Args:
+        ams_net_id (str): The AMS Net ID of the target device.
+        port (int, optional): The ADS port used for names without a port qualifier.
+        cycle_time (float, optional): The read cycle time of the worker in seconds.
+        driver_factory (Callable, optional): A picklable callable that creates the driver inside the worker.
+            Defaults to an AdsDriver for ams_net_id and port.
+        snapshot_size (int, optional): The initial size of the shared snapshot memory in bytes.
+        backend (str, optional): The backend of the default AdsDriver, "pyads" or "asyncio".
+        backend_options (dict, optional): The backend options of the default AdsDriver.
+
+    """
+
+    def __init__(self, ams_net_id : str, port : int = DEFAULT_PORT, cycle_time : float = 0.02, driver_factory = None, snapshot_size : int = DEFAULT_SNAPSHOT_SIZE,
+                 backend : str = PYADS_BACKEND, backend_options : dict = None):
+        self.ams_net_id = ams_net_id
+        self.port = port
+        self.backend = backend
+        self.backend_options = backend_options
+        self._cycle_time = cycle_time
+        self._driver_factory = driver_factory
+        self._snapshot_size = snapshot_size
+
+        self._process = None
+        self._control = None
+        self._notify = None
+        self._memory = None
+        # The control pipe is used by the I/O thread and by the callers of add_read() and cycle_time, and a reply
+        # must be received by the thread that sent the request
+        self._control_lock = RLock()
+
+        # Replayed into a new worker, so a restarted worker reads the same variables
+        self._reads = list()
+
+        self._indexes = dict()
+        self._snapshot = FlatSnapshot(ReadIndex([]), [])
+        self._sequence = 0
+        self._connected = False
+        self._online_change = False
+        self._read_error = None
+
+    ####################################
+    # Worker process
+    ####################################
+
+    def _start(self):
+        with self._control_lock:
+            self._start_worker()
+
+    def _start_worker(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        factory = self._driver_factory
+        if factory is None:
+            factory = _AdsDriverFactory(self.ams_net_id, self.port, self.backend, self.backend_options)
+
+        context = multiprocessing.get_context("spawn")
+        context.set_executable(_python_executable())
+        self._control, worker_control = context.Pipe()
+        self._notify, worker_notify = context.Pipe(duplex=False)
+        self._process = context.Process(target=_worker_main, name="BeckhoffBridgeWorker", daemon=True,
+                                        args=(worker_control, worker_notify, factory, self._snapshot_size, self._cycle_time))
+        self._process.start()
+        worker_control.close()
+        worker_notify.close()
+
+        self._indexes = dict()
+        self._receive_notifications(lambda: self._memory is not None, timeout=10.0)
+        for read in self._reads:
+            self._request("add_read", *read)
+
+    def close(self):
+        """
+        Stops the worker process.
+        """
+        with self._control_lock:
+            self._stop_worker()
+
+    def _stop_worker(self):
+        if self._process is None:
+            return
+        try:
+            if self._process.is_alive():
+                self._request("stop")
+        except (EOFError, OSError):
+            pass
+        self._process.join(timeout=5.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        self._control.close()
+        self._notify.close()
+        self._control = None
+        self._notify = None
+        self._close_memory()
+
+    def _request(self, command, *args):
+        """
+        Sends a command to the worker and returns its result, raising the worker's exception if it failed.
+        """
+        with self._control_lock:
+            self._control.send((command, *args))
+            status, result = self._control.recv()
+        if status == "error":
+            raise result
+        return result
+
+    def _receive_notifications(self, done = None, timeout : float = 0.0):
+        """
+        Handles the notifications of the worker. If done is given, waits until it returns True.
+        """
+        if self._notify is None:
+            return
+        deadline = time.perf_counter() + timeout
+        while True:
+            if done is not None and done():
+                return
+            remaining = deadline - time.perf_counter()
+            if not self._notify.poll(max(remaining, 0)):
+                if done is None:
+                    return
+                raise TimeoutError("The Beckhoff Bridge worker process did not respond")
+            message = self._notify.recv()
+            kind = message[0]
+            if kind == "memory":
+                self._close_memory()
+                self._memory = shared_memory.SharedMemory(name=message[1])
+                self._sequence = 0
+                # The worker owns the memory, so this process must not unlink it at exit
+                try:
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(self._memory._name, "shared_memory")
+                except Exception:
+                    pass
+            elif kind == "index":
+                self._indexes[message[1]] = ReadIndex(message[2])
+            elif kind == "online_change":
+                self._online_change = True
+            elif kind == "read_error":
+                self._read_error = message[1]
+
+    def _close_memory(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory = None
+
+    ####################################
+    # Driver interface
+    ####################################
+
+    @property
+    def cycle_time(self):
+        return self._cycle_time
+
+    @cycle_time.setter
+    def cycle_time(self, cycle_time : float):
+        with self._control_lock:
+            self._cycle_time = cycle_time
+            if self._process is not None:
+                self._request("cycle_time", cycle_time)
+
+    def add_read(self, name : str, structure_def = None):
+        # Under the lock, so a worker that is being started replays the read exactly once
+        with self._control_lock:
+            self._reads.append((name, structure_def))
+            if self._process is not None:
+                self._request("add_read", name, structure_def)
+
+    def connect(self, ams_net_id = None):
+        if ams_net_id is not None:
+            self.ams_net_id = ams_net_id
+        self._start()
+        self._request("connect", self.ams_net_id)
+        self._connected = True
+        self._read_error = None
+
+    def disconnect(self):
+        if self._process is not None and self._process.is_alive():
+            self._request("disconnect")
+        self._connected = False
+
+    def is_connected(self):
+        return self._process is not None and self._process.is_alive() and self._connected
+
+    def check_online_change(self):
+        self._receive_notifications()
+        changed = self._online_change
+        self._online_change = False
+        return changed
+
+    def write_data(self, data : dict):
+        self._request("write_data", data)
+
+    def write_array(self, name : str, values, offset : int = 0):
+        self._request("write_array", name, values, offset)
+
+    def read_table(self):
+        """
+        Returns the newest snapshot published by the worker.
+        If the worker did not publish a new one since the last call, the last snapshot is returned again.
+        """
+        self._receive_notifications()
+        if self._read_error is not None:
+            error = self._read_error
+            self._read_error = None
+            raise RuntimeError(error)
+        if not self.is_connected():
+            raise RuntimeError("The Beckhoff Bridge worker process is not connected")
+
+        buffer = self._memory.buf
+        while True:
+            sequence = _SEQUENCE.unpack_from(buffer, 0)[0]
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            if sequence == self._sequence or sequence == 0:
+                # Nothing new, or nothing published yet
+                return self._snapshot
+            _, cycle, timestamp, length, index_version, connected = _HEADER.unpack_from(buffer, 0)
+            payload = bytes(buffer[_PAYLOAD_OFFSET:_PAYLOAD_OFFSET + length])
+            if _SEQUENCE.unpack_from(buffer, 0)[0] == sequence:
+                break
+
+        if index_version not in self._indexes:
+            self._receive_notifications(lambda: index_version in self._indexes, timeout=1.0)
+        self._sequence = sequence
+        self._connected = bool(connected)
+        self._snapshot = FlatSnapshot(self._indexes[index_version], pickle.loads(payload))
+        return self._snapshot
+
+    def exchange(self, values : dict):
+        # The worker reads on its own clock, so the write is sent to it and the newest snapshot is returned
+        error = None
+        if values:
+            try:
+                self.write_data(values)
+            except Exception as e:
+                error = e
+        return self.read_table(), error
+
+    def read_data(self):
+        return self.read_table().to_dict()
+
+    def read_values(self, names : list):
+        return self._request("read_values", list(names))
+
+    def get_array_length(self, name : str):
+        return self._request("get_array_length", name)
+
+    def read_array_bytes(self, name : str, start : int, count : int, element_size : int):
+        return self._request("read_array_bytes", name, start, count, element_size)
+
+
+class _AdsDriverFactory():
+    """
+    Creates the AdsDriver inside the worker process. A class instead of a closure, so it can be pickled.
+    """
+
+    def __init__(self, ams_net_id, port, backend = PYADS_BACKEND, backend_options = None):
+        self.ams_net_id = ams_net_id
+        self.port = port
+        self.backend = backend
+        self.backend_options = backend_options
+
+    def __call__(self):
+        return AdsDriver(self.ams_net_id, self.port, self.backend, self.backend_options)
@@ -0,0 +1,405 @@
+'''
+  File: **soak.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import argparse
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from .BeckhoffBridge import Manager
+from .bridge_service import BridgeService, Settings
+from .latency_probe import percentile
+from .stand_in_plc import StandInDriver
+
+# Churn steps between hot reloads
+RELOAD_STEPS = 20
+
+
+def _rss_mb():
+    """
+    Returns the resident set size of this process in MB, or None if it cannot be measured here.
+    """
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class SoakThresholds():
+    """
+    The largest growth from the end of the warmup to the end of a soak run that still passes.
+
+    Args:
+        rss_growth_mb (float, optional): Growth of the resident set size.
+        traced_growth_mb (float, optional): Growth of the memory traced by tracemalloc.
+        thread_growth (int, optional): Growth of the number of threads.
+        cycle_drift_ms (float, optional): Growth of the median time between read cycles.
+        read_growth (int, optional): Growth of the number of variables in the cyclic read list.
+        history_growth (int, optional): Growth of the number of history buffers.
+        history_capacity_growth (int, optional): Growth of the number of samples the history buffers can hold.
+
+    """
+
+    def __init__(self, rss_growth_mb : float = 50.0, traced_growth_mb : float = 20.0, thread_growth : int = 2, cycle_drift_ms : float = 5.0,
+                 read_growth : int = 10, history_growth : int = 10, history_capacity_growth : int = 10000):
+        self.rss_growth_mb = rss_growth_mb
+        self.traced_growth_mb = traced_growth_mb
+        self.thread_growth = thread_growth
+        self.cycle_drift_ms = cycle_drift_ms
+        self.read_growth = read_growth
+        self.history_growth = history_growth
+        self.history_capacity_growth = history_capacity_growth
+
+
+class SoakSample():
+    """
+    The resource usage at one point of a soak run.
+    """
+
+    __slots__ = ("elapsed", "rss_mb", "traced_mb", "threads", "cycle_ms", "cycles", "reads", "history_buffers", "history_capacity")
+
+    def __init__(self, elapsed : float, rss_mb, traced_mb : float, threads : int, cycle_ms : float, cycles : int,
+                 reads : int, history_buffers : int, history_capacity : int):
+        self.elapsed = elapsed
+        self.rss_mb = rss_mb
+        self.traced_mb = traced_mb
+        self.threads = threads
+        self.cycle_ms = cycle_ms
+        self.cycles = cycles
+        self.reads = reads
+        self.history_buffers = history_buffers
+        self.history_capacity = history_capacity
+
+    def __repr__(self):
+        rss = "n/a" if self.rss_mb is None else f"{self.rss_mb:.1f} MB"
+        return (f"{self.elapsed:9.1f} s  rss {rss}  traced {self.traced_mb:.2f} MB  threads {self.threads}  "
+                f"cycle {self.cycle_ms:.2f} ms  cycles {self.cycles}  reads {self.reads}  "
+                f"history {self.history_buffers} buffers / {self.history_capacity} samples")
+
+
+class SoakReport():
+    """
+    The result of a soak run.
+
+    Attributes:
+        samples (list[SoakSample]): The samples, oldest first.
+        baseline (SoakSample): The sample taken at the end of the warmup.
+        failures (list[str]): The thresholds that were exceeded.
+        top_allocators (list[str]): The source lines whose traced allocations grew the most since the baseline.
+
+    """
+
+    def __init__(self, samples : list, baseline : SoakSample, failures : list, top_allocators : list):
+        self.samples = samples
+        self.baseline = baseline
+        self.failures = failures
+        self.top_allocators = top_allocators
+
+    @property
+    def passed(self):
+        return not self.failures
+
+    def summary(self):
+        lines = ["Soak test " + ("passed" if self.passed else "FAILED"), f"baseline {self.baseline!r}"]
+        if self.samples:
+            lines.append(f"final    {self.samples[-1]!r}")
+        lines.extend("  " + failure for failure in self.failures)
+        if self.top_allocators:
+            lines.append("Top allocators since the baseline:")
+            lines.extend("  " + allocator for allocator in self.top_allocators)
+        return "\n".join(lines)
+
+
+def evaluate(baseline : SoakSample, final : SoakSample, thresholds : SoakThresholds):
+    """
+    Compares the final sample of a soak run with the baseline.
+
+    Returns:
+        list[str]: A description of every exceeded threshold. Empty if the run passed.
+
+    """
+    failures = []
+    if baseline.rss_mb is not None and final.rss_mb is not None:
+        growth = final.rss_mb - baseline.rss_mb
+        if growth > thresholds.rss_growth_mb:
+            failures.append(f"RSS grew by {growth:.1f} MB, more than {thresholds.rss_growth_mb} MB")
+    growth = final.traced_mb - baseline.traced_mb
+    if growth > thresholds.traced_growth_mb:
+        failures.append(f"Traced memory grew by {growth:.2f} MB, more than {thresholds.traced_growth_mb} MB")
+    growth = final.threads - baseline.threads
+    if growth > thresholds.thread_growth:
+        failures.append(f"The thread count grew by {growth}, more than {thresholds.thread_growth}")
+    drift = final.cycle_ms - baseline.cycle_ms
+    if drift > thresholds.cycle_drift_ms:
+        failures.append(f"The cycle time drifted by {drift:.2f} ms, more than {thresholds.cycle_drift_ms} ms")
+    growth = final.reads - baseline.reads
+    if growth > thresholds.read_growth:
+        failures.append(f"The read list grew by {growth} variables, more than {thresholds.read_growth}")
+    growth = final.history_buffers - baseline.history_buffers
+    if growth > thresholds.history_growth:
+        failures.append(f"The history grew by {growth} buffers, more than {thresholds.history_growth}")
+    growth = final.history_capacity - baseline.history_capacity
+    if growth > thresholds.history_capacity_growth:
+        failures.append(f"The history capacity grew by {growth} samples, more than {thresholds.history_capacity_growth}")
+    return failures
+
+
+class SoakHarness():
+    """
+    Runs the bridge against a StandInDriver for a long time while subscribers and reloads churn, and tracks
+    the resident set size, the tracemalloc allocations, the thread count, the time between read cycles, the size
+    of the read list and the number and capacity of the history buffers.
+
+    Besides a steady workload of writes and data callbacks, the harness repeats, in turn:
+        - creating and dropping a Manager with init, data, subset and history registrations,
+        - re-pushing DATA_INIT, as opening the window does, which re-registers the same read variables,
+        - disabling and re-enabling communication, which ends and re-creates the I/O thread,
+        - a hot reload: cleaning up the service, and starting a new one with new Managers,
+        - adding a variable that was never read before to the read list and to the history, and switching the
+          trend to another new variable, as editing the Trend field of the window does.
+
+    The read list only grows until the next hot reload, so its growth stays within the variables added in one
+    reload period. The window itself is not covered, it needs omni.ui and a running Kit app: the UIBuilder
+    rebuild and cleanup are left to the UI tests.
+
+    The first samples are taken as a warmup, which lasts at least until the first hot reload, so that threads and
+    caches that are created lazily exist. Growth is measured from the end of the warmup to the end of the run.
+
+    Args:
+        duration (float, optional): The length of the run in seconds.
+        refresh_rate (int, optional): The REFRESH_RATE of the bridge in milliseconds.
+        variables (int, optional): The number of variables read every cycle.
+        churn_interval (float, optional): Seconds between churn steps.
+        sample_interval (float, optional): Seconds between samples.
+        warmup (float, optional): Seconds before the baseline sample. Defaults to a tenth of the duration.
+        thresholds (SoakThresholds, optional): The allowed growth.
+        trace_allocations (bool, optional): Set to False to not run tracemalloc, which slows down Python.
+        log (Callable, optional): Called with a line of text for every sample.
+
+    e.g.
+        report = SoakHarness(duration=4 * 3600).run()
+        print(report.summary())
+
+    """
+
+    def __init__(self, duration : float = 3600.0, refresh_rate : int = 10, variables : int = 100, churn_interval : float = 0.5,
+                 sample_interval : float = 10.0, warmup : float = None, thresholds : SoakThresholds = None,
+                 trace_allocations : bool = True, log = print):
+        self.duration = duration
+        self.refresh_rate = refresh_rate
+        self.variables = [f"MAIN.values[{i}]" for i in range(variables)]
+        self.churn_interval = churn_interval
+        self.sample_interval = sample_interval
+        self.warmup = max(duration / 10 if warmup is None else warmup, (RELOAD_STEPS + 1) * churn_interval)
+        self.thresholds = thresholds if thresholds is not None else SoakThresholds()
+        self.trace_allocations = trace_allocations
+        self.log = log
+
+        self._service = None
+        self._driver = None
+        self._manager = None
+        self._trend = None
+        self._added = 0
+        self._step = 0
+        self._cycles = 0
+        self._last_cycle = None
+        self._intervals = deque(maxlen=100000)
+
+    ####################################
+    # Run
+    ####################################
+
+    def run(self):
+        """
+        Runs the soak test for the duration.
+
+        Returns:
+            SoakReport: The samples and the exceeded thresholds.
+
+        """
+        started_tracing = self.trace_allocations and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        samples = []
+        baseline = None
+        baseline_allocations = None
+        try:
+            self._start_service()
+            start = time.perf_counter()
+            next_churn = start + self.churn_interval
+            next_sample = start + self.sample_interval
+            while True:
+                now = time.perf_counter()
+                if now - start >= self.duration:
+                    break
+                if now >= next_churn:
+                    self._churn()
+                    next_churn += self.churn_interval
+                if now >= next_sample:
+                    sample = self._sample(now - start)
+                    samples.append(sample)
+                    self.log(repr(sample))
+                    if baseline is None and now - start >= self.warmup:
+                        baseline = sample
+                        if tracemalloc.is_tracing():
+                            baseline_allocations = tracemalloc.take_snapshot()
+                    next_sample += self.sample_interval
+                time.sleep(max(0.0, min(next_churn, next_sample) - time.perf_counter()))
+
+            final = self._sample(time.perf_counter() - start)
+            samples.append(final)
+            if baseline is None:
+                baseline = samples[0]
+            top_allocators = []
+            if baseline_allocations is not None:
+                statistics = tracemalloc.take_snapshot().compare_to(baseline_allocations, "lineno")
+                top_allocators = [str(statistic) for statistic in statistics[:10]]
+            return SoakReport(samples, baseline, evaluate(baseline, final, self.thresholds), top_allocators)
+        finally:
+            self._stop_service()
+            if started_tracing:
+                tracemalloc.stop()
+
+    def _sample(self, elapsed : float):
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0] / 2**20 if tracemalloc.is_tracing() else 0.0
+        intervals = sorted(self._intervals)
+        self._intervals.clear()
+        history = self._service.history
+        return SoakSample(elapsed, _rss_mb(), traced, threading.active_count(), percentile(intervals, 0.5) * 1000, self._cycles,
+                          len(self._driver.read_names), len(history.names) if history is not None else 0,
+                          history.capacity if history is not None else 0)
+
+    ####################################
+    # Workload
+    ####################################
+
+    def _start_service(self):
+        settings = Settings({'ENABLE_COMMUNICATION': True, 'REFRESH_RATE': self.refresh_rate}, persistent=False)
+        self._driver = StandInDriver()
+        self._service = BridgeService(settings, self._driver, message_bus=False)
+        self._service.add_cycle_observer(self._on_cycle)
+        self._last_cycle = None
+        self._service.start()
+        self._manager = self._create_manager(persistent=True)
+
+    def _stop_service(self):
+        if self._service is None:
+            return
+        self._manager = None
+        self._trend = None
+        self._service.cleanup()
+        self._service = None
+        self._driver = None
+
+    def _create_manager(self, persistent : bool = False):
+        manager = Manager(self._service)
+        variables = self.variables
+        if persistent:
+            # The init subscription references the Manager, which keeps it alive until the service is cleaned up
+            manager.register_init_callback(lambda event: manager.add_cyclic_read_variables(variables))
+        else:
+            manager.add_cyclic_read_variables(variables)
+        manager.register_data_callback(_consume)
+        manager.register_data_callback(_consume, variables=variables[:3])
+        manager.add_history(variables[:2], depth=100)
+        return manager
+
+    def _on_cycle(self, snapshot, timing):
+        # Called on the I/O thread after every read
+        now = time.perf_counter()
+        if self._last_cycle is not None:
+            self._intervals.append(now - self._last_cycle)
+        self._last_cycle = now
+        self._cycles += 1
+
+    def _churn(self):
+        step = self._step
+        self._step += 1
+        self._manager.write_variables({name: (step + i) % 1000 for i, name in enumerate(self.variables[:10])})
+
+        action = step % 5
+        if action == 0:
+            # A short-lived Manager, cleaned up by __del__
+            manager = self._create_manager()
+            manager.get_history(self.variables[0])
+            del manager
+        elif action == 1:
+            # Opening the window re-pushes DATA_INIT
+            self._service.push_init()
+        elif action == 2:
+            self._service.enable_communication = False
+            self._last_cycle = None
+            self._service.enable_communication = True
+        elif action == 3 and step % RELOAD_STEPS == 3:
+            # Hot reload of the extension
+            self._stop_service()
+            self._start_service()
+        elif action == 4:
+            # New names every time, so caches keyed by variable name have to stay bounded as well
+            variable = f"MAIN.added[{self._added}]"
+            trend = f"MAIN.trend[{self._added}]"
+            self._added += 1
+            self._manager.add_cyclic_read_variables([variable])
+            self._manager.add_history([variable], depth=100)
+            if self._trend is not None:
+                self._service.remove_history([self._trend])
+            self._service.add_history([trend], cyclic=False)
+            self._trend = trend
+
+
+def _consume(event):
+    event.payload['data']
+
+
+def main(argv = None):
+    """
+    Runs a soak test from the command line, and returns 1 if a threshold was exceeded.
+
+    e.g.
+        python -m loupe.simulation.beckhoff_bridge.soak --hours 4
+
+    """
+    parser = argparse.ArgumentParser(description="Soak test of the Beckhoff Bridge against a stand-in PLC")
+    parser.add_argument("--hours", type=float, default=1.0, help="length of the run")
+    parser.add_argument("--refresh-rate", type=int, default=10, help="REFRESH_RATE in milliseconds")
+    parser.add_argument("--variables", type=int, default=100, help="number of variables read every cycle")
+    parser.add_argument("--sample-interval", type=float, default=10.0, help="seconds between samples")
+    parser.add_argument("--max-rss-growth", type=float, default=50.0, help="allowed RSS growth in MB")
+    parser.add_argument("--max-traced-growth", type=float, default=20.0, help="allowed tracemalloc growth in MB")
+    parser.add_argument("--max-thread-growth", type=int, default=2, help="allowed growth of the thread count")
+    parser.add_argument("--max-cycle-drift", type=float, default=5.0, help="allowed drift of the cycle time in ms")
+    parser.add_argument("--max-read-growth", type=int, default=10, help="allowed growth of the read list")
+    parser.add_argument("--max-history-growth", type=int, default=10, help="allowed growth of the number of history buffers")
+    parser.add_argument("--max-history-capacity-growth", type=int, default=10000, help="allowed growth of the history capacity in samples")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="do not trace allocations")
+    args = parser.parse_args(argv)
+
+    thresholds = SoakThresholds(args.max_rss_growth, args.max_traced_growth, args.max_thread_growth, args.max_cycle_drift,
+                                args.max_read_growth, args.max_history_growth, args.max_history_capacity_growth)
+    harness = SoakHarness(duration=args.hours * 3600, refresh_rate=args.refresh_rate, variables=args.variables,
+                          sample_interval=args.sample_interval, thresholds=thresholds, trace_allocations=not args.no_tracemalloc)
+    report = harness.run()
+    print(report.summary())
+    return 0 if report.passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+'''
+  File: **stand_in_ams.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import asyncio
+import struct
+import threading
+import time
+
+from .ads_driver import split_port
+from .ams_client import (
+    AmsSymbol, plc_codec, net_id_bytes,
+    ADSCOMMAND_READ, ADSCOMMAND_WRITE, ADSCOMMAND_READSTATE, ADSCOMMAND_READWRITE,
+    ADSCOMMAND_ADDDEVICENOTE, ADSCOMMAND_DELDEVICENOTE, ADSCOMMAND_DEVICENOTE,
+    ADSIGRP_SYM_VERSION, ADSIGRP_SYM_INFOBYNAMEEX, ADSIGRP_SYM_UPLOAD, ADSIGRP_SYM_UPLOADINFO2,
+    ADSIGRP_SUMUP_READ, ADSIGRP_SUMUP_WRITE, ADSIGRP_SUMUP_READWRITE,
+    STATE_REQUEST, STATE_RESPONSE, STRING_ENCODING,
+)
+
+# The index group of PLC memory
+ADSIGRP_PLC_MEMORY = 0x4020
+
+# ADS states
+ADSSTATE_RUN = 5
+
+# FILETIME of 1970-01-01
+_FILETIME_EPOCH = 116444736000000000
+
+_TCP_HEADER = struct.Struct("<HI")
+_AMS_HEADER = struct.Struct("<6sH6sHHHIII")
+_U32 = struct.Struct("<I")
+_ITEM = struct.Struct("<III")
+_READ_WRITE_ITEM = struct.Struct("<IIII")
+
+
+class StandInAmsServer():
+    """
+    A local AMS/TCP server that answers ADS requests from an in-memory symbol table, used to run the AmsClient and
+    the asyncio backend of AdsDriver without a PLC, e.g. in tests and CI.
+
+    It serves reads and writes of PLC memory, the symbol services, sum reads, writes and read-writes, the symbol
+    version and on-change notifications. The server runs its own event loop in a background thread.
+
+    Args:
+        symbols (dict): The variables and their PLC types and initial values. Names can have a port qualifier.
+            {'MAIN.speed': ('LREAL', 0.0), '852:MAIN.count': ('UDINT', 0)}
+        ams_net_id (str, optional): The AMS Net ID of the server.
+        port (int, optional): The ADS port of names without a port qualifier.
+        response_delay (float, optional): Seconds each response is delayed, without delaying other requests,
+            to simulate the round trip of a network.
+        combined_writes (bool, optional): Whether read-write commands on PLC memory write and then read it. If False,
+            they fail with "Service is not supported", like on targets that only write through write commands.
+
+    e.g.
+        server = StandInAmsServer({'MAIN.speed': ('LREAL', 1.5)})
+        host, tcp_port = server.start()
+        driver = AdsDriver('127.0.0.1.1.1', backend='asyncio', backend_options={'tcp_port': tcp_port})
+
+    """
+
+    def __init__(self, symbols : dict, ams_net_id : str = "127.0.0.1.1.1", port : int = 851, response_delay : float = 0.0,
+                 combined_writes : bool = True):
+        self.ams_net_id = ams_net_id
+        self.port = port
+        self.response_delay = response_delay
+        self.combined_writes = combined_writes
+        self.requests = 0
+        self.version = 1
+
+        self._net_id = net_id_bytes(ams_net_id)
+        self._lock = threading.Lock()
+        # Per ADS port: the symbols by name, in layout order, and the memory they are laid out in
+        self._symbols = dict()
+        self._memory = dict()
+        self._notifications = dict()
+        self._next_handle = 1
+        # The AMS address of each connected client, which notifications are sent to
+        self._clients = dict()
+
+        values = dict()
+        for qualified_name, (symbol_type, value) in symbols.items():
+            ads_port, name = split_port(qualified_name, port)
+            size = plc_codec(symbol_type).size
+            self._symbols.setdefault(ads_port, dict())[name] = AmsSymbol(name, ADSIGRP_PLC_MEMORY, 0, size, symbol_type)
+            values[(ads_port, name)] = value
+        for ads_port in self._symbols:
+            self._layout(ads_port, list(self._symbols[ads_port]))
+        for (ads_port, name), value in values.items():
+            self._store(ads_port, name, value)
+
+        self._loop = None
+        self._thread = None
+        self._server = None
+
+    ####################################
+    # Lifecycle
+    ####################################
+
+    def start(self):
+        """
+        Starts serving on a free TCP port of 127.0.0.1.
+
+        Returns:
+            tuple[str, int]: The host and the TCP port.
+
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="StandInAmsServer", daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._serve, "127.0.0.1", 0), self._loop).result()
+        return self._server.sockets[0].getsockname()[:2]
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def close():
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    ####################################
+    # Memory
+    ####################################
+
+    def _layout(self, ads_port, names):
+        offset = 0
+        for name in names:
+            symbol = self._symbols[ads_port][name]
+            symbol.index_offset = offset
+            offset += symbol.size
+        self._memory[ads_port] = bytearray(offset)
+
+    def _store(self, ads_port, name, value):
+        symbol = self._symbols[ads_port][name]
+        self._memory[ads_port][symbol.index_offset:symbol.index_offset + symbol.size] = symbol.codec.encode(value)
+
+    def get(self, name : str):
+        """
+        Returns the value of a variable.
+        """
+        ads_port, bare_name = split_port(name, self.port)
+        with self._lock:
+            symbol = self._symbols[ads_port][bare_name]
+            return symbol.codec.decode(memoryview(self._memory[ads_port]), symbol.index_offset)
+
+    def set(self, name : str, value):
+        """
+        Sets the value of a variable, like the PLC program would, and sends the notifications of changed values.
+        """
+        ads_port, bare_name = split_port(name, self.port)
+        with self._lock:
+            self._store(ads_port, bare_name, value)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._send_notifications)
+
+    def online_change(self):
+        """
+        Moves every variable to a new address and increments the symbol version, like an online change that
+        adds variables would. Values are kept.
+        """
+        with self._lock:
+            for ads_port, symbols in self._symbols.items():
+                values = {name: symbol.codec.decode(memoryview(self._memory[ads_port]), symbol.index_offset)
+                          for name, symbol in symbols.items()}
+                self._layout(ads_port, list(reversed(list(symbols))))
+                for name, value in values.items():
+                    self._store(ads_port, name, value)
+            self.version = (self.version + 1) % 256
+
+    ####################################
+    # Protocol
+    ####################################
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                _, length = _TCP_HEADER.unpack(await reader.readexactly(_TCP_HEADER.size))
+                frame = await reader.readexactly(length)
+                (target, target_port, source, source_port, command, _, data_length, _, invoke_id) = _AMS_HEADER.unpack_from(frame)
+                data = memoryview(frame)[_AMS_HEADER.size:_AMS_HEADER.size + data_length]
+                self.requests += 1
+                self._clients[writer] = (source, source_port)
+                with self._lock:
+                    response, changed = self._handle(target_port, command, data, writer)
+                header = _AMS_HEADER.pack(source, source_port, target, target_port, command, STATE_RESPONSE,
+                                          len(response), 0, invoke_id)
+                message = _TCP_HEADER.pack(0, len(header) + len(response)) + header + response
+                if self.response_delay > 0:
+                    self._loop.call_later(self.response_delay, self._send, writer, message)
+                else:
+                    self._send(writer, message)
+                if changed:
+                    self._send_notifications()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._notifications = {handle: entry for handle, entry in self._notifications.items() if entry[0] is not writer}
+            self._clients.pop(writer, None)
+            writer.close()
+
+    def _send(self, writer, message):
+        if not writer.is_closing():
+            writer.write(message)
+
+    def _handle(self, ads_port, command, data, writer):
+        """
+        Returns the response data of a request, and whether it changed PLC memory.
+        """
+        if ads_port not in self._symbols:
+            return _U32.pack(0x6), False
+
+        if command == ADSCOMMAND_READSTATE:
+            return struct.pack("<IHH", 0, ADSSTATE_RUN, 0), False
+
+        if command == ADSCOMMAND_READ:
+            index_group, index_offset, length = _ITEM.unpack_from(data)
+            error, result = self._read(ads_port, index_group, index_offset, length)
+            return struct.pack("<II", error, len(result)) + result, False
+
+        if command == ADSCOMMAND_WRITE:
+            index_group, index_offset, length = _ITEM.unpack_from(data)
+            error = self._write(ads_port, index_group, index_offset, data[_ITEM.size:_ITEM.size + length])
+            return _U32.pack(error), error == 0
+
+        if command == ADSCOMMAND_READWRITE:
+            index_group, index_offset, read_length, write_length = struct.unpack_from("<IIII", data)
+            error, result, changed = self._read_write(ads_port, index_group, index_offset, read_length, data[16:16 + write_length])
+            return struct.pack("<II", error, len(result)) + result, changed
+
+        if command == ADSCOMMAND_ADDDEVICENOTE:
+            index_group, index_offset, length = _ITEM.unpack_from(data)
+            error, _ = self._read(ads_port, index_group, index_offset, length)
+            if error:
+                return struct.pack("<II", error, 0), False
+            handle = self._next_handle
+            self._next_handle += 1
+            # None as the last value makes the first check send the current value
+            self._notifications[handle] = (writer, ads_port, index_group, index_offset, length, None)
+            self._loop.call_soon(self._send_notifications)
+            return struct.pack("<II", 0, handle), False
+
+        if command == ADSCOMMAND_DELDEVICENOTE:
+            handle = _U32.unpack_from(data)[0]
+            if self._notifications.pop(handle, None) is None:
+                return _U32.pack(0x714), False
+            return _U32.pack(0), False
+
+        return _U32.pack(0x701), False
+
+    def _read(self, ads_port, index_group, index_offset, length):
+        if index_group == ADSIGRP_PLC_MEMORY:
+            memory = self._memory[ads_port]
+            if index_offset + length > len(memory):
+                return 0x703, b""
+            return 0, bytes(memory[index_offset:index_offset + length])
+        if index_group == ADSIGRP_SYM_VERSION:
+            return 0, bytes([self.version])
+        if index_group == ADSIGRP_SYM_UPLOADINFO2:
+            entries = self._symbol_entries(ads_port)
+            return 0, struct.pack("<IIIIII", len(self._symbols[ads_port]), len(entries), 0, 0, 0, 0)[:length]
+        if index_group == ADSIGRP_SYM_UPLOAD:
+            return 0, self._symbol_entries(ads_port)[:length]
+        return 0x702, b""
+
+    def _write(self, ads_port, index_group, index_offset, data):
+        if index_group != ADSIGRP_PLC_MEMORY:
+            return 0x702
+        memory = self._memory[ads_port]
+        if index_offset + len(data) > len(memory):
+            return 0x703
+        memory[index_offset:index_offset + len(data)] = data
+        return 0
+
+    def _read_write(self, ads_port, index_group, index_offset, read_length, data):
+        if index_group == ADSIGRP_SYM_INFOBYNAMEEX:
+            name = bytes(data).split(b"\0", 1)[0].decode(STRING_ENCODING)
+            symbol = self._symbols[ads_port].get(name)
+            if symbol is None:
+                return 0x710, b"", False
+            return 0, symbol.pack()[:read_length], False
+
+        if index_group == ADSIGRP_PLC_MEMORY:
+            if not self.combined_writes:
+                return 0x701, b"", False
+            error = self._write(ads_port, index_group, index_offset, data) if len(data) else 0
+            if error:
+                return error, b"", False
+            error, result = self._read(ads_port, index_group, index_offset, read_length)
+            return error, result, len(data) > 0
+
+        if index_group == ADSIGRP_SUMUP_READ:
+            errors = []
+            results = []
+            for i in range(index_offset):
+                item_group, item_offset, length = _ITEM.unpack_from(data, i * _ITEM.size)
+                error, result = self._read(ads_port, item_group, item_offset, length)
+                errors.append(error)
+                results.append(result if not error else bytes(length))
+            return 0, b"".join(_U32.pack(error) for error in errors) + b"".join(results), False
+
+        if index_group == ADSIGRP_SUMUP_WRITE:
+            errors = []
+            offset = index_offset * _ITEM.size
+            for i in range(index_offset):
+                item_group, item_offset, length = _ITEM.unpack_from(data, i * _ITEM.size)
+                errors.append(self._write(ads_port, item_group, item_offset, data[offset:offset + length]))
+                offset += length
+            return 0, b"".join(_U32.pack(error) for error in errors), True
+
+        if index_group == ADSIGRP_SUMUP_READWRITE:
+            headers = []
+            results = []
+            changed = False
+            offset = index_offset * _READ_WRITE_ITEM.size
+            for i in range(index_offset):
+                item_group, item_offset, length, write_length = _READ_WRITE_ITEM.unpack_from(data, i * _READ_WRITE_ITEM.size)
+                error, result, item_changed = self._read_write(ads_port, item_group, item_offset, length, data[offset:offset + write_length])
+                offset += write_length
+                changed = changed or item_changed
+                headers.append(struct.pack("<II", error, len(result)))
+                results.append(result)
+            return 0, b"".join(headers) + b"".join(results), changed
+
+        return 0x702, b"", False
+
+    def _symbol_entries(self, ads_port):
+        return b"".join(symbol.pack() for symbol in self._symbols[ads_port].values())
+
+    def _send_notifications(self):
+        """
+        Sends the notifications whose memory area changed since it was last sent.
+        """
+        timestamp = int(time.time() * 10**7) + _FILETIME_EPOCH
+        with self._lock:
+            for handle, (writer, ads_port, index_group, index_offset, length, last) in list(self._notifications.items()):
+                _, value = self._read(ads_port, index_group, index_offset, length)
+                if value == last:
+                    continue
+                self._notifications[handle] = (writer, ads_port, index_group, index_offset, length, value)
+                sample = struct.pack("<II", handle, len(value)) + value
+                stamp = struct.pack("<QI", timestamp, 1) + sample
+                data = struct.pack("<II", len(stamp) + 4, 1) + stamp
+                client_net_id, client_port = self._clients[writer]
+                header = _AMS_HEADER.pack(client_net_id, client_port, self._net_id, ads_port, ADSCOMMAND_DEVICENOTE,
+                                          STATE_REQUEST, len(data), 0, 0)
+                self._send(writer, _TCP_HEADER.pack(0, len(header) + len(data)) + header + data)
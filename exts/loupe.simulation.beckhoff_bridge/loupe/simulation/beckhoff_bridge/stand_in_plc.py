@@ -0,0 +1,103 @@
+'''
+  File: **stand_in_plc.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+from .flat_data import ReadIndex, FlatSnapshot
+
+
+class StandInDriver():
+    """
+    An in-memory stand-in for a PLC, used to run the bridge without a target device, e.g. in tests and CI.
+    Implements the driver interface of AdsDriver on top of a dictionary.
+    Written values are read back, and unknown variables read as 0.
+
+    e.g.
+        service = BridgeService(Settings({'ENABLE_COMMUNICATION': True}, persistent=False), StandInDriver())
+
+    Args:
+        echo (dict, optional): Variables that are copied to other variables after every write, like a PLC task would.
+            {'MAIN.echo_out': 'MAIN.echo_in'}
+    """
+
+    def __init__(self, ams_net_id = '127.0.0.1.1.1', echo = None):
+        self.ams_net_id = ams_net_id
+        self.echo = echo or dict()
+        self.memory = dict()
+        self.connected = False
+        self.write_count = 0
+        self.read_count = 0
+        self._read_names = list()
+        self._read_index = ReadIndex(self._read_names)
+
+    @property
+    def read_names(self):
+        """
+        The names in the cyclic read list.
+        """
+        return self._read_index.names
+
+    def add_read(self, name, structure_def = None):
+        if name not in self._read_names:
+            self._read_names.append(name)
+            self._read_index = ReadIndex(self._read_names)
+
+    def connect(self, ams_net_id = None):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def check_online_change(self):
+        return False
+
+    def write_data(self, data):
+        self.write_count += 1
+        self.memory.update(data)
+        for target, source in self.echo.items():
+            self.memory[target] = self.memory.get(source, 0)
+
+    def read_table(self):
+        self.read_count += 1
+        index = self._read_index
+        return FlatSnapshot(index, [self.memory.get(name, 0) for name in index.names])
+
+    def exchange(self, values):
+        error = None
+        if values:
+            try:
+                self.write_data(values)
+            except Exception as e:
+                error = e
+        return self.read_table(), error
+
+    def read_values(self, names):
+        return [self.memory.get(name, 0) for name in names]
+
+    def read_data(self):
+        return self.read_table().to_dict()
+
+    def get_array_length(self, name):
+        return len(self.memory[name])
+
+    def read_array_bytes(self, name, start, count, element_size):
+        # Arrays are stored as NumPy arrays
+        return self.memory[name][start:start + count].tobytes()
+
+    def write_array(self, name, values, offset = 0):
+        # Like the PLC, the existing array fixes the dtype and the length
+        target = self.memory[name].reshape(-1)
+        if values.dtype != target.dtype:
+            raise TypeError(f"Cannot write {values.dtype} to {name}, which is an array of {target.dtype}")
+        values = values.reshape(-1)
+        if offset < 0 or offset + len(values) > len(target):
+            raise ValueError(f"Elements {offset} to {offset + len(values) - 1} do not fit into {name}, which has {len(target)}")
+        self.write_count += 1
+        target[offset:offset + len(values)] = values
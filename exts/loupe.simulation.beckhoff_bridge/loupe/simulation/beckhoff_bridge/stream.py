@@ -0,0 +1,170 @@
+'''
+  File: **stream.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import time
+
+import numpy as np
+
+# Offsets and scales that convert PLC timestamps to time.time() seconds
+TIME_FORMATS = {
+    # F_GetSystemTime(): 100 ns since 1601-01-01
+    "filetime": (116444736000000000, 1e-7),
+    # F_GetActualDcTime64(): 1 ns since 2000-01-01
+    "dc": (-946684800 * 10**9, 1e-9),
+}
+
+# The write counter is a UDINT, which wraps around
+COUNTER_MODULO = 2**32
+
+# Seconds to wait before a stream whose read failed is opened again
+DEFAULT_RETRY_INTERVAL = 1.0
+
+
+class StreamBatch():
+    """
+    The samples a stream received in one bridge cycle.
+
+    Args:
+        stream (str): The name of the stream.
+        samples (numpy.ndarray): The new samples, oldest first, decoded with the dtype of the stream.
+        timestamps (numpy.ndarray): The PLC timestamps of the samples in time.time() seconds, or None.
+        lost (int): The number of samples that were overwritten on the PLC before they could be read.
+
+    """
+
+    __slots__ = ("stream", "samples", "timestamps", "lost")
+
+    def __init__(self, stream : str, samples, timestamps = None, lost : int = 0):
+        self.stream = stream
+        self.samples = samples
+        self.timestamps = timestamps
+        self.lost = lost
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class StreamReader():
+    """
+    Reads the new entries of a ring buffer that the PLC fills faster than the bridge polls.
+
+    The PLC writes each sample to `buffer[counter MOD length]`, and then increments `counter`, a UDINT that counts
+    every sample written. Every bridge cycle, the counter is read with the other variables, and only the entries
+    written since the last cycle are fetched, in at most two contiguous raw reads.
+
+    e.g. PLC code, called every 1 ms task cycle
+        buffer[count MOD 1000].timestamp := F_GetSystemTime();
+        buffer[count MOD 1000].position := axis.NcToPlc.ActPos;
+        count := count + 1;
+
+    Args:
+        name (str): The name of the stream, used in the events.
+        buffer (str): The name of the one-dimensional array on the PLC. "MAIN.buffer"
+        counter (str): The name of the UDINT write counter on the PLC. "MAIN.count"
+        dtype (numpy.dtype): The layout of one array element, with the PLC's packing.
+            np.dtype([('timestamp', '<u8'), ('position', '<f8')])
+        time_field (str, optional): The field of dtype that holds the PLC timestamp.
+        time_format (str, optional): The format of the timestamp, one of TIME_FORMATS.
+        retry_interval (float, optional): Seconds to wait before a stream whose read failed is opened again.
+
+    Attributes:
+        error (str): The error of the last poll, or None if it succeeded.
+
+    """
+
+    def __init__(self, name : str, buffer : str, counter : str, dtype, time_field : str = None, time_format : str = "filetime",
+                 retry_interval : float = DEFAULT_RETRY_INTERVAL):
+        self.name = name
+        self.buffer = buffer
+        self.counter = counter
+        self.dtype = np.dtype(dtype)
+        if time_field is not None and time_field not in (self.dtype.names or ()):
+            raise ValueError(f"The dtype of stream {name} has no field {time_field}")
+        if time_format not in TIME_FORMATS:
+            raise ValueError(f"Unknown time format: {time_format}")
+        self.time_field = time_field
+        self.time_format = time_format
+        self.retry_interval = retry_interval
+        self.error = None
+        self._length = None
+        self._last_count = None
+        self._retry_time = 0.0
+
+    def reset(self):
+        """
+        Forgets the array layout and the read position, e.g. after an online change or a read error.
+        The next poll starts from the current counter, without a backlog.
+        """
+        self._length = None
+        self._last_count = None
+
+    def poll(self, count, driver):
+        """
+        Fetches and decodes the entries written since the last poll.
+
+        Args:
+            count (int): The current value of the write counter.
+            driver: The driver, with get_array_length(name) and read_array_bytes(name, start, count, element_size).
+
+        Returns:
+            StreamBatch: The new samples, or None if there are none, or the stream is waiting to be opened again.
+
+        Raises:
+            Exception: The error of the driver. The stream is then reset, and opened again after the retry interval.
+
+        """
+        if not isinstance(count, int):
+            return None
+        if self._length is None and time.monotonic() < self._retry_time:
+            return None
+        try:
+            batch = self._poll(count, driver)
+        except Exception as e:
+            self.reset()
+            self.error = str(e)
+            self._retry_time = time.monotonic() + self.retry_interval
+            raise
+        self.error = None
+        return batch
+
+    def _poll(self, count, driver):
+        if self._length is None:
+            self._length = driver.get_array_length(self.buffer)
+        if self._last_count is None:
+            self._last_count = count
+            return None
+
+        new = (count - self._last_count) % COUNTER_MODULO
+        if new == 0:
+            return None
+        if new > COUNTER_MODULO // 2:
+            # The counter went backwards, so the PLC was restarted: continue from its current position
+            new = count
+        self._last_count = count
+        if new == 0:
+            return None
+
+        lost = max(0, new - self._length)
+        new = min(new, self._length)
+        start = (count - new) % self._length
+        first = min(new, self._length - start)
+
+        size = self.dtype.itemsize
+        data = driver.read_array_bytes(self.buffer, start, first, size)
+        if first < new:
+            data += driver.read_array_bytes(self.buffer, 0, new - first, size)
+
+        samples = np.frombuffer(data, dtype=self.dtype, count=new)
+        return StreamBatch(self.name, samples, self._timestamps(samples), lost)
+
+    def _timestamps(self, samples):
+        if self.time_field is None:
+            return None
+        offset, scale = TIME_FORMATS[self.time_format]
+        return (samples[self.time_field].astype(np.int64) - offset) * scale
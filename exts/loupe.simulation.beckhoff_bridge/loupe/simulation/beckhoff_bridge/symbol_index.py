@@ -0,0 +1,219 @@
+'''
+  File: **symbol_index.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import re
+from fnmatch import fnmatchcase
+from itertools import product
+
+_ARRAY_TYPE = re.compile(r"^\s*ARRAY\s*\[([^\]]+)\]\s*OF\s+(.*?)\s*$", re.IGNORECASE)
+_STRING_TYPE = re.compile(r"^STRING(?:\s*[\(\[]\s*(\d+)\s*[\)\]])?$", re.IGNORECASE)
+
+# NumPy dtypes of the elementary PLC types, as laid out in PLC memory
+PLC_TYPE_DTYPES = {
+    "BOOL": "?",
+    "BYTE": "u1", "USINT": "u1", "SINT": "i1",
+    "WORD": "<u2", "UINT": "<u2", "INT": "<i2",
+    "DWORD": "<u4", "UDINT": "<u4", "DINT": "<i4",
+    "LWORD": "<u8", "ULINT": "<u8", "LINT": "<i8",
+    "REAL": "<f4", "LREAL": "<f8",
+    "TIME": "<u4", "TOD": "<u4", "TIME_OF_DAY": "<u4", "DATE": "<u4", "DT": "<u4", "DATE_AND_TIME": "<u4",
+    "LTIME": "<u8",
+}
+_SEGMENT = re.compile(r"^([^\[\]]*)(?:\[([^\]]*)\])?$")
+
+def is_pattern(name : str):
+    """
+    Returns True if a variable name contains wildcards and has to be expanded against the symbol table.
+    """
+    return '*' in name or '?' in name
+
+def parse_array_bounds(symbol_type : str):
+    """
+    Parses the bounds of an ADS array type.
+
+    Args:
+        symbol_type (str): The type string from the symbol table. "ARRAY [0..3,1..2] OF ST_Axis"
+
+    Returns:
+        list[tuple[int, int]]: Inclusive (low, high) bounds per dimension, or None if the type is not an array.
+
+    """
+    match = _ARRAY_TYPE.match(symbol_type or "")
+    if match is None:
+        return None
+    bounds = []
+    for dimension in match.group(1).split(','):
+        low, high = dimension.split('..')
+        bounds.append((int(low), int(high)))
+    return bounds
+
+def parse_array_element_type(symbol_type : str):
+    """
+    Returns the element type of an ADS array type, or None if the type is not an array.
+    "ARRAY [0..3] OF LREAL" -> "LREAL"
+    """
+    match = _ARRAY_TYPE.match(symbol_type or "")
+    if match is None:
+        return None
+    return match.group(2)
+
+def plc_type_dtype(plc_type : str):
+    """
+    Returns the NumPy dtype string of an elementary PLC type, or None for structures and other types.
+    A STRING(n) is n + 1 bytes, including its terminating null. "LREAL" -> "<f8", "STRING(10)" -> "S11"
+    """
+    plc_type = (plc_type or "").strip()
+    dtype = PLC_TYPE_DTYPES.get(plc_type.upper())
+    if dtype is not None:
+        return dtype
+    match = _STRING_TYPE.match(plc_type)
+    if match is not None:
+        return "S" + str(int(match.group(1) or 80) + 1)
+    return None
+
+
+class _TrieNode():
+    """
+    One name segment of the symbol table. A node is a symbol if it has a full name.
+    """
+
+    __slots__ = ("children", "segment", "name", "bounds")
+
+    def __init__(self, segment : str):
+        self.children = dict()
+        self.segment = segment
+        self.name = None
+        self.bounds = None
+
+
+class SymbolIndex():
+    """
+    A prefix tree over the PLC symbol table, used to expand wildcard subscriptions.
+
+    Names are split on '.', and matching is case-insensitive like TwinCAT itself. Pattern segments can use
+    shell-style wildcards ('*', '?'), array symbols can be indexed with '[*]' to expand over every element,
+    and a trailing '*' segment matches every symbol below its prefix.
+
+    e.g.
+        'GVL_Robot.*'            every symbol in GVL_Robot
+        'MAIN.axis[*].position'  the position member of every element of MAIN.axis
+        'MAIN.sensor_?'          MAIN.sensor_1 ... MAIN.sensor_9
+
+    Members below a symbol (like '.position' above) are not part of the symbol table, so they are appended
+    literally. Wildcards in those members cannot be expanded.
+
+    Args:
+        symbols (iterable[tuple[str, str]]): (name, type) pairs from the symbol table.
+
+    """
+
+    def __init__(self, symbols = ()):
+        self._root = _TrieNode("")
+        self._size = 0
+        for name, symbol_type in symbols:
+            self.add(name, symbol_type)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, name : str, symbol_type : str = None):
+        """
+        Adds one symbol to the index.
+
+        Args:
+            name (str): The full symbol name. "MAIN.axis"
+            symbol_type (str, optional): The symbol type, used for array bounds. "ARRAY [0..3] OF ST_Axis"
+
+        """
+        node = self._root
+        for segment in name.split('.'):
+            key = segment.lower()
+            child = node.children.get(key)
+            if child is None:
+                child = _TrieNode(segment)
+                node.children[key] = child
+            node = child
+        if node.name is None:
+            self._size += 1
+        node.name = name
+        node.bounds = parse_array_bounds(symbol_type)
+
+    def expand(self, pattern : str):
+        """
+        Expands a wildcard pattern into the matching variable names.
+
+        Args:
+            pattern (str): The pattern. "MAIN.axis[*].position"
+
+        Returns:
+            list[str]: The matching names, in symbol table order.
+
+        """
+        segments = pattern.split('.')
+        results = []
+        self._expand(self._root, segments, 0, "", results)
+        return results
+
+    def _expand(self, node, segments, position, prefix, results):
+        if position == len(segments):
+            if node.name is not None:
+                results.append(prefix)
+            return
+
+        segment = segments[position]
+        is_last = position == len(segments) - 1
+
+        # A trailing '*' is a prefix subscription: every symbol below this node
+        if is_last and segment == '*':
+            self._collect(node, prefix, results)
+            return
+
+        match = _SEGMENT.match(segment)
+        if match is None:
+            return
+        base, index = match.groups()
+
+        if is_pattern(base):
+            children = [child for key, child in node.children.items() if fnmatchcase(key, base.lower())]
+        else:
+            child = node.children.get(base.lower())
+            children = [] if child is None else [child]
+
+        for child in children:
+            name = child.segment if not prefix else prefix + '.' + child.segment
+            if index is None and child.name is not None and not child.children and not is_last:
+                self._append_members(segments[position + 1:], name, results)
+            elif index is None:
+                self._expand(child, segments, position + 1, name, results)
+            elif child.name is not None:
+                for element in self._expand_index(child, index):
+                    self._append_members(segments[position + 1:], name + element, results)
+
+    def _expand_index(self, node, index):
+        parts = [part.strip() for part in index.split(',')]
+        if '*' not in parts:
+            return ['[' + ','.join(parts) + ']']
+        if node.bounds is None or len(node.bounds) != len(parts):
+            return []
+        ranges = []
+        for part, (low, high) in zip(parts, node.bounds):
+            ranges.append(range(low, high + 1) if part == '*' else [int(part)])
+        return ['[' + ','.join(str(i) for i in element) + ']' for element in product(*ranges)]
+
+    def _append_members(self, members, name, results):
+        if any(is_pattern(member) for member in members):
+            raise ValueError(f"Wildcards below an array element cannot be expanded: {'.'.join(members)}")
+        results.append('.'.join([name] + members))
+
+    def _collect(self, node, prefix, results):
+        for child in node.children.values():
+            name = child.segment if not prefix else prefix + '.' + child.segment
+            if child.name is not None:
+                results.append(name)
+            self._collect(child, name, results)
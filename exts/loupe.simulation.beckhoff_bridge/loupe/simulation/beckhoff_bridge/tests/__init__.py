@@ -1 +1,17 @@
 from .tests import *
+from .test_usd_bindings import *
+from .test_flat_data import *
+from .test_symbol_index import *
+from .test_tracer import *
+from .test_bridge_service import *
+from .test_dispatcher import *
+from .test_history import *
+from .test_stream import *
+from .test_latency_probe import *
+from .test_process_worker import *
+from .test_array_write import *
+from .test_adaptive_rate import *
+from .test_soak import *
+from .test_trigger import *
+from .test_ams_client import *
+from .test_interpolation import *
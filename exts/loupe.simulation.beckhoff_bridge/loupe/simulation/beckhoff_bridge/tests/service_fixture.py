@@ -0,0 +1,46 @@
+"""
+Shared fixture for the tests that run a BridgeService against a stand-in PLC
+"""
+
+import asyncio
+
+from loupe.simulation.beckhoff_bridge.bridge_service import BridgeService, Settings
+from loupe.simulation.beckhoff_bridge.BeckhoffBridge import Manager
+from loupe.simulation.beckhoff_bridge.stand_in_plc import StandInDriver
+
+DEFAULT_SETTINGS = {'ENABLE_COMMUNICATION': True, 'REFRESH_RATE': 10}
+
+
+def create_service(driver = None, **settings):
+    """
+    Creates a service without message bus, and the Manager on top of it. The service is not started.
+
+    Args:
+        driver: The driver the service reads through, a new StandInDriver by default.
+        **settings: Settings added to or overriding DEFAULT_SETTINGS.
+
+    Returns:
+        tuple: The driver, the service and the manager.
+    """
+    if driver is None:
+        driver = StandInDriver()
+    service = BridgeService(Settings({**DEFAULT_SETTINGS, **settings}, persistent=False), driver, message_bus=False)
+    return driver, service, Manager(service)
+
+
+async def wait_for(condition, timeout = 3.0):
+    """
+    Polls a condition every 10 ms until it holds or the timeout expires.
+
+    Args:
+        condition (callable): Returns True once the awaited state is reached.
+        timeout (float): The time in seconds to wait for.
+
+    Returns:
+        bool: Whether the condition held before the timeout.
+    """
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return False
@@ -0,0 +1,86 @@
+"""
+Test the adaptive refresh rate controller and its use by the bridge service
+"""
+
+import time
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.adaptive_rate import AdaptiveRate
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+
+class TestAdaptiveRate(omni.kit.test.AsyncTestCase):
+    """Tests for the rate chosen from cycle cost and demand."""
+
+    def test_demand_runs_at_min_rate(self):
+        controller = AdaptiveRate(min_rate=10, max_rate=1000)
+        self.assertEqual(controller.update(1.0, demand=True), 10)
+
+    def test_backs_off_without_demand(self):
+        controller = AdaptiveRate(min_rate=10, max_rate=100, backoff=2.0)
+        rates = [controller.update(1.0, demand=False) for _ in range(5)]
+        self.assertEqual(rates, [20, 40, 80, 100, 100])
+        self.assertEqual(controller.update(1.0, demand=True), 10)
+
+    def test_paused_runs_at_max_rate(self):
+        controller = AdaptiveRate(min_rate=10, max_rate=500)
+        self.assertEqual(controller.update(1.0, demand=True, paused=True), 500)
+
+    def test_budget(self):
+        # Cycles of 10 ms within a budget of 25 % need at least 40 ms between them
+        controller = AdaptiveRate(min_rate=10, max_rate=1000, budget=0.25)
+        self.assertEqual(controller.update(10.0, demand=True), 40)
+        self.assertEqual(controller.cost, 10.0)
+
+    def test_limits(self):
+        controller = AdaptiveRate(min_rate=1, max_rate=100000)
+        self.assertEqual((controller.min_rate, controller.max_rate), (10, 10000))
+        with self.assertRaises(ValueError):
+            AdaptiveRate(budget=0.0)
+
+
+class TestServiceAdaptiveRate(omni.kit.test.AsyncTestCase):
+    """Tests for the adaptive rate of the I/O thread."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver, self.service, _ = create_service(REFRESH_RATE=20, ADAPTIVE_RATE=True, ADAPTIVE_MIN_RATE=10, ADAPTIVE_MAX_RATE=200)
+
+    async def tearDown(self):
+        self.service.cleanup()
+
+    async def test_backs_off_while_static(self):
+        self.service.add_read_variables(['MAIN.a'])
+        self.service.subscribe_data(lambda event: None)
+        self.service.start()
+        self.assertTrue(self.service.adaptive_rate)
+        self.assertTrue(await wait_for(lambda: self.service.effective_rate == 200))
+
+    async def test_speeds_up_on_change(self):
+        self.service.add_read_variables(['MAIN.a'])
+        self.service.subscribe_data(lambda event: None)
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.service.effective_rate == 200))
+        # Observers run before the rate is updated, so they see the rate chosen after the previous cycle
+        rates = []
+        self.service.add_cycle_observer(lambda snapshot, timing: rates.append(self.service.effective_rate))
+        # A write ends the long sleep, and the changed value speeds the bridge up
+        start = time.perf_counter()
+        self.service.queue_write('MAIN.a', 1)
+        self.assertTrue(await wait_for(lambda: self.driver.memory.get('MAIN.a') == 1))
+        self.assertLess(time.perf_counter() - start, 0.15)
+        self.assertTrue(await wait_for(lambda: 10 in rates))
+
+    async def test_paused(self):
+        self.service.add_read_variables(['MAIN.a'])
+        self.service.paused = True
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.service.effective_rate == 200))
+
+    async def test_fixed_rate(self):
+        self.service.adaptive_rate = False
+        self.service.add_read_variables(['MAIN.a'])
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.service.cycle_count > 3))
+        self.assertEqual(self.service.effective_rate, 20)
+        self.assertGreater(self.service.cycle_cost, 0.0)
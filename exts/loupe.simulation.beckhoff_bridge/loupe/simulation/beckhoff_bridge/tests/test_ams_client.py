@@ -0,0 +1,281 @@
+"""
+Test the asyncio AMS/TCP client against a stand-in AMS server
+"""
+
+import asyncio
+import ctypes
+import time
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.ads_driver import AdsDriver, ASYNCIO_BACKEND
+from loupe.simulation.beckhoff_bridge.ams_client import AmsClient, AmsConnection, AmsSymbol, AdsError, plc_codec
+from loupe.simulation.beckhoff_bridge.stand_in_ams import StandInAmsServer, ADSIGRP_PLC_MEMORY
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+# pylint: disable=W0212
+
+SYMBOLS = {
+    'MAIN.speed': ('LREAL', 1.5),
+    'MAIN.count': ('DINT', -3),
+    'MAIN.flag': ('BOOL', True),
+    'MAIN.name': ('STRING(10)', 'axis'),
+    'MAIN.positions': ('ARRAY [0..3] OF REAL', [0.5, 1.5, 2.5, 3.5]),
+    '852:MAIN.state': ('UINT', 7),
+}
+
+
+class TestPlcCodec(omni.kit.test.AsyncTestCase):
+    """Tests for decoding and encoding PLC values."""
+
+    def test_round_trip(self):
+        for symbol_type, value in [("LREAL", 2.5), ("DINT", -7), ("BOOL", True), ("USINT", 255),
+                                   ("STRING(5)", "abc"), ("WSTRING(4)", "äbc"), ("ARRAY [1..3] OF INT", [1, -2, 3]),
+                                   ("ARRAY [0..1] OF STRING(3)", ["ab", "cd"])]:
+            codec = plc_codec(symbol_type)
+            data = codec.encode(value)
+            self.assertEqual(len(data), codec.size)
+            self.assertEqual(codec.decode(memoryview(b"xx" + data), 2), value)
+
+    def test_sizes(self):
+        self.assertEqual(plc_codec("STRING").size, 81)
+        self.assertEqual(plc_codec("ARRAY [0..2,0..1] OF LREAL").size, 48)
+        self.assertEqual(plc_codec("STRING(3)").encode("abcdef"), b"abc\0")
+
+    def test_structures_are_raw(self):
+        codec = plc_codec("ST_Point", 16)
+        self.assertEqual(codec.decode(memoryview(bytes(range(16)))), bytes(range(16)))
+        with self.assertRaises(ValueError):
+            plc_codec("ST_Point")
+
+    def test_symbol_entry(self):
+        symbol = AmsSymbol("MAIN.speed", 0x4020, 16, 8, "LREAL", comment="mm/s")
+        parsed, length = AmsSymbol.unpack_from(memoryview(symbol.pack()))
+        self.assertEqual(length, len(symbol.pack()))
+        self.assertEqual((parsed.name, parsed.index_group, parsed.index_offset, parsed.size, parsed.symbol_type, parsed.comment),
+                         ("MAIN.speed", 0x4020, 16, 8, "LREAL", "mm/s"))
+
+
+class TestAmsConnection(omni.kit.test.AsyncTestCase):
+    """Tests for the pyads-compatible connection."""
+
+    # Run before every test
+    async def setUp(self):
+        self.server = StandInAmsServer(SYMBOLS)
+        _, self.tcp_port = self.server.start()
+        self.connection = AmsConnection('127.0.0.1.1.1', 851, tcp_port=self.tcp_port)
+        self.connection.open()
+
+    async def tearDown(self):
+        self.connection.close()
+        self.server.stop()
+
+    def test_read_list(self):
+        values = self.connection.read_list_by_name(['MAIN.speed', 'MAIN.count', 'MAIN.flag', 'MAIN.name', 'MAIN.positions'])
+        self.assertEqual(values, {'MAIN.speed': 1.5, 'MAIN.count': -3, 'MAIN.flag': True, 'MAIN.name': 'axis',
+                                  'MAIN.positions': [0.5, 1.5, 2.5, 3.5]})
+
+    def test_write_list(self):
+        self.connection.write_list_by_name({'MAIN.speed': 4.0, 'MAIN.name': 'spindle', 'MAIN.positions': [1, 2, 3, 4]})
+        self.assertEqual(self.server.get('MAIN.speed'), 4.0)
+        self.assertEqual(self.server.get('MAIN.name'), 'spindle')
+        self.assertEqual(self.server.get('MAIN.positions'), [1.0, 2.0, 3.0, 4.0])
+
+    def test_raw_read_and_write(self):
+        symbol = self.connection.get_symbol('MAIN.count')
+        self.assertEqual((symbol.index_group, symbol.size, symbol.symbol_type), (ADSIGRP_PLC_MEMORY, 4, 'DINT'))
+        self.assertEqual(self.connection.read(symbol.index_group, symbol.index_offset, ctypes.c_int32), -3)
+        self.connection.write(symbol.index_group, symbol.index_offset, 12, ctypes.c_int32)
+        self.assertEqual(self.server.get('MAIN.count'), 12)
+        self.assertEqual(self.connection.read_state(), (5, 0))
+
+    def test_symbol_upload(self):
+        names = [symbol.name for symbol in self.connection.get_all_symbols()]
+        self.assertEqual(names, ['MAIN.speed', 'MAIN.count', 'MAIN.flag', 'MAIN.name', 'MAIN.positions'])
+
+    def test_errors(self):
+        with self.assertRaises(AdsError) as context:
+            self.connection.read_list_by_name(['MAIN.speed', 'MAIN.missing'])
+        self.assertEqual(context.exception.err_code, 0x710)
+        with self.assertRaises(ValueError):
+            self.connection.read_list_by_name(['MAIN.speed'], structure_defs={'MAIN.speed': ()})
+
+    def test_online_change(self):
+        self.assertEqual(self.connection.read_list_by_name(['MAIN.speed', 'MAIN.count']), {'MAIN.speed': 1.5, 'MAIN.count': -3})
+        self.server.online_change()
+        self.assertEqual(self.connection.read_list_by_name(['MAIN.speed', 'MAIN.count']), {'MAIN.speed': 1.5, 'MAIN.count': -3})
+
+    def test_large_sum_read(self):
+        names = ['MAIN.speed', 'MAIN.count'] * 600
+        values = self.connection.read_list_by_name(names)
+        self.assertEqual(values, {'MAIN.speed': 1.5, 'MAIN.count': -3})
+
+    async def test_notifications(self):
+        received = []
+        handle = self.connection.add_notification('MAIN.speed', lambda name, timestamp, value: received.append(value))
+        # The current value arrives first, before it is changed
+        for _ in range(100):
+            if received:
+                break
+            await asyncio.sleep(0.01)
+        self.server.set('MAIN.speed', 2.0)
+        for _ in range(100):
+            if received[-1:] == [2.0]:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(received, [1.5, 2.0])
+        self.connection.del_notification(handle)
+        self.server.set('MAIN.speed', 3.0)
+        await asyncio.sleep(0.05)
+        self.assertEqual(received, [1.5, 2.0])
+
+
+class TestExchange(omni.kit.test.AsyncTestCase):
+    """Tests for writing and reading in one sum read-write request."""
+
+    # Run before every test
+    async def setUp(self):
+        self.server = StandInAmsServer(SYMBOLS)
+        _, self.tcp_port = self.server.start()
+        self.connection = AmsConnection('127.0.0.1.1.1', 851, tcp_port=self.tcp_port)
+        self.connection.open()
+        # Look the symbols up and learn the symbol version
+        self.connection.read_list_by_name(['MAIN.speed', 'MAIN.count'])
+
+    async def tearDown(self):
+        self.connection.close()
+        self.server.stop()
+
+    def test_one_request(self):
+        requests = self.server.requests
+        values, error = self.connection.exchange({'MAIN.speed': 9.0}, ['MAIN.speed', 'MAIN.count'])
+        self.assertEqual((values, error), ({'MAIN.speed': 9.0, 'MAIN.count': -3}, None))
+        # The symbol version, then one sum read-write
+        self.assertEqual(self.server.requests - requests, 2)
+        self.assertTrue(self.connection._combined_writes)
+
+    def test_separate_writes(self):
+        self.server.combined_writes = False
+        values, error = self.connection.exchange({'MAIN.speed': 9.0}, ['MAIN.speed'])
+        self.assertEqual((values, error), ({'MAIN.speed': 9.0}, None))
+        self.assertFalse(self.connection._combined_writes)
+        requests = self.server.requests
+        self.connection.exchange({'MAIN.count': 4}, ['MAIN.count'])
+        # The symbol version, a sum write and a sum read, sent back to back
+        self.assertEqual(self.server.requests - requests, 3)
+        self.assertEqual(self.server.get('MAIN.count'), 4)
+
+    def test_write_error_does_not_fail_read(self):
+        values, error = self.connection.exchange({'MAIN.missing': 1, 'MAIN.count': 2}, ['MAIN.speed', 'MAIN.count'])
+        # Only the unknown variable is not written
+        self.assertEqual(values, {'MAIN.speed': 1.5, 'MAIN.count': 2})
+        self.assertEqual(error.err_code, 0x710)
+        self.assertIn('MAIN.missing', str(error))
+        with self.assertRaises(AdsError):
+            self.connection.write_list_by_name({'MAIN.missing': 1})
+
+    def test_online_change(self):
+        self.server.online_change()
+        values, error = self.connection.exchange({'MAIN.count': 5}, ['MAIN.speed', 'MAIN.count'])
+        self.assertEqual((values, error), ({'MAIN.speed': 1.5, 'MAIN.count': 5}, None))
+        self.assertEqual(self.server.get('MAIN.count'), 5)
+        # Nothing was written to the old address of MAIN.count, which now belongs to another variable
+        for name, (_, value) in SYMBOLS.items():
+            if name != 'MAIN.count':
+                self.assertEqual(self.server.get(name), value)
+
+    def test_online_change_without_writes(self):
+        self.server.online_change()
+        requests = self.server.requests
+        self.assertEqual(self.connection.read_list_by_name(['MAIN.speed', 'MAIN.count']), {'MAIN.speed': 1.5, 'MAIN.count': -3})
+        # The read with the symbol version, the lookups, and the repeated read with the symbol version
+        self.assertEqual(self.server.requests - requests, 5)
+
+    def test_batched_lookup(self):
+        symbols = {f'MAIN.values[{i}]': ('DINT', i) for i in range(600)}
+        server = StandInAmsServer(symbols)
+        _, tcp_port = server.start()
+        connection = AmsConnection('127.0.0.1.1.1', 851, tcp_port=tcp_port)
+        try:
+            connection.open()
+            connection._client.run(connection._resolve(list(symbols)))
+            # Two sum read-writes of at most MAX_SUM_ITEMS lookups
+            self.assertEqual(server.requests, 2)
+            self.assertEqual(connection.get_symbol('MAIN.values[599]').symbol_type, 'DINT')
+        finally:
+            connection.close()
+            server.stop()
+
+
+class TestPipelining(omni.kit.test.AsyncTestCase):
+    """Tests that the requests of a cycle are in flight at once."""
+
+    async def test_requests_in_flight(self):
+        server = StandInAmsServer(SYMBOLS, response_delay=0.1)
+        _, tcp_port = server.start()
+        client = AmsClient('127.0.0.1.1.1', tcp_port=tcp_port)
+        try:
+            await client.connect()
+            start = time.perf_counter()
+            results = await asyncio.gather(*(client.read(851, ADSIGRP_PLC_MEMORY, 0, 8) for _ in range(20)))
+            self.assertLess(time.perf_counter() - start, 0.5)
+            self.assertEqual(len(results), 20)
+        finally:
+            await client.close()
+            server.stop()
+
+    def test_one_round_trip_per_cycle(self):
+        symbols = {f'MAIN.values[{i}]': ('DINT', i) for i in range(1200)}
+        symbols['852:MAIN.state'] = ('UINT', 7)
+        server = StandInAmsServer(symbols, response_delay=0.1)
+        _, tcp_port = server.start()
+        driver = AdsDriver('127.0.0.1.1.1', backend=ASYNCIO_BACKEND, backend_options={'tcp_port': tcp_port})
+        try:
+            for name in symbols:
+                driver.add_read(name)
+            driver.connect()
+            # The first read looks up the symbols
+            driver.read_table()
+            start = time.perf_counter()
+            snapshot = driver.read_table()
+            elapsed = time.perf_counter() - start
+            self.assertEqual(snapshot.get('MAIN.values[1199]'), 1199)
+            self.assertEqual(snapshot.get('852:MAIN.state'), 7)
+            # Three sum reads on port 851, one on 852 and the symbol versions, all within one round trip
+            self.assertLess(elapsed, 0.19)
+
+            # Writes to both ports go out with the reads, after the symbol versions are checked
+            start = time.perf_counter()
+            snapshot, error = driver.exchange({'MAIN.values[0]': 100, '852:MAIN.state': 9})
+            elapsed = time.perf_counter() - start
+            self.assertIsNone(error)
+            self.assertEqual((snapshot.get('MAIN.values[0]'), snapshot.get('852:MAIN.state')), (100, 9))
+            self.assertLess(elapsed, 0.29)
+        finally:
+            driver.disconnect()
+            server.stop()
+
+
+class TestAsyncioBackendService(omni.kit.test.AsyncTestCase):
+    """Tests for the bridge running on the asyncio backend."""
+
+    async def test_round_trip(self):
+        server = StandInAmsServer(SYMBOLS)
+        _, tcp_port = server.start()
+        driver = AdsDriver('127.0.0.1.1.1', backend=ASYNCIO_BACKEND, backend_options={'tcp_port': tcp_port})
+        _, service, manager = create_service(driver)
+        received = []
+        try:
+            manager.add_cyclic_read_variables(['MAIN.speed', '852:MAIN.state'])
+            manager.register_data_callback(lambda event: received.append(event.payload['data']))
+            service.start()
+            manager.write_variable('MAIN.speed', 6.5)
+            await wait_for(lambda: received and received[-1]['MAIN']['speed'] == 6.5)
+            self.assertEqual(received[-1], {'MAIN': {'speed': 6.5}, '852:MAIN': {'state': 7}})
+            self.assertEqual(service.status, "Connected")
+        finally:
+            service.cleanup()
+            server.stop()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            AdsDriver('127.0.0.1.1.1', backend='serial')
@@ -0,0 +1,143 @@
+"""
+Test block writes of NumPy arrays to PLC arrays
+"""
+
+import ctypes
+
+import numpy as np
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.ads_driver import AdsDriver
+from loupe.simulation.beckhoff_bridge.events import BridgeEvent, EVENT_TYPE_DATA_WRITE_REQ
+from loupe.simulation.beckhoff_bridge.symbol_index import parse_array_element_type, plc_type_dtype
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+# pylint: disable=W0212
+
+
+class _Symbol():
+    def __init__(self, symbol_type):
+        self.symbol_type = symbol_type
+        self.index_group = 0x4020
+        self.index_offset = 1000
+
+
+class _RecordingConnection():
+    """Records the raw writes of an AdsDriver instead of sending them."""
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.writes = []
+
+    def get_symbol(self, name):
+        return self.symbols[name]
+
+    def write(self, index_group, index_offset, value, plc_datatype):
+        self.writes.append((index_group, index_offset, bytes(value), ctypes.sizeof(plc_datatype)))
+
+
+class TestPlcTypes(omni.kit.test.AsyncTestCase):
+    """Tests for the element types of PLC arrays."""
+
+    def test_element_type(self):
+        self.assertEqual(parse_array_element_type("ARRAY [0..3] OF LREAL"), "LREAL")
+        self.assertEqual(parse_array_element_type("ARRAY [1..2,0..1] OF ST_Point "), "ST_Point")
+        self.assertIsNone(parse_array_element_type("LREAL"))
+
+    def test_dtypes(self):
+        self.assertEqual(plc_type_dtype("LREAL"), "<f8")
+        self.assertEqual(plc_type_dtype("dint"), "<i4")
+        self.assertEqual(plc_type_dtype("BOOL"), "?")
+        self.assertEqual(plc_type_dtype("STRING(10)"), "S11")
+        self.assertEqual(plc_type_dtype("STRING"), "S81")
+        self.assertIsNone(plc_type_dtype("ST_Point"))
+
+
+class TestAdsDriverWriteArray(omni.kit.test.AsyncTestCase):
+    """Tests that AdsDriver.write_array() sends one raw write at the right offset."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver = AdsDriver('127.0.0.1.1.1')
+        self.connection = _RecordingConnection({
+            'MAIN.trajectory': _Symbol("ARRAY [0..99] OF LREAL"),
+            'MAIN.grid': _Symbol("ARRAY [1..10,0..2] OF INT"),
+            'MAIN.points': _Symbol("ARRAY [0..9] OF ST_Point"),
+            'MAIN.value': _Symbol("LREAL"),
+        })
+        self.driver._connections[851] = self.connection
+
+    def test_block_write(self):
+        values = np.linspace(0.0, 1.0, 50)
+        self.driver.write_array('MAIN.trajectory', values, offset=10)
+        self.assertEqual(self.connection.writes, [(0x4020, 1000 + 10 * 8, values.tobytes(), 400)])
+
+    def test_multi_dimensional(self):
+        values = np.arange(6, dtype='<i2').reshape(2, 3)
+        self.driver.write_array('MAIN.grid', values, offset=24)
+        self.assertEqual(self.connection.writes, [(0x4020, 1000 + 24 * 2, values.tobytes(), 12)])
+
+    def test_structured(self):
+        values = np.zeros(3, dtype=[('x', '<f8'), ('y', '<f8')])
+        self.driver.write_array('MAIN.points', values)
+        self.assertEqual(len(self.connection.writes), 1)
+        with self.assertRaises(TypeError):
+            self.driver.write_array('MAIN.points', np.zeros(3))
+
+    def test_dtype_mismatch(self):
+        with self.assertRaises(TypeError):
+            self.driver.write_array('MAIN.trajectory', np.zeros(10, dtype=np.float32))
+        self.assertEqual(self.connection.writes, [])
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            self.driver.write_array('MAIN.trajectory', np.zeros(10), offset=95)
+        with self.assertRaises(ValueError):
+            self.driver.write_array('MAIN.value', np.zeros(1))
+        self.assertEqual(self.connection.writes, [])
+
+
+class TestServiceWriteArray(omni.kit.test.AsyncTestCase):
+    """Tests for array writes through the Manager and the I/O thread."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver, self.service, self.manager = create_service()
+        self.driver.memory['MAIN.trajectory'] = np.zeros(100)
+
+    async def tearDown(self):
+        self.service.cleanup()
+
+    async def test_write_array(self):
+        self.service.start()
+        values = np.arange(20, dtype='<f8')
+        self.manager.write_array('MAIN.trajectory', values, offset=5)
+        # The values are copied when they are queued
+        values[:] = -1
+        self.assertTrue(await wait_for(lambda: self.driver.write_count > 0))
+        self.assertEqual(self.driver.write_count, 1)
+        self.assertEqual(self.driver.memory['MAIN.trajectory'][5:25].tolist(), list(range(20)))
+
+    async def test_arrays_are_written_before_variables(self):
+        order = []
+        write_array = self.driver.write_array
+        write_data = self.driver.write_data
+        self.driver.write_array = lambda *args: (order.append('array'), write_array(*args))
+        self.driver.write_data = lambda data: (order.append('data'), write_data(data))
+        self.manager.write_variable('MAIN.execute', True)
+        self.manager.write_array('MAIN.trajectory', np.ones(3))
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: len(order) == 2))
+        self.assertEqual(order, ['array', 'data'])
+
+    async def test_dtype_mismatch_is_reported(self):
+        self.manager.add_cyclic_read_variables(['MAIN.value'])
+        self.service.start()
+        self.manager.write_array('MAIN.trajectory', np.ones(3, dtype=np.int32))
+        self.assertTrue(await wait_for(lambda: self.service.status.startswith("Error writing data to PLC")))
+
+    async def test_write_request_event(self):
+        event = BridgeEvent(EVENT_TYPE_DATA_WRITE_REQ, {'arrays': [{'name': 'MAIN.trajectory', 'values': [1.0, 2.0], 'dtype': '<f8', 'offset': 3}]})
+        self.service.on_write_req_event(event)
+        name, values, offset = self.service.array_write_queue[0]
+        self.assertEqual((name, values.dtype.str, values.tolist(), offset), ('MAIN.trajectory', '<f8', [1.0, 2.0], 3))
@@ -0,0 +1,206 @@
+"""
+Test the headless bridge service against an in-memory stand-in PLC
+"""
+
+import asyncio
+import threading
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.events import BridgeEvent, EVENT_TYPE_DATA_WRITE_REQ
+from loupe.simulation.beckhoff_bridge.flat_data import FlatSnapshot
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+# pylint: disable=W0212
+
+
+class TestBridgeService(omni.kit.test.AsyncTestCase):
+    """Tests for the I/O loop of BridgeService, without UI or message bus."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver, self.service, self.manager = create_service()
+
+    async def tearDown(self):
+        self.service.cleanup()
+
+    async def test_write_then_read(self):
+        received = []
+        self.manager.register_init_callback(lambda event: self.manager.add_cyclic_read_variables(['MAIN.custom_struct.var1']))
+        self.manager.register_data_callback(lambda event: received.append(event.payload['data']))
+        self.service.start()
+        self.manager.write_variable('MAIN.custom_struct.var1', 42)
+
+        self.assertTrue(await wait_for(lambda: received and received[-1]['MAIN']['custom_struct']['var1'] == 42))
+        self.assertEqual(self.service.status, "Connected")
+
+    async def test_disabled(self):
+        self.service.enable_communication = False
+        self.service.start()
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.service.status, "Disabled")
+        self.assertFalse(self.driver.connected)
+
+    async def test_no_thread_while_idle(self):
+        """No I/O thread exists until communication is enabled and there is something to read or write."""
+        self.service.enable_communication = False
+        self.service.start()
+        self.assertIsNone(self.service._thread)
+        self.assertEqual(self.service.status, "Disabled")
+
+        self.service.enable_communication = True
+        self.assertIsNone(self.service._thread)
+        self.assertEqual(self.service.status, "Idle")
+
+        self.manager.add_cyclic_read_variables(['MAIN.var'])
+        self.assertIsNotNone(self.service._thread)
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > 0))
+
+    async def test_idle_thread_does_not_cycle(self):
+        """Once disabled, the I/O thread blocks until it is enabled again, and wakes up immediately."""
+        self.manager.add_cyclic_read_variables(['MAIN.var'])
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > 0))
+
+        self.service.enable_communication = False
+        await asyncio.sleep(0.05)
+        read_count = self.driver.read_count
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.driver.read_count, read_count)
+        self.assertEqual(self.service.status, "Disabled")
+
+        self.service.refresh_rate = 10000
+        self.service.enable_communication = True
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > read_count, timeout=1.0))
+
+    async def test_connection_probed_after_failure(self):
+        """A working connection is not probed every cycle, only after the connect and after a failed cycle."""
+        probes = []
+        is_connected = self.driver.is_connected
+        self.driver.is_connected = lambda: probes.append(1) or is_connected()
+        self.manager.add_cyclic_read_variables(['MAIN.var'])
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > 5))
+        self.assertEqual(len(probes), 1)
+
+        read_table = self.driver.read_table
+        def fail_once():
+            self.driver.read_table = read_table
+            raise RuntimeError("Connection lost")
+        self.driver.read_table = fail_once
+        read_count = self.driver.read_count
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > read_count + 5, timeout=3.0))
+        self.assertEqual(len(probes), 2)
+
+    async def test_write_wakes_thread(self):
+        """A queued write starts the I/O thread even without cyclic reads."""
+        self.service.start()
+        self.assertIsNone(self.service._thread)
+        self.manager.write_variable('MAIN.var', 3)
+        self.assertTrue(await wait_for(lambda: self.driver.memory.get('MAIN.var') == 3))
+
+    async def test_slow_subscriber_does_not_stretch_cycle(self):
+        """A blocked data callback neither delays the I/O cycle nor the other callbacks."""
+        release = threading.Event()
+        fast = []
+        self.manager.register_data_callback(lambda event: release.wait())
+        self.manager.register_data_callback(fast.append)
+        self.manager.add_cyclic_read_variables(['MAIN.var'])
+        self.service.start()
+
+        try:
+            self.assertTrue(await wait_for(lambda: self.driver.read_count > 10 and len(fast) > 10))
+            stats = self.manager.get_subscriber_stats()
+            self.assertEqual(stats[0]['delivered'], 0)
+            self.assertGreater(stats[0]['dropped'], 0)
+        finally:
+            release.set()
+
+    async def test_variable_subset(self):
+        """A callback with variables only receives those, and only when they change."""
+        subset = []
+        full = []
+        self.manager.add_cyclic_read_variables(['MAIN.counter'])
+        self.manager.register_data_callback(lambda event: subset.append(event.payload['data']), variables=['MAIN.a', 'MAIN.b'])
+        self.manager.register_data_callback(lambda event: full.append(event.payload['data']))
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: subset == [{'MAIN': {'a': 0, 'b': 0}}]))
+
+        # Cycles in which only other variables change are skipped
+        cycles = self.service.cycle_count
+        for count in range(1, 4):
+            self.manager.write_variable('MAIN.counter', count)
+            self.assertTrue(await wait_for(lambda: full and full[-1]['MAIN']['counter'] == count))
+        self.assertGreater(self.service.cycle_count, cycles)
+        self.assertEqual(len(subset), 1)
+        self.assertIn('counter', full[-1]['MAIN'])
+
+        self.manager.write_variable('MAIN.b', 2)
+        self.assertTrue(await wait_for(lambda: subset[-1] == {'MAIN': {'a': 0, 'b': 2}}))
+        self.assertEqual(len(subset), 2)
+
+    async def test_subset_does_not_build_full_data(self):
+        """Without full-data subscribers, the nested dictionary of the whole cycle is not built."""
+        full_builds = []
+        to_dict = FlatSnapshot.to_dict
+        def tracked_to_dict(snapshot):
+            # The subset only holds MAIN.a, the full cycle also MAIN.counter
+            if 'MAIN.counter' in snapshot.index.slots:
+                full_builds.append(snapshot)
+            return to_dict(snapshot)
+        FlatSnapshot.to_dict = tracked_to_dict
+        try:
+            subset = []
+            self.manager.add_cyclic_read_variables(['MAIN.counter'])
+            self.manager.register_data_callback(lambda event: subset.append(event.payload['data']), variables=['MAIN.a'])
+            self.service.start()
+            self.manager.write_variable('MAIN.counter', 1)
+            self.assertTrue(await wait_for(lambda: subset and self.service.cycle_count > 5))
+            self.assertEqual(full_builds, [])
+
+            # The data property still builds it on demand
+            self.assertEqual(self.service.data['MAIN']['counter'], 1)
+            self.assertGreater(len(full_builds), 0)
+        finally:
+            FlatSnapshot.to_dict = to_dict
+
+    async def test_publish_without_subset(self):
+        """A topic whose subset was removed by another thread is skipped, the other subscribers still receive data."""
+        full = []
+        self.manager.register_data_callback(lambda event: None, variables=['MAIN.a'])
+        self.manager.register_data_callback(lambda event: full.append(event.payload['data']))
+        self.service._subsets = dict()
+        self.service._publish(self.driver.read_table(), 0.0)
+        self.assertTrue(await wait_for(lambda: len(full) == 1))
+
+    async def test_shared_variable_subset(self):
+        """A new callback for the same variables receives the current values, even if they do not change."""
+        first = []
+        second = []
+        self.service.start()
+        self.manager.register_data_callback(lambda event: first.append(event.payload['data']), variables=['MAIN.a'])
+        self.assertTrue(await wait_for(lambda: len(first) == 1))
+        self.manager.register_data_callback(lambda event: second.append(event.payload['data']), variables=['MAIN.a'])
+        self.assertTrue(await wait_for(lambda: second == [{'MAIN': {'a': 0}}]))
+        self.assertEqual(len(self.service._subsets), 1)
+
+    async def test_queue_writes(self):
+        """A batch of writes is written in one cycle."""
+        self.service.start()
+        self.service.queue_writes({'MAIN.a': 1, 'MAIN.b': 2, 'MAIN.c': 3})
+        self.assertTrue(await wait_for(lambda: self.driver.memory.get('MAIN.c') == 3))
+        self.assertEqual(self.driver.write_count, 1)
+
+    async def test_write_variables(self):
+        """Manager.write_variables() queues all values for one write."""
+        self.service.start()
+        values = {f'MAIN.sensors[{i}]': i % 2 == 0 for i in range(500)}
+        self.manager.write_variables(values)
+        self.assertTrue(await wait_for(lambda: self.driver.write_count > 0))
+        self.assertEqual(self.driver.write_count, 1)
+        self.assertTrue(all(self.driver.memory[name] == value for name, value in values.items()))
+
+    async def test_write_request_event(self):
+        """A message bus write request is queued as one batch."""
+        event = BridgeEvent(EVENT_TYPE_DATA_WRITE_REQ, {'variables': [{'name': 'MAIN.a', 'value': 1}, {'name': 'MAIN.b', 'value': 2}]})
+        self.service.on_write_req_event(event)
+        self.assertEqual(self.service.write_queue, {'MAIN.a': 1, 'MAIN.b': 2})
@@ -0,0 +1,130 @@
+"""
+Test the bounded per-subscriber queues of the event dispatcher
+"""
+
+import threading
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge import dispatcher
+from loupe.simulation.beckhoff_bridge.dispatcher import Dispatcher, LATEST, DROP_OLDEST
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import wait_for
+
+# pylint: disable=W0212
+
+
+class TestDispatcher(omni.kit.test.AsyncTestCase):
+    """Tests for queue policies, statistics and isolation of slow subscribers."""
+
+    # Run before every test
+    async def setUp(self):
+        self.dispatcher = Dispatcher()
+        self.release = threading.Event()
+
+    async def tearDown(self):
+        self.release.set()
+        self.dispatcher.close()
+
+    def _blocked_subscriber(self, received, policy, depth = 1):
+        """Subscribes a callback that blocks on its first event until self.release is set."""
+        def callback(event):
+            received.append(event)
+            self.release.wait()
+        subscriber = self.dispatcher.subscribe(callback, policy, depth)
+        self.dispatcher.publish(0)
+        return subscriber
+
+    async def test_latest_coalesces(self):
+        received = []
+        subscriber = self._blocked_subscriber(received, LATEST)
+        self.assertTrue(await wait_for(lambda: received == [0]))
+
+        for i in range(1, 10):
+            self.dispatcher.publish(i)
+        self.assertEqual(subscriber.pending, 1)
+
+        self.release.set()
+        self.assertTrue(await wait_for(lambda: subscriber.stats()['delivered'] == 2))
+        self.assertEqual(received, [0, 9])
+        self.assertEqual(subscriber.stats()['dropped'], 8)
+
+    async def test_drop_oldest(self):
+        received = []
+        subscriber = self._blocked_subscriber(received, DROP_OLDEST, depth=3)
+        self.assertTrue(await wait_for(lambda: received == [0]))
+
+        for i in range(1, 10):
+            self.dispatcher.publish(i)
+        self.assertEqual(subscriber.pending, 3)
+
+        self.release.set()
+        self.assertTrue(await wait_for(lambda: subscriber.stats()['delivered'] == 4))
+        self.assertEqual(received, [0, 7, 8, 9])
+        self.assertEqual(subscriber.stats()['dropped'], 6)
+
+    async def test_slow_subscriber_does_not_block(self):
+        slow = []
+        fast = []
+        self._blocked_subscriber(slow, LATEST)
+        self.dispatcher.subscribe(fast.append, DROP_OLDEST, depth=100)
+        self.assertTrue(await wait_for(lambda: slow == [0]))
+
+        for i in range(1, 50):
+            self.dispatcher.publish(i)
+        self.assertTrue(await wait_for(lambda: len(fast) == 49))
+        self.assertEqual(fast, list(range(1, 50)))
+        self.assertEqual(slow, [0])
+
+    async def test_callback_errors_are_counted(self):
+        def callback(event):
+            raise ValueError("bad data")
+        subscriber = self.dispatcher.subscribe(callback)
+        self.dispatcher.publish(1)
+        self.assertTrue(await wait_for(lambda: subscriber.stats()['errors'] == 1))
+
+        self.dispatcher.publish(2)
+        self.assertTrue(await wait_for(lambda: subscriber.stats()['delivered'] == 2))
+        self.assertIn("bad data", subscriber.stats()['last_error'])
+
+    async def test_callback_errors_are_logged(self):
+        """Outside of Kit, callback errors go to the logging module with their traceback."""
+        def callback(event):
+            raise ValueError("bad data")
+        subscriber = self.dispatcher.subscribe(callback)
+        carb = dispatcher.carb
+        dispatcher.carb = None
+        try:
+            with self.assertLogs(dispatcher.__name__, level="ERROR") as logs:
+                self.dispatcher.publish(1)
+                # Counted as delivered once the error is logged
+                self.assertTrue(await wait_for(lambda: subscriber.stats()['delivered'] == 1))
+        finally:
+            dispatcher.carb = carb
+        self.assertIn("bad data", logs.output[0])
+        self.assertIsNotNone(logs.records[0].exc_info)
+
+    async def test_unsubscribe(self):
+        received = []
+        subscriber = self.dispatcher.subscribe(received.append)
+        self.assertIsNone(subscriber._thread)
+        self.dispatcher.publish(1)
+        self.assertTrue(await wait_for(lambda: received == [1]))
+
+        subscriber.unsubscribe()
+        self.assertEqual(len(self.dispatcher), 0)
+        self.assertFalse(subscriber._thread.is_alive())
+        self.dispatcher.publish(2)
+        self.assertEqual(received, [1])
+
+    async def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            self.dispatcher.subscribe(print, "newest")
+
+    async def test_topics(self):
+        received = []
+        self.dispatcher.subscribe(lambda event: received.append(('all', event)))
+        self.dispatcher.subscribe(lambda event: received.append(('a', event)), topic='a')
+        self.assertEqual(self.dispatcher.topics(), {None, 'a'})
+        self.dispatcher.publish(1)
+        self.dispatcher.publish(2, 'a')
+        self.assertTrue(await wait_for(lambda: len(received) == 2))
+        self.assertEqual(sorted(received), [('a', 2), ('all', 1)])
@@ -0,0 +1,102 @@
+"""
+Test the flat value table and its lazy nested view against the dictionary parser
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.ads_driver import AdsDriver
+from loupe.simulation.beckhoff_bridge.flat_data import ReadIndex, FlatSnapshot, LazyDataView, LazyListView, SnapshotSubset, snapshot_changed
+
+# pylint: disable=W0212
+
+class TestLazyDataView(omni.kit.test.AsyncTestCase):
+    """Tests that the lazy view matches the dictionaries built by _parse_flat_plc_var_to_dict."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver = AdsDriver('127.0.0.1.1')
+        self.test_output_string = "correct: {correct}\nactual: {actual}\n\n"
+
+    def _parse(self, names, values):
+        parsed = {}
+        for name, value in zip(names, values):
+            parsed = self.driver._parse_flat_plc_var_to_dict(parsed, name, value)
+        return parsed
+
+    def _check(self, names):
+        values = list(range(len(names)))
+        correct_output = self._parse(names, values)
+        snapshot = FlatSnapshot(ReadIndex(names), values)
+        actual_output = snapshot.to_dict()
+        self.assertEqual(actual_output,
+                         correct_output,
+                         msg=self.test_output_string.format(correct=correct_output, actual=actual_output))
+        self.assertEqual(snapshot.view, correct_output)
+
+    def test_single_vars(self):
+        self._check(["gVar", "gOtherVar"])
+
+    def test_arrays(self):
+        self._check(["gBool[2]", "Program.array[29]", "Program.array[3]"])
+
+    def test_deep_mix_of_nesting(self):
+        self._check(["Program.myStruct.myArray[1].myStruct.arr[3].myVar", "Program.myStruct.myArray[0].x", "Program.y"])
+
+    def test_overwrite_order(self):
+        """Conflicting names resolve the same way as the dictionary parser: the later name wins."""
+        self._check(["MAIN.s", "MAIN.s.x"])
+        self._check(["MAIN.s.x", "MAIN.s"])
+        self._check(["MAIN.q[1]", "MAIN.q[1].z"])
+        self._check(["MAIN.q[1].z", "MAIN.q[1]"])
+
+    def test_lazy_access(self):
+        names = ["MAIN.custom_struct.var1", "MAIN.custom_struct.var_array[1]"]
+        snapshot = FlatSnapshot(ReadIndex(names), [5, 7])
+        view = snapshot.view
+        self.assertIsInstance(view['MAIN'], LazyDataView)
+        self.assertIsInstance(view['MAIN']['custom_struct']['var_array'], LazyListView)
+        self.assertEqual(view['MAIN']['custom_struct']['var_array'][-1], 7)
+        self.assertIsNone(view['MAIN']['custom_struct']['var_array'][0])
+        self.assertEqual(snapshot.get("MAIN.custom_struct.var1"), 5)
+        self.assertIsNone(snapshot.get("MAIN.missing"))
+        with self.assertRaises(KeyError):
+            view['MAIN']['missing']
+
+
+class TestSnapshotSubset(omni.kit.test.AsyncTestCase):
+    """Tests for selecting the variables of one subscriber out of a snapshot."""
+
+    # Run before every test
+    async def setUp(self):
+        self.index = ReadIndex(["MAIN.axis[0].position", "MAIN.axis[1].position", "MAIN.axis[0].velocity", "MAIN.state"])
+
+    def test_snapshot_changed(self):
+        first = FlatSnapshot(self.index, [1, 2, 3, 4])
+        self.assertTrue(snapshot_changed(None, first))
+        self.assertFalse(snapshot_changed(first, FlatSnapshot(self.index, [1, 2, 3, 4])))
+        self.assertTrue(snapshot_changed(first, FlatSnapshot(self.index, [1, 2, 3, 5])))
+        self.assertTrue(snapshot_changed(first, FlatSnapshot(ReadIndex(list(self.index.names)), [1, 2, 3, 4])))
+
+    def test_select(self):
+        subset = SnapshotSubset(["MAIN.state", "MAIN.missing"])
+        selected = subset.select(FlatSnapshot(self.index, [1, 2, 3, 4]))
+        self.assertEqual(selected.to_dict(), {'MAIN': {'state': 4}})
+
+    def test_unchanged_is_skipped(self):
+        subset = SnapshotSubset(["MAIN.state"])
+        self.assertIsNotNone(subset.select(FlatSnapshot(self.index, [1, 2, 3, 4])))
+        # Other variables changed, but not the selected one
+        self.assertIsNone(subset.select(FlatSnapshot(self.index, [9, 9, 9, 4])))
+        self.assertIsNotNone(subset.select(FlatSnapshot(self.index, [9, 9, 9, 5])))
+        subset.reset()
+        self.assertIsNotNone(subset.select(FlatSnapshot(self.index, [9, 9, 9, 5])))
+
+    def test_patterns(self):
+        subset = SnapshotSubset(["main.axis[*].POSITION"])
+        selected = subset.select(FlatSnapshot(self.index, [1, 2, 3, 4]))
+        self.assertEqual(selected.to_dict(), {'MAIN': {'axis': [{'position': 1}, {'position': 2}]}})
+
+    def test_new_layout(self):
+        subset = SnapshotSubset(["MAIN.state"])
+        subset.select(FlatSnapshot(self.index, [1, 2, 3, 4]))
+        selected = subset.select(FlatSnapshot(ReadIndex(["MAIN.state"]), [4]))
+        self.assertEqual(selected.to_dict(), {'MAIN': {'state': 4}})
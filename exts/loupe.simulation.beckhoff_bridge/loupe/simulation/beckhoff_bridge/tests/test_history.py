@@ -0,0 +1,116 @@
+"""
+Test the fixed-size per-variable history ring buffers
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.history import HistoryBuffer, History
+from loupe.simulation.beckhoff_bridge.flat_data import ReadIndex, FlatSnapshot
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+# pylint: disable=W0212
+
+
+class TestHistoryBuffer(omni.kit.test.AsyncTestCase):
+    """Tests for the ring buffer of one variable."""
+
+    def test_partial(self):
+        buffer = HistoryBuffer(depth=5)
+        for i in range(3):
+            buffer.append(float(i), i * 10)
+        times, values = buffer.get()
+        self.assertEqual(times.tolist(), [0.0, 1.0, 2.0])
+        self.assertEqual(values.tolist(), [0.0, 10.0, 20.0])
+
+    def test_wraps_in_fixed_memory(self):
+        buffer = HistoryBuffer(depth=4)
+        storage = buffer._values
+        for i in range(10):
+            buffer.append(float(i), i)
+        self.assertEqual(len(buffer), 4)
+        self.assertIs(buffer._values, storage)
+        times, values = buffer.get()
+        self.assertEqual(times.tolist(), [6.0, 7.0, 8.0, 9.0])
+        self.assertEqual(values.tolist(), [6.0, 7.0, 8.0, 9.0])
+
+    def test_window(self):
+        buffer = HistoryBuffer(depth=100)
+        for i in range(20):
+            buffer.append(i * 0.5, i)
+        times, values = buffer.get(window=2.0)
+        self.assertEqual(times.tolist(), [7.5, 8.0, 8.5, 9.0, 9.5])
+
+    def test_decimation(self):
+        buffer = HistoryBuffer(depth=100, decimation=3)
+        for i in range(10):
+            buffer.append(float(i), i)
+        self.assertEqual(buffer.get()[1].tolist(), [0.0, 3.0, 6.0, 9.0])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            HistoryBuffer(depth=0)
+        with self.assertRaises(ValueError):
+            HistoryBuffer(decimation=0)
+
+
+class TestHistory(omni.kit.test.AsyncTestCase):
+    """Tests for recording snapshots, and for the history API of the service and Manager."""
+
+    def test_record(self):
+        index = ReadIndex(["MAIN.x", "MAIN.flag", "MAIN.text"])
+        history = History()
+        for name in index.names:
+            history.add(name, depth=10)
+        history.record(FlatSnapshot(index, [1.5, True, "a"]), 100.0)
+        history.record(FlatSnapshot(index, [2.5, False, "b"]), 101.0)
+
+        self.assertEqual(history.get("MAIN.x")[1].tolist(), [1.5, 2.5])
+        self.assertEqual(history.get("MAIN.flag")[1].tolist(), [1.0, 0.0])
+        self.assertEqual(len(history.get("MAIN.text")[1]), 0)
+        with self.assertRaises(KeyError):
+            history.get("MAIN.other")
+
+    async def test_manager(self):
+        driver, service, manager = create_service()
+        try:
+            driver.memory['MAIN.position'] = 4.0
+            manager.add_history(['MAIN.position'], depth=8)
+            service.start()
+            await wait_for(lambda: len(manager.get_history('MAIN.position')[0]) == 8)
+            times, values = manager.get_history('MAIN.position')
+            self.assertEqual(values.tolist(), [4.0] * 8)
+            self.assertTrue((times[1:] >= times[:-1]).all())
+        finally:
+            service.cleanup()
+
+    async def test_separate_reads(self):
+        """History outside of the cyclic read list is read on its own, and removing it stops the reads."""
+        driver, service, _ = create_service()
+        read_values = driver.read_values
+        def read_known(names):
+            if 'MAIN.typo' in names:
+                raise KeyError('MAIN.typo')
+            return read_values(names)
+        driver.read_values = read_known
+        try:
+            driver.memory['MAIN.trend'] = 2.0
+            service.add_read_variables(['MAIN.counter'])
+            service.add_history(['MAIN.trend'], depth=4, cyclic=False)
+            service.start()
+            self.assertTrue(await wait_for(lambda: len(service.get_history('MAIN.trend')[0]) == 4))
+            self.assertEqual(service.get_history('MAIN.trend')[1].tolist(), [2.0] * 4)
+            self.assertNotIn('MAIN.trend', driver._read_names)
+
+            # A variable that does not exist fails its own reads, not the cycle
+            service.remove_history(['MAIN.trend'])
+            service.add_history(['MAIN.typo'], cyclic=False)
+            cycles = service.cycle_count
+            self.assertTrue(await wait_for(lambda: service.cycle_count > cycles + 5))
+            self.assertIn('MAIN.typo', service.status)
+            self.assertEqual(driver._read_names, ['MAIN.counter'])
+
+            service.remove_history(['MAIN.typo'])
+            self.assertIsNone(service._history_reads)
+            with self.assertRaises(KeyError):
+                service.get_history('MAIN.trend')
+        finally:
+            service.cleanup()
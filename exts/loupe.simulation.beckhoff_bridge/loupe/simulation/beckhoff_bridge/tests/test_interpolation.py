@@ -0,0 +1,113 @@
+"""
+Test the evaluation of PLC values at frame time
+"""
+
+import asyncio
+import time
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.flat_data import ReadIndex, FlatSnapshot
+from loupe.simulation.beckhoff_bridge.interpolation import SampleTrack, Interpolator, LINEAR, HOLD
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service
+
+
+class TestSampleTrack(omni.kit.test.AsyncTestCase):
+    """Tests for evaluating the samples of one variable."""
+
+    def _track(self, mode = LINEAR, max_extrapolation = 0.1):
+        track = SampleTrack(mode, max_extrapolation)
+        for timestamp, value in [(1.0, 0.0), (2.0, 10.0), (3.0, 30.0)]:
+            track.append(timestamp, value)
+        return track
+
+    def test_linear(self):
+        track = self._track()
+        self.assertAlmostEqual(track.sample(1.5), 5.0)
+        self.assertAlmostEqual(track.sample(2.25), 15.0)
+        self.assertEqual(track.sample(2.0), 10.0)
+        # Before the oldest sample
+        self.assertEqual(track.sample(0.0), 0.0)
+
+    def test_bounded_extrapolation(self):
+        track = self._track()
+        self.assertAlmostEqual(track.sample(3.05), 31.0)
+        self.assertAlmostEqual(track.sample(3.1), 32.0)
+        self.assertAlmostEqual(track.sample(10.0), 32.0)
+        self.assertEqual(self._track(max_extrapolation=0.0).sample(3.5), 30.0)
+
+    def test_hold(self):
+        track = self._track(HOLD)
+        self.assertEqual(track.sample(1.9), 0.0)
+        self.assertEqual(track.sample(2.5), 10.0)
+        self.assertEqual(track.sample(4.0), 30.0)
+
+    def test_values(self):
+        track = SampleTrack()
+        self.assertIsNone(track.sample(1.0))
+        track.append(1.0, [0.0, 2.0])
+        self.assertEqual(track.sample(2.0), [0.0, 2.0])
+        track.append(2.0, [1.0, 4.0])
+        self.assertEqual(track.sample(1.5), [0.5, 3.0])
+        # Booleans and strings are held
+        flags = SampleTrack()
+        flags.append(1.0, False)
+        flags.append(2.0, True)
+        self.assertIs(flags.sample(1.5), False)
+        self.assertIs(flags.sample(2.5), True)
+
+    def test_old_samples_dropped(self):
+        track = self._track()
+        track.append(2.5, 100.0)
+        self.assertEqual(len(track), 3)
+        with self.assertRaises(ValueError):
+            SampleTrack("cubic")
+
+
+class TestInterpolator(omni.kit.test.AsyncTestCase):
+    """Tests for recording read cycles."""
+
+    def test_record(self):
+        interpolator = Interpolator()
+        interpolator.add('MAIN.x')
+        index = ReadIndex(['MAIN.x', 'MAIN.y'])
+        first = FlatSnapshot(index, [0.0, 1])
+        interpolator.record(first, 1.0)
+        # A snapshot returned again is not a new sample
+        interpolator.record(first, 1.5)
+        interpolator.record(FlatSnapshot(index, [4.0, 2]), 2.0)
+        self.assertEqual(interpolator.sample(['MAIN.x'], 1.5), {'MAIN.x': 2.0})
+        with self.assertRaises(KeyError):
+            interpolator.sample(['MAIN.y'], 1.5)
+
+
+class TestServiceInterpolation(omni.kit.test.AsyncTestCase):
+    """Tests for evaluating variables at frame time through the Manager."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver, self.service, self.manager = create_service()
+
+    async def tearDown(self):
+        self.service.cleanup()
+
+    async def test_ramp(self):
+        self.manager.add_interpolation(['MAIN.position'])
+        self.manager.add_interpolation(['MAIN.state'], mode=HOLD)
+        self.service.start()
+        # A PLC that moves at 1000 units per second
+        start = time.time()
+        for _ in range(30):
+            now = time.time()
+            self.driver.memory['MAIN.position'] = (now - start) * 1000
+            self.driver.memory['MAIN.state'] = int(now - start > 0.05)
+            await asyncio.sleep(0.005)
+        frame_time = time.time()
+        values = self.manager.get_interpolated(['MAIN.position', 'MAIN.state'], frame_time)
+        # One read cycle behind the frame, and between read cycles rather than on them
+        expected = (frame_time - 0.01 - start) * 1000
+        self.assertLess(abs(values['MAIN.position'] - expected), 30)
+        self.assertEqual(values['MAIN.state'], 1)
+
+    def test_not_added(self):
+        with self.assertRaises(KeyError):
+            self.manager.get_interpolated(['MAIN.position'])
@@ -0,0 +1,80 @@
+"""
+Test the end-to-end latency probe against an echoing stand-in PLC
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.latency_probe import percentile
+from loupe.simulation.beckhoff_bridge.stand_in_plc import StandInDriver
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+
+class TestPercentile(omni.kit.test.AsyncTestCase):
+    """Tests for the nearest-rank percentile."""
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1.0), 100)
+        self.assertEqual(percentile([7], 0.5), 7)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+class TestLatencyProbe(omni.kit.test.AsyncTestCase):
+    """Tests for round trips through the write and read paths of the service."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver, self.service, _ = create_service(StandInDriver(echo={'MAIN.echo_out': 'MAIN.echo_in'}), REFRESH_RATE=5,
+                                                      LATENCY_PROBE_WRITE_VARIABLE='MAIN.echo_in',
+                                                      LATENCY_PROBE_ECHO_VARIABLE='MAIN.echo_out')
+
+    async def tearDown(self):
+        self.service.cleanup()
+
+    async def test_round_trips(self):
+        self.service.start()
+        probe = self.service.start_latency_probe()
+        self.assertTrue(await wait_for(lambda: probe.stats()['samples'] >= 10))
+        probe.stop()
+
+        stats = probe.stats()
+        self.assertEqual(stats['lost'], 0)
+        # The stand-in driver writes and then reads, so both are timed on their own
+        self.assertEqual(list(stats['stages']), ['queue', 'write', 'turnaround', 'read', 'delivery'])
+        round_trip = stats['round_trip']
+        self.assertGreater(round_trip['p50'], 0.0)
+        self.assertLessEqual(round_trip['p50'], round_trip['p99'])
+        self.assertLessEqual(round_trip['p99'], round_trip['max'])
+        for stage in stats['stages'].values():
+            self.assertGreaterEqual(stage['p50'], 0.0)
+
+        # The tokens increment with every round trip
+        self.assertGreaterEqual(self.driver.memory['MAIN.echo_out'], 10)
+
+    async def test_exchange_stage(self):
+        """A driver that writes and reads in one request reports the exchange instead of write and read."""
+        self.driver.combined_exchange = True
+        self.service.start()
+        probe = self.service.start_latency_probe()
+        self.assertTrue(await wait_for(lambda: probe.stats()['samples'] >= 10))
+        probe.stop()
+
+        stages = probe.stats()['stages']
+        self.assertEqual(list(stages), ['queue', 'exchange', 'turnaround', 'delivery'])
+        self.assertGreater(stages['exchange']['max'], 0.0)
+
+    async def test_lost_token(self):
+        # Without the echo, no token ever comes back
+        self.driver.echo = dict()
+        self.service.start()
+        probe = self.service.start_latency_probe()
+        probe.timeout = 0.05
+        self.assertTrue(await wait_for(lambda: probe.stats()['lost'] >= 2))
+        self.assertEqual(probe.stats()['samples'], 0)
+
+    async def test_needs_variable(self):
+        _, service, _ = create_service()
+        with self.assertRaises(ValueError):
+            service.start_latency_probe()
+        service.cleanup()
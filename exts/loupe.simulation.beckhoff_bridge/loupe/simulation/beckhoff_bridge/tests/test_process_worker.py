@@ -0,0 +1,151 @@
+"""
+Test the out-of-process driver against a stand-in PLC running in the worker process
+"""
+
+import asyncio
+import threading
+from functools import partial
+
+import numpy as np
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.process_worker import ProcessDriver
+from loupe.simulation.beckhoff_bridge.stand_in_plc import StandInDriver
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+
+class TestProcessDriver(omni.kit.test.AsyncTestCase):
+    """Tests for the driver interface of the worker process."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver = ProcessDriver('127.0.0.1.1.1', cycle_time=0.005,
+                                    driver_factory=partial(StandInDriver, echo={'MAIN.echo_out': 'MAIN.echo_in'}))
+
+    async def tearDown(self):
+        self.driver.close()
+
+    async def _read_until(self, name, value, timeout = 5.0):
+        for _ in range(int(timeout / 0.01)):
+            snapshot = self.driver.read_table()
+            if snapshot.get(name) == value:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    async def test_not_connected(self):
+        self.assertFalse(self.driver.is_connected())
+        with self.assertRaises(RuntimeError):
+            self.driver.read_table()
+
+    async def test_write_and_read(self):
+        self.driver.add_read('MAIN.echo_out')
+        self.driver.connect()
+        self.assertTrue(self.driver.is_connected())
+        self.driver.write_data({'MAIN.echo_in': 42})
+        self.assertTrue(await self._read_until('MAIN.echo_out', 42))
+        self.assertEqual(self.driver.read_data(), {'MAIN': {'echo_out': 42}})
+
+    async def test_unchanged_snapshot_is_reused(self):
+        self.driver.add_read('MAIN.echo_out')
+        self.driver.connect()
+        self.driver.cycle_time = 10.0
+        first = self.driver.read_table()
+        self.assertIs(self.driver.read_table(), first)
+
+    async def test_worker_errors_are_raised(self):
+        self.driver.connect()
+        with self.assertRaises(KeyError):
+            self.driver.get_array_length('MAIN.missing')
+
+    async def test_array_reads(self):
+        self.driver.connect()
+        self.driver.write_data({'MAIN.buffer': np.arange(10, dtype=np.int32)})
+        self.assertEqual(self.driver.get_array_length('MAIN.buffer'), 10)
+        data = self.driver.read_array_bytes('MAIN.buffer', 2, 3, 4)
+        self.assertEqual(np.frombuffer(data, dtype=np.int32).tolist(), [2, 3, 4])
+
+    async def test_read_values(self):
+        self.driver.connect()
+        self.driver.write_data({'MAIN.recipe': 3.5})
+        self.assertEqual(self.driver.read_values(['MAIN.recipe', 'MAIN.unknown']), [3.5, 0])
+
+    async def test_requests_from_two_threads(self):
+        """Each thread receives the reply to its own request."""
+        self.driver.connect()
+        self.driver.write_data({'MAIN.a': 1.5})
+        errors = []
+        def add_reads():
+            try:
+                for i in range(200):
+                    self.driver.add_read(f'MAIN.extra[{i}]')
+            except Exception as e:
+                errors.append(e)
+        thread = threading.Thread(target=add_reads)
+        thread.start()
+        try:
+            for _ in range(200):
+                self.assertEqual(self.driver.read_values(['MAIN.a']), [1.5])
+        finally:
+            thread.join(timeout=10.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+
+    async def test_array_write(self):
+        self.driver.connect()
+        self.driver.write_data({'MAIN.buffer': np.zeros(10, dtype=np.int32)})
+        self.driver.write_array('MAIN.buffer', np.array([7, 8], dtype=np.int32), 4)
+        data = self.driver.read_array_bytes('MAIN.buffer', 3, 4, 4)
+        self.assertEqual(np.frombuffer(data, dtype=np.int32).tolist(), [0, 7, 8, 0])
+        with self.assertRaises(TypeError):
+            self.driver.write_array('MAIN.buffer', np.zeros(2), 0)
+
+    async def test_snapshot_larger_than_memory(self):
+        self.driver = ProcessDriver('127.0.0.1.1.1', cycle_time=0.005, driver_factory=StandInDriver, snapshot_size=256)
+        self.driver.add_read('MAIN.text')
+        self.driver.connect()
+        text = 'x' * 10000
+        self.driver.write_data({'MAIN.text': text})
+        self.assertTrue(await self._read_until('MAIN.text', text))
+
+    async def test_restart_replays_reads(self):
+        self.driver.add_read('MAIN.echo_out')
+        self.driver.connect()
+        self.driver.close()
+        self.assertFalse(self.driver.is_connected())
+        self.driver.connect()
+        self.driver.write_data({'MAIN.echo_in': 7})
+        self.assertTrue(await self._read_until('MAIN.echo_out', 7))
+
+
+class TestWorkerProcessService(omni.kit.test.AsyncTestCase):
+    """Tests for the Manager API of a service that reads through a worker process."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver = ProcessDriver('127.0.0.1.1.1', cycle_time=0.005,
+                                    driver_factory=partial(StandInDriver, echo={'MAIN.echo_out': 'MAIN.echo_in'}))
+        _, self.service, self.manager = create_service(self.driver, REFRESH_RATE=5)
+
+    async def tearDown(self):
+        self.service.cleanup()
+
+    async def test_round_trip(self):
+        received = []
+        self.manager.register_data_callback(lambda event: received.append(event.payload['data']))
+        self.manager.add_cyclic_read_variables(['MAIN.echo_out'])
+        self.service.start()
+        self.manager.write_variable('MAIN.echo_in', 5)
+        self.assertTrue(await wait_for(lambda: received and received[-1] == {'MAIN': {'echo_out': 5}}, timeout=5.0))
+        self.assertEqual(self.service.status, "Connected")
+
+    async def test_refresh_rate_sets_cycle_time(self):
+        self.service.refresh_rate = 50
+        self.assertEqual(self.driver.cycle_time, 0.05)
+
+    async def test_cleanup_stops_worker(self):
+        self.manager.add_cyclic_read_variables(['MAIN.echo_out'])
+        self.service.start()
+        self.assertTrue(await wait_for(self.driver.is_connected, timeout=5.0))
+        self.service.cleanup()
+        self.assertFalse(self.driver.is_connected())
@@ -0,0 +1,39 @@
+"""
+Test the soak test harness with a short run
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.soak import SoakHarness, SoakSample, SoakThresholds, evaluate
+
+# pylint: disable=W0212
+
+
+class TestSoak(omni.kit.test.AsyncTestCase):
+    """Tests for the soak test harness."""
+
+    def test_short_run(self):
+        harness = SoakHarness(duration=2.5, churn_interval=0.02, sample_interval=0.25, warmup=0.5,
+                              thresholds=SoakThresholds(rss_growth_mb=200.0, traced_growth_mb=50.0, thread_growth=4, cycle_drift_ms=50.0),
+                              log=lambda line: None)
+        report = harness.run()
+        self.assertTrue(report.passed, report.summary())
+        self.assertGreater(len(report.samples), 3)
+        self.assertGreater(report.samples[-1].cycles, report.baseline.cycles)
+        # Every churn action ran, including a hot reload
+        self.assertGreater(harness._step, 20)
+        self.assertIsNone(harness._service)
+        # New variables were read and recorded
+        self.assertGreater(harness._added, 4)
+        self.assertGreater(max(sample.reads for sample in report.samples), 100)
+        self.assertGreater(max(sample.history_buffers for sample in report.samples), 3)
+
+    def test_thresholds(self):
+        thresholds = SoakThresholds(rss_growth_mb=10.0, traced_growth_mb=1.0, thread_growth=0, cycle_drift_ms=1.0,
+                                    read_growth=5, history_growth=2, history_capacity_growth=200)
+        baseline = SoakSample(1.0, 100.0, 5.0, 10, 10.0, 100, 100, 2, 200)
+        self.assertEqual(evaluate(baseline, SoakSample(60.0, 105.0, 5.5, 10, 10.5, 6000, 105, 4, 400), thresholds), [])
+        failures = evaluate(baseline, SoakSample(60.0, 150.0, 8.0, 12, 20.0, 6000, 106, 5, 401), thresholds)
+        self.assertEqual(len(failures), 7)
+        # RSS is skipped where it cannot be measured
+        self.assertEqual(evaluate(SoakSample(1.0, None, 5.0, 10, 10.0, 100, 100, 2, 200),
+                                  SoakSample(60.0, None, 5.0, 10, 10.0, 6000, 100, 2, 200), thresholds), [])
@@ -0,0 +1,148 @@
+"""
+Test decoding of PLC-side ring buffers into NumPy batches
+"""
+
+import numpy as np
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.stream import StreamReader, COUNTER_MODULO
+from loupe.simulation.beckhoff_bridge.stand_in_plc import StandInDriver
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+SAMPLE = np.dtype([('timestamp', '<u8'), ('position', '<f8')])
+
+# 2024-01-01 00:00:00 UTC as a FILETIME
+FILETIME_2024 = 133485408000000000
+
+
+class _RingBuffer():
+    """Plays the PLC side: writes samples to buffer[count MOD length] and increments count."""
+
+    def __init__(self, driver, length = 10, count = 0):
+        self.driver = driver
+        self.driver.memory['MAIN.buffer'] = np.zeros(length, dtype=SAMPLE)
+        self.driver.memory['MAIN.count'] = count
+
+    def write(self, positions):
+        buffer = self.driver.memory['MAIN.buffer']
+        for position in positions:
+            count = self.driver.memory['MAIN.count']
+            buffer[count % len(buffer)] = (FILETIME_2024 + int(position * 10000), position)
+            self.driver.memory['MAIN.count'] = (count + 1) % COUNTER_MODULO
+
+    def poll(self, reader):
+        return reader.poll(self.driver.memory['MAIN.count'], self.driver)
+
+
+class TestStreamReader(omni.kit.test.AsyncTestCase):
+    """Tests for fetching only new entries, wrap-around and overruns."""
+
+    def setUp(self):
+        self.driver = StandInDriver()
+        self.reader = StreamReader("axis", "MAIN.buffer", "MAIN.count", SAMPLE, "timestamp")
+
+    def test_new_entries_only(self):
+        plc = _RingBuffer(self.driver)
+        plc.write([1.0, 2.0])
+        self.assertIsNone(plc.poll(self.reader))
+
+        plc.write([3.0, 4.0, 5.0])
+        batch = plc.poll(self.reader)
+        self.assertEqual(batch.samples['position'].tolist(), [3.0, 4.0, 5.0])
+        self.assertEqual(batch.lost, 0)
+        self.assertIsNone(plc.poll(self.reader))
+
+    def test_wrap_around(self):
+        plc = _RingBuffer(self.driver, length=10)
+        plc.write(range(8))
+        plc.poll(self.reader)
+        plc.write([8.0, 9.0, 10.0, 11.0, 12.0])
+        batch = plc.poll(self.reader)
+        self.assertEqual(batch.samples['position'].tolist(), [8.0, 9.0, 10.0, 11.0, 12.0])
+
+    def test_overrun(self):
+        plc = _RingBuffer(self.driver, length=10)
+        plc.poll(self.reader)
+        plc.write(range(25))
+        batch = plc.poll(self.reader)
+        self.assertEqual(batch.lost, 15)
+        self.assertEqual(batch.samples['position'].tolist(), list(range(15, 25)))
+
+    def test_counter_wraps(self):
+        plc = _RingBuffer(self.driver, length=8, count=COUNTER_MODULO - 2)
+        plc.poll(self.reader)
+        plc.write([1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(self.driver.memory['MAIN.count'], 2)
+        self.assertEqual(plc.poll(self.reader).samples['position'].tolist(), [1.0, 2.0, 3.0, 4.0])
+
+    def test_timestamps(self):
+        plc = _RingBuffer(self.driver)
+        plc.poll(self.reader)
+        plc.write([0.0, 1.0])
+        batch = plc.poll(self.reader)
+        self.assertAlmostEqual(batch.timestamps[0], 1704067200.0)
+        self.assertAlmostEqual(batch.timestamps[1] - batch.timestamps[0], 0.001, places=6)
+
+    def test_missing_buffer_backs_off(self):
+        reader = StreamReader("axis", "MAIN.not_an_array", "MAIN.count", SAMPLE, retry_interval=60.0)
+        with self.assertRaises(KeyError):
+            reader.poll(0, self.driver)
+        self.assertIn("MAIN.not_an_array", reader.error)
+        # The stream is not opened again before the retry interval
+        self.driver.memory['MAIN.not_an_array'] = np.zeros(10, dtype=SAMPLE)
+        self.assertIsNone(reader.poll(0, self.driver))
+        reader._retry_time = 0.0
+        self.assertIsNone(reader.poll(0, self.driver))
+        self.assertIsNone(reader.error)
+
+    def test_invalid_time_field(self):
+        with self.assertRaises(ValueError):
+            StreamReader("axis", "MAIN.buffer", "MAIN.count", SAMPLE, "time")
+
+
+class TestStreamSubscription(omni.kit.test.AsyncTestCase):
+    """Tests for stream batches delivered by the service."""
+
+    async def test_bad_stream_does_not_stop_cycle(self):
+        driver, service, manager = create_service()
+        plc = _RingBuffer(driver, length=100)
+        cyclic = []
+        received = []
+        try:
+            manager.add_stream("enc", "MAIN.not_an_array", "MAIN.count", '<f8')
+            manager.add_stream("axis", "MAIN.buffer", "MAIN.count", SAMPLE, "timestamp")
+            manager.add_cyclic_read_variables(['MAIN.speed'])
+            manager.register_data_callback(lambda event: cyclic.append(event.payload['data']))
+            manager.register_stream_callback(lambda event: received.append(event.payload['batch']))
+            service.start()
+
+            self.assertTrue(await wait_for(lambda: driver.read_count > 3))
+            self.assertIsNotNone(service._streams["enc"].error)
+            self.assertIn("Error reading stream enc", service.status)
+
+            # The cyclic reads and the good stream carry on
+            driver.memory['MAIN.speed'] = 5
+            plc.write(range(20))
+            await wait_for(lambda: cyclic and cyclic[-1]['MAIN']['speed'] == 5 and sum(len(batch) for batch in received) >= 20)
+            self.assertEqual(cyclic[-1]['MAIN']['speed'], 5)
+            self.assertEqual(sum(len(batch) for batch in received), 20)
+        finally:
+            service.cleanup()
+
+    async def test_manager(self):
+        driver, service, manager = create_service()
+        plc = _RingBuffer(driver, length=100)
+        received = []
+        try:
+            manager.add_stream("axis", "MAIN.buffer", "MAIN.count", SAMPLE, "timestamp")
+            manager.register_stream_callback(lambda event: received.append(event.payload['batch']))
+            service.start()
+
+            self.assertTrue(await wait_for(lambda: driver.read_count > 1))
+            plc.write(range(50))
+
+            await wait_for(lambda: sum(len(batch) for batch in received) >= 50)
+            positions = np.concatenate([batch.samples['position'] for batch in received])
+            self.assertEqual(positions.tolist(), list(range(50)))
+        finally:
+            service.cleanup()
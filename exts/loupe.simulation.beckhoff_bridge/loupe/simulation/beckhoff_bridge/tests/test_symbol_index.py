@@ -0,0 +1,48 @@
+"""
+Test expansion of wildcard subscriptions against an indexed symbol table
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.symbol_index import SymbolIndex, parse_array_bounds
+
+
+class TestSymbolIndex(omni.kit.test.AsyncTestCase):
+    """Tests for wildcard and prefix pattern expansion."""
+
+    # Run before every test
+    async def setUp(self):
+        self.index = SymbolIndex([
+            ("MAIN.axis", "ARRAY [0..2] OF ST_Axis"),
+            ("MAIN.grid", "ARRAY [1..2,0..1] OF INT"),
+            ("MAIN.sensor_1", "BOOL"),
+            ("MAIN.sensor_2", "BOOL"),
+            ("GVL_Robot.speed", "LREAL"),
+            ("GVL_Robot.pos", "ST_Pos"),
+        ])
+
+    def test_array_bounds(self):
+        self.assertEqual(parse_array_bounds("ARRAY [0..3] OF REAL"), [(0, 3)])
+        self.assertEqual(parse_array_bounds("ARRAY [1..2,-1..1] OF INT"), [(1, 2), (-1, 1)])
+        self.assertIsNone(parse_array_bounds("LREAL"))
+
+    def test_prefix(self):
+        self.assertEqual(self.index.expand("GVL_Robot.*"), ["GVL_Robot.speed", "GVL_Robot.pos"])
+
+    def test_array_elements(self):
+        self.assertEqual(self.index.expand("MAIN.axis[*].position"),
+                         ["MAIN.axis[0].position", "MAIN.axis[1].position", "MAIN.axis[2].position"])
+        self.assertEqual(self.index.expand("MAIN.grid[*,1]"), ["MAIN.grid[1,1]", "MAIN.grid[2,1]"])
+
+    def test_segment_wildcard(self):
+        self.assertEqual(self.index.expand("MAIN.sensor_?"), ["MAIN.sensor_1", "MAIN.sensor_2"])
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.index.expand("gvl_robot.POS.x"), ["GVL_Robot.pos.x"])
+
+    def test_no_match(self):
+        self.assertEqual(self.index.expand("MAIN.missing.*"), [])
+        self.assertEqual(self.index.expand("MAIN.sensor_1[*]"), [])
+
+    def test_member_wildcard_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.expand("MAIN.axis[*].*")
@@ -0,0 +1,46 @@
+"""
+Test recording and Chrome trace-event export of bridge timeline events
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.tracer import Tracer
+
+
+class TestTracer(omni.kit.test.AsyncTestCase):
+    """Tests for the bounded trace ring and its export."""
+
+    # Run before every test
+    async def setUp(self):
+        self.tracer = Tracer(capacity=4)
+
+    def test_disabled_records_nothing(self):
+        with self.tracer.span("read"):
+            pass
+        self.tracer.instant("disconnect")
+        self.assertEqual(self.tracer.to_chrome_trace()["traceEvents"], [])
+
+    def test_span_export(self):
+        self.tracer.enabled = True
+        with self.tracer.span("read", "cycle", {"count": 3}):
+            pass
+        events = [event for event in self.tracer.to_chrome_trace()["traceEvents"] if event["ph"] != "M"]
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["name"], "read")
+        self.assertEqual(events[0]["cat"], "cycle")
+        self.assertEqual(events[0]["args"], {"count": 3})
+        self.assertGreaterEqual(events[0]["dur"], 0)
+
+    def test_span_records_error(self):
+        self.tracer.enabled = True
+        with self.assertRaises(RuntimeError):
+            with self.tracer.span("write"):
+                raise RuntimeError("boom")
+        events = self.tracer.to_chrome_trace()["traceEvents"]
+        self.assertIn("boom", events[0]["args"]["error"])
+
+    def test_ring_is_bounded(self):
+        self.tracer.enabled = True
+        for i in range(10):
+            self.tracer.instant(f"event {i}")
+        names = [event["name"] for event in self.tracer.to_chrome_trace()["traceEvents"] if event["ph"] == "i"]
+        self.assertEqual(names, ["event 6", "event 7", "event 8", "event 9"])
@@ -0,0 +1,193 @@
+"""
+Test read groups that are only read when their trigger fires
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.ads_driver import AdsDriver
+from loupe.simulation.beckhoff_bridge.trigger import TriggeredGroup, RISING_EDGE, CHANGE
+from loupe.simulation.beckhoff_bridge.stand_in_plc import StandInDriver
+from loupe.simulation.beckhoff_bridge.tests.service_fixture import create_service, wait_for
+
+# pylint: disable=W0212
+
+
+class _CountingDriver(StandInDriver):
+    """A stand-in PLC that counts the group reads, and can fail them."""
+
+    def __init__(self):
+        super().__init__()
+        self.group_reads = 0
+        self.fail = False
+
+    def read_values(self, names):
+        if self.fail:
+            raise RuntimeError("Read failed")
+        self.group_reads += 1
+        return super().read_values(names)
+
+
+class _ListConnection():
+    """Answers read_list_by_name from a dictionary, and records the requested names."""
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.reads = []
+
+    def read_list_by_name(self, names, structure_defs = None):
+        self.reads.append(list(names))
+        return {name: self.memory[name] for name in names}
+
+
+class TestAdsDriverReadValues(omni.kit.test.AsyncTestCase):
+    """Tests for reads outside of the cyclic read list."""
+
+    def test_read_per_port(self):
+        driver = AdsDriver('127.0.0.1.1.1')
+        driver._connections[851] = _ListConnection({'MAIN.a': 1, 'MAIN.b': 2})
+        driver._connections[852] = _ListConnection({'MAIN.c': 3})
+        self.assertEqual(driver.read_values(['MAIN.b', '852:MAIN.c', 'MAIN.a']), [2, 3, 1])
+        self.assertEqual(driver._connections[851].reads, [['MAIN.b', 'MAIN.a']])
+        # The cyclic read list is unchanged
+        self.assertEqual(driver.read_table().values, [])
+
+
+class TestTriggeredGroup(omni.kit.test.AsyncTestCase):
+    """Tests for firing on rising edges and changes."""
+
+    def setUp(self):
+        self.driver = _CountingDriver()
+        self.driver.memory['MAIN.recipe.speed'] = 2.5
+
+    def test_rising_edge(self):
+        group = TriggeredGroup("recipe", "MAIN.ready", ["MAIN.recipe.speed"], RISING_EDGE)
+        self.assertIsNone(group.poll(False, self.driver))
+        data = group.poll(True, self.driver)
+        self.assertEqual(data.to_dict(), {'MAIN': {'recipe': {'speed': 2.5}}})
+        # Holding the flag does not read again
+        self.assertIsNone(group.poll(True, self.driver))
+        self.assertIsNone(group.poll(False, self.driver))
+        self.assertIsNotNone(group.poll(True, self.driver))
+        self.assertEqual(self.driver.group_reads, 2)
+
+    def test_first_value_sets_reference(self):
+        group = TriggeredGroup("recipe", "MAIN.ready", ["MAIN.recipe.speed"])
+        self.assertIsNone(group.poll(True, self.driver))
+        group = TriggeredGroup("report", "MAIN.count", ["MAIN.recipe.speed"], CHANGE)
+        self.assertIsNone(group.poll(7, self.driver))
+        self.assertEqual(self.driver.group_reads, 0)
+
+    def test_change(self):
+        group = TriggeredGroup("report", "MAIN.count", ["MAIN.recipe.speed"], CHANGE)
+        group.poll(1, self.driver)
+        self.assertIsNone(group.poll(1, self.driver))
+        # Counting twice between polls reads once
+        self.assertIsNotNone(group.poll(3, self.driver))
+        self.assertIsNone(group.poll(3, self.driver))
+        self.assertEqual(self.driver.group_reads, 1)
+
+    def test_failed_read_is_repeated(self):
+        group = TriggeredGroup("recipe", "MAIN.ready", ["MAIN.recipe.speed"], retry_interval=0.0)
+        group.poll(False, self.driver)
+        self.driver.fail = True
+        with self.assertRaises(RuntimeError):
+            group.poll(True, self.driver)
+        self.assertEqual(group.error, "Read failed")
+        self.driver.fail = False
+        self.assertIsNotNone(group.poll(True, self.driver))
+        self.assertIsNone(group.error)
+
+    def test_failed_read_backs_off(self):
+        group = TriggeredGroup("recipe", "MAIN.ready", ["MAIN.recipe.speed"], retry_interval=60.0)
+        group.poll(False, self.driver)
+        self.driver.fail = True
+        with self.assertRaises(RuntimeError):
+            group.poll(True, self.driver)
+        self.driver.fail = False
+        # The trigger is kept, but the read is not repeated before the retry interval
+        self.assertIsNone(group.poll(True, self.driver))
+        self.assertEqual(self.driver.group_reads, 0)
+        group._retry_time = 0.0
+        self.assertIsNotNone(group.poll(True, self.driver))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            TriggeredGroup("recipe", "MAIN.ready", ["MAIN.recipe"], "falling_edge")
+        with self.assertRaises(ValueError):
+            TriggeredGroup("recipe", "MAIN.ready", ["MAIN.recipe[*]"])
+
+
+class TestTriggeredGroupService(omni.kit.test.AsyncTestCase):
+    """Tests for triggered groups read and delivered by the service."""
+
+    # Run before every test
+    async def setUp(self):
+        self.driver = _CountingDriver()
+        self.driver.memory.update({'MAIN.ready': False, 'MAIN.recipe.speed': 2.5, 'MAIN.recipe.name': 'A'})
+        _, self.service, self.manager = create_service(self.driver)
+
+    async def tearDown(self):
+        self.service.cleanup()
+
+    async def test_read_once_per_trigger(self):
+        received = []
+        cyclic = []
+        self.manager.add_triggered_group("recipe", "MAIN.ready", ["MAIN.recipe.speed", "MAIN.recipe.name"])
+        self.manager.register_group_callback(lambda event: received.append(event.payload))
+        self.manager.register_data_callback(lambda event: cyclic.append(event.payload['data']))
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > 1))
+
+        self.driver.write_data({'MAIN.ready': True})
+        self.assertTrue(await wait_for(lambda: len(received) == 1))
+        start = self.driver.read_count
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > start + 3))
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0], {'group': 'recipe', 'trigger': True,
+                                       'data': {'MAIN': {'recipe': {'speed': 2.5, 'name': 'A'}}}})
+        self.assertEqual(self.driver.group_reads, 1)
+        # The group is not part of the cyclic data
+        self.assertEqual(cyclic[-1], {'MAIN': {'ready': True}})
+
+        self.driver.write_data({'MAIN.ready': False, 'MAIN.recipe.name': 'B'})
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > start + 6))
+        self.driver.write_data({'MAIN.ready': True})
+        self.assertTrue(await wait_for(lambda: len(received) == 2))
+        self.assertEqual(received[1]['data']['MAIN']['recipe']['name'], 'B')
+
+    async def test_failing_group_does_not_stop_cycle(self):
+        cyclic = []
+        self.manager.add_triggered_group("recipe", "MAIN.ready", ["MAIN.recipe.speed"])
+        self.manager.add_cyclic_read_variables(["MAIN.speed"])
+        self.manager.register_data_callback(lambda event: cyclic.append(event.payload['data']))
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > 1))
+
+        self.driver.fail = True
+        self.driver.write_data({'MAIN.ready': True})
+        group = self.service._groups["recipe"]
+        self.assertTrue(await wait_for(lambda: group.error is not None))
+        self.assertIn("Error reading group recipe", self.service.status)
+
+        # The cyclic data keeps flowing, and the group is not read again every cycle
+        count = len(cyclic)
+        self.driver.write_data({'MAIN.speed': 1})
+        self.assertTrue(await wait_for(lambda: len(cyclic) > count and cyclic[-1]['MAIN'].get('speed') == 1, timeout=0.5))
+        self.assertEqual(group.error, "Read failed")
+
+        self.driver.fail = False
+        self.assertTrue(await wait_for(lambda: self.driver.group_reads == 1))
+        self.assertIsNone(group.error)
+
+    async def test_remove(self):
+        received = []
+        self.service.add_triggered_group("report", "MAIN.count", ["MAIN.recipe.speed"], CHANGE)
+        self.service.subscribe_groups(lambda event: received.append(event.payload))
+        self.service.start()
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > 1))
+        self.driver.write_data({'MAIN.count': 1})
+        self.assertTrue(await wait_for(lambda: len(received) == 1))
+        self.service.remove_triggered_group("report")
+        self.driver.write_data({'MAIN.count': 2})
+        start = self.driver.read_count
+        self.assertTrue(await wait_for(lambda: self.driver.read_count > start + 3))
+        self.assertEqual(len(received), 1)
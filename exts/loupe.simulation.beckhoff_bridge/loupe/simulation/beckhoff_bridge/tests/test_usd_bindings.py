@@ -0,0 +1,231 @@
+"""
+Test parsing of PLC-to-USD binding configurations, and the values the binding engine writes
+"""
+
+import omni.kit.test
+from loupe.simulation.beckhoff_bridge.ads_driver import split_plc_var_name, lookup_plc_var
+from loupe.simulation.beckhoff_bridge.events import BridgeEvent, EVENT_TYPE_DATA_READ
+from loupe.simulation.beckhoff_bridge.usd_bindings import (Binding, OutputBinding, UsdBindingEngine, parse_bindings,
+                                                           parse_output_bindings)
+
+# pylint: disable=W0212
+
+
+class TestVariableLookup(omni.kit.test.AsyncTestCase):
+    """Tests for looking up flat variable names in parsed data."""
+
+    def test_split(self):
+        self.assertEqual(split_plc_var_name("MAIN.myStruct.myArray[3].myVar"), ("MAIN", "myStruct", "myArray", 3, "myVar"))
+        self.assertEqual(split_plc_var_name("gVar"), ("gVar",))
+
+    def test_lookup(self):
+        data = {"MAIN": {"axis": [None, {"position": 2.5}]}}
+        self.assertEqual(lookup_plc_var(data, split_plc_var_name("MAIN.axis[1].position")), 2.5)
+        self.assertIsNone(lookup_plc_var(data, split_plc_var_name("MAIN.axis[0].position")))
+        self.assertIsNone(lookup_plc_var(data, split_plc_var_name("MAIN.axis[5].position")))
+        self.assertIsNone(lookup_plc_var(data, split_plc_var_name("MAIN.other")))
+
+
+class TestParseBindings(omni.kit.test.AsyncTestCase):
+    """Tests for the accepted binding configuration forms."""
+
+    def setUp(self):
+        self.definition = {"variable": "MAIN.x", "prim": "/World/Cube", "attribute": "translate", "component": 0, "scale": 0.001, "offset": 1.0}
+
+    def test_forms(self):
+        for config in ([self.definition],
+                       {"bindings": [self.definition]},
+                       {"cube_x": self.definition},
+                       '{"bindings": [{"variable": "MAIN.x", "prim": "/World/Cube", "attribute": "translate", "component": 0, "scale": 0.001, "offset": 1.0}]}'):
+            bindings = parse_bindings(config)
+            self.assertEqual(len(bindings), 1)
+            self.assertEqual(bindings[0].attribute_path, "/World/Cube.xformOp:translate")
+            self.assertEqual(bindings[0].component, 0)
+            self.assertEqual(bindings[0].keys, ("MAIN", "x"))
+
+    def test_transform(self):
+        binding = Binding.from_dict(self.definition)
+        self.assertAlmostEqual(binding.transform(1000), 2.0)
+        self.assertIs(type(Binding("MAIN.count", "/World/Counter", "count").transform(7)), int)
+
+    def test_visibility(self):
+        binding = Binding("MAIN.lamp", "/World/Lamp", "visibility", scale=5.0)
+        self.assertEqual(binding.transform(True), "inherited")
+        self.assertEqual(binding.transform(False), "invisible")
+
+    def test_interpolation(self):
+        self.assertIsNone(Binding.from_dict(self.definition).interpolation)
+        binding = Binding.from_dict(dict(self.definition, interpolation="linear"))
+        self.assertEqual(binding.interpolation, "linear")
+        with self.assertRaises(ValueError):
+            Binding.from_dict(dict(self.definition, interpolation="cubic"))
+
+
+class TestOutputBindings(omni.kit.test.AsyncTestCase):
+    """Tests for parsing and converting USD-to-PLC output bindings."""
+
+    def setUp(self):
+        self.output = {"variable": "MAIN.part_x", "prim": "/World/Part", "attribute": "translate", "component": 0, "scale": 1000.0}
+        self.binding = {"variable": "MAIN.x", "prim": "/World/Cube", "attribute": "translate"}
+
+    def test_sections(self):
+        config = {"bindings": [self.binding], "outputs": [self.output]}
+        self.assertEqual([binding.variable for binding in parse_bindings(config)], ["MAIN.x"])
+        outputs = parse_output_bindings(config)
+        self.assertEqual(len(outputs), 1)
+        self.assertIsInstance(outputs[0], OutputBinding)
+        self.assertEqual(outputs[0].attribute_path, "/World/Part.xformOp:translate")
+
+        self.assertEqual(parse_bindings({"outputs": {"part_x": self.output}}), [])
+        self.assertEqual(len(parse_output_bindings({"outputs": {"part_x": self.output}})), 1)
+
+    def test_no_outputs(self):
+        self.assertEqual(parse_output_bindings([self.binding]), [])
+        self.assertEqual(parse_output_bindings({"cube_x": self.binding}), [])
+
+    def test_integers(self):
+        self.assertIs(type(OutputBinding("MAIN.count", "/World/Part", "count").transform(7)), int)
+        self.assertIs(type(OutputBinding("MAIN.count", "/World/Part", "count", scale=2.0).transform(7)), int)
+        self.assertAlmostEqual(OutputBinding("MAIN.count", "/World/Part", "count", scale=0.5).transform(7), 3.5)
+
+    def test_transform(self):
+        binding = OutputBinding.from_dict(self.output)
+        self.assertAlmostEqual(binding.transform((0.25, 1.0, 2.0)), 250.0)
+        whole = OutputBinding("MAIN.pos", "/World/Part", "translate", scale=2.0)
+        self.assertEqual(whole.transform((1.0, 2.0, 3.0)), [2.0, 4.0, 6.0])
+
+    def test_bool_and_visibility(self):
+        self.assertIs(OutputBinding("MAIN.hit", "/World/Sensor", "triggered", scale=5.0).transform(True), True)
+        visibility = OutputBinding("MAIN.shown", "/World/Lamp", "visibility")
+        self.assertTrue(visibility.transform("inherited"))
+        self.assertFalse(visibility.transform("invisible"))
+
+
+class _FakeAttribute():
+    """Stands in for a Usd.Attribute, and records the values set."""
+
+    def __init__(self, value):
+        self.value = value
+        self.sets = []
+        self.failures = 0
+
+    def IsValid(self):
+        return True
+
+    def Get(self):
+        return self.value
+
+    def Set(self, value):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Set failed")
+        self.value = value
+        self.sets.append(value)
+
+
+class _FakeStage():
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def GetAttributeAtPath(self, path):
+        return self.attributes[str(path)]
+
+
+class _FakeContext():
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def get_stage(self):
+        return self.stage
+
+
+class _FakeBridge():
+    """Stands in for the bridge Manager, and records the batched writes."""
+
+    def __init__(self):
+        self.writes = []
+
+    def add_cyclic_read_variables(self, variables):
+        pass
+
+    def write_variables(self, values):
+        self.writes.append(dict(values))
+
+
+class TestUsdBindingEngine(omni.kit.test.AsyncTestCase):
+    """Tests for the values the engine writes to USD and to the PLC."""
+
+    def setUp(self):
+        self.engine = UsdBindingEngine()
+        self.engine._bridge = _FakeBridge()
+        self.stage = _FakeStage({
+            "/World/Part.count": _FakeAttribute(7),
+            "/World/Part.blocked": _FakeAttribute(True),
+            "/World/Part.position": _FakeAttribute(0.0),
+            "/World/Part.xformOp:translate": _FakeAttribute((0.25, 1.0, 2.0)),
+        })
+
+    def tearDown(self):
+        self.engine.cleanup()
+
+    def test_output_types(self):
+        self.engine.set_output_bindings([
+            OutputBinding("MAIN.count", "/World/Part", "count"),
+            OutputBinding("MAIN.double_count", "/World/Part", "count", scale=2.0),
+            OutputBinding("MAIN.blocked", "/World/Part", "blocked"),
+            OutputBinding("MAIN.x", "/World/Part", "translate", component=0, scale=1000.0),
+        ])
+        self.engine._send_outputs(self.stage)
+        writes = self.engine._bridge.writes
+        self.assertEqual(writes, [{"MAIN.count": 7, "MAIN.double_count": 14, "MAIN.blocked": True, "MAIN.x": 250.0}])
+        self.assertIs(type(writes[0]["MAIN.count"]), int)
+        self.assertIs(type(writes[0]["MAIN.double_count"]), int)
+
+        # Unchanged values are not sent again
+        self.engine._dirty = set(self.engine._outputs)
+        self.engine._send_outputs(self.stage)
+        self.assertEqual(len(writes), 1)
+
+    def test_input_types(self):
+        self.engine.set_bindings([
+            Binding("MAIN.count", "/World/Part", "count"),
+            Binding("MAIN.position", "/World/Part", "position", scale=0.001),
+        ])
+        self.engine._usd_context = _FakeContext(self.stage)
+        self.engine._on_data(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': {'MAIN': {'count': 9, 'position': 1500}}}))
+        self.engine._on_update(None)
+        count = self.stage.attributes["/World/Part.count"]
+        self.assertEqual(count.sets, [9])
+        self.assertIs(type(count.value), int)
+        self.assertAlmostEqual(self.stage.attributes["/World/Part.position"].value, 1.5)
+
+    def test_reverted_value(self):
+        self.engine.set_bindings([Binding("MAIN.count", "/World/Part", "count")])
+        self.engine._usd_context = _FakeContext(self.stage)
+        count = self.stage.attributes["/World/Part.count"]
+        self.engine._on_data(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': {'MAIN': {'count': 9}}}))
+        self.engine._on_update(None)
+        self.assertEqual(count.sets, [9])
+
+        # Changed and changed back between two frames
+        self.engine._on_data(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': {'MAIN': {'count': 10}}}))
+        self.engine._on_data(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': {'MAIN': {'count': 9}}}))
+        self.engine._on_update(None)
+        self.assertEqual(count.value, 9)
+        self.assertEqual(count.sets, [9])
+
+    def test_failed_set(self):
+        self.engine.set_bindings([Binding("MAIN.count", "/World/Part", "count")])
+        self.engine._usd_context = _FakeContext(self.stage)
+        count = self.stage.attributes["/World/Part.count"]
+        count.failures = 1
+        self.engine._on_data(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': {'MAIN': {'count': 9}}}))
+        self.engine._on_update(None)
+        self.assertEqual(count.sets, [])
+
+        # The same value is written by the next data
+        self.engine._on_data(BridgeEvent(EVENT_TYPE_DATA_READ, {'data': {'MAIN': {'count': 9}}}))
+        self.engine._on_update(None)
+        self.assertEqual(count.sets, [9])
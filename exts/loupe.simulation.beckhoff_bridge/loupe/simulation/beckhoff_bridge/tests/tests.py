@@ -2,8 +2,10 @@
 Test a wide variety of inputs for parsing PLC representations of data into a dictionary
 """
 
+from types import SimpleNamespace
+
 import omni.kit.test
-from loupe.simulation.beckhoff_bridge.ads_driver import AdsDriver
+from loupe.simulation.beckhoff_bridge.ads_driver import AdsDriver, split_port
 
 # pylint: disable=W0212
 
@@ -419,3 +421,119 @@ class TestParseNameComplex(omni.kit.test.AsyncTestCase):
         self.assertEqual(actual_output, 
                          correct_output, 
                          msg=self.test_output_string.format(correct=correct_output, actual=actual_output))
+
+
+class TestSplitPort(omni.kit.test.AsyncTestCase):
+    """Tests for ADS port qualifiers on variable names."""
+
+    def test_unqualified(self):
+        self.assertEqual(split_port("MAIN.var"), (851, "MAIN.var"))
+        self.assertEqual(split_port("MAIN.var", 852), (852, "MAIN.var"))
+
+    def test_qualified(self):
+        self.assertEqual(split_port("852:MAIN.var"), (852, "MAIN.var"))
+        self.assertEqual(split_port("501:GVL.arr[3].x"), (501, "GVL.arr[3].x"))
+
+
+class _FakeConnection():
+    """Answers reads from a dictionary, and records the requests and whether it was closed."""
+
+    def __init__(self, memory, symbols = ()):
+        self.memory = memory
+        self.symbols = [SimpleNamespace(name=name, symbol_type=symbol_type) for name, symbol_type in symbols]
+        self.symbol_version = 1
+        self.reads = []
+        self.writes = []
+        self.closed = False
+
+    def get_all_symbols(self):
+        return self.symbols
+
+    def read(self, index_group, index_offset, plc_datatype):
+        return self.symbol_version
+
+    def read_list_by_name(self, names, structure_defs = None):
+        self.reads.append(list(names))
+        return {name: self.memory[name] for name in names}
+
+    def write_list_by_name(self, data):
+        self.writes.append(dict(data))
+        self.memory.update(data)
+
+    def close(self):
+        self.closed = True
+
+
+class TestAdsDriverPorts(omni.kit.test.AsyncTestCase):
+    """Tests for grouping reads and writes per ADS port."""
+
+    def setUp(self):
+        self.driver = AdsDriver('127.0.0.1.1.1')
+        self.plc1 = _FakeConnection({'MAIN.a': 1, 'MAIN.b': 2})
+        self.plc2 = _FakeConnection({'MAIN.a': 10, 'GVL.c': 3})
+        self.driver._connections = {851: self.plc1, 852: self.plc2}
+
+    def tearDown(self):
+        self.driver.disconnect()
+
+    def test_read_plan(self):
+        for name in ['MAIN.a', '852:MAIN.a', 'MAIN.b', '852:GVL.c']:
+            self.driver.add_read(name)
+        groups, index = self.driver._build_read_plan()
+        self.assertIs(self.driver._get_read_plan()[1], index)
+        self.assertEqual(groups, [(851, [('MAIN.a', 'MAIN.a'), ('MAIN.b', 'MAIN.b')]),
+                                  (852, [('852:MAIN.a', 'MAIN.a'), ('852:GVL.c', 'GVL.c')])])
+        self.assertEqual(list(index.names), ['MAIN.a', '852:MAIN.a', 'MAIN.b', '852:GVL.c'])
+
+    def test_read_table(self):
+        for name in ['MAIN.a', '852:MAIN.a', 'MAIN.b', '852:GVL.c']:
+            self.driver.add_read(name)
+        snapshot = self.driver.read_table()
+        self.assertEqual(snapshot.values, [1, 10, 2, 3])
+        self.assertEqual(self.plc1.reads, [['MAIN.a', 'MAIN.b']])
+        self.assertEqual(self.plc2.reads, [['MAIN.a', 'GVL.c']])
+
+    def test_write_data(self):
+        self.driver.write_data({'MAIN.a': 5, '852:MAIN.a': 50, '852:GVL.c': 30})
+        self.assertEqual(self.plc1.writes, [{'MAIN.a': 5}])
+        self.assertEqual(self.plc2.writes, [{'MAIN.a': 50, 'GVL.c': 30}])
+
+    def test_connect_closes_previous_connections(self):
+        reconnected = _FakeConnection({})
+        self.driver._get_connection = lambda port: reconnected
+        self.driver.connect()
+        self.assertTrue(self.plc1.closed)
+        self.assertTrue(self.plc2.closed)
+        self.assertEqual(self.driver._connections, {})
+
+
+class TestAdsDriverPatterns(omni.kit.test.AsyncTestCase):
+    """Tests for expanding wildcard patterns after an online change."""
+
+    def setUp(self):
+        self.driver = AdsDriver('127.0.0.1.1.1')
+        self.plc = _FakeConnection({}, [("MAIN.sensor_1", "BOOL"), ("MAIN.axis", "ARRAY [0..1] OF ST_Axis")])
+        self.driver._connections = {851: self.plc}
+
+    def test_bad_pattern_is_skipped(self):
+        self.driver.add_read("MAIN.sensor_?")
+        self.driver.add_read("MAIN.axis[*].*")
+        self.assertTrue(self.driver.check_online_change())
+        self.assertEqual(self.driver._get_read_names(), ["MAIN.sensor_1"])
+
+    def test_version_recorded_after_expansion(self):
+        self.driver.add_read("MAIN.sensor_?")
+        get_all_symbols = self.plc.get_all_symbols
+        def fail():
+            raise RuntimeError("Upload failed")
+        self.plc.get_all_symbols = fail
+        with self.assertRaises(RuntimeError):
+            self.driver.check_online_change()
+        self.assertEqual(self.driver._symbol_versions, {})
+
+        # The next check uploads again, even though the version did not change
+        self.plc.get_all_symbols = get_all_symbols
+        self.driver._symbol_check_time = 0
+        self.assertTrue(self.driver.check_online_change())
+        self.assertEqual(self.driver._symbol_versions, {851: 1})
+        self.assertEqual(self.driver._get_read_names(), ["MAIN.sensor_1"])
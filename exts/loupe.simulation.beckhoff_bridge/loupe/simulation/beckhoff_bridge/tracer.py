@@ -0,0 +1,178 @@
+'''
+  File: **tracer.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+class _NullSpan():
+    """
+    Span returned while tracing is disabled. Entering and exiting it does nothing.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span():
+    """
+    Records the time between entering and exiting as one complete event.
+    """
+
+    __slots__ = ("_tracer", "_name", "_category", "_args", "_start")
+
+    def __init__(self, tracer, name, category, args):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        args = self._args
+        if exc_type is not None:
+            args = dict(args or {}, error=repr(exc_value))
+        self._tracer._events.append(("X", self._name, self._category, self._start, end - self._start, threading.get_ident(), args))
+        return False
+
+
+class Tracer():
+    """
+    Records timeline events of the bridge into a bounded in-memory ring, and exports them in Chrome trace-event
+    format for viewing in Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+
+    While disabled, span() returns a shared no-op context manager, so instrumented code only pays for one attribute
+    check per span.
+
+    Args:
+        capacity (int): The maximum number of events kept. The oldest events are dropped first.
+
+    e.g.
+        with get_tracer().span("read"):
+            ...
+
+    """
+
+    def __init__(self, capacity : int = 100000):
+        self.enabled = False
+        self._events = deque(maxlen=capacity)
+
+    @property
+    def capacity(self):
+        return self._events.maxlen
+
+    @capacity.setter
+    def capacity(self, capacity : int):
+        self._events = deque(self._events, maxlen=capacity)
+
+    def span(self, name : str, category : str = "bridge", args : dict = None):
+        """
+        Returns a context manager that records its duration as a complete event.
+
+        Args:
+            name (str): The name of the event. "read"
+            category (str, optional): The category of the event. "cycle"
+            args (dict, optional): Extra values shown with the event.
+
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def instant(self, name : str, category : str = "bridge", args : dict = None):
+        """
+        Records an event without duration, such as a disconnect.
+        """
+        if self.enabled:
+            self._events.append(("i", name, category, time.perf_counter_ns(), 0, threading.get_ident(), args))
+
+    def counter(self, name : str, values : dict):
+        """
+        Records counter values, shown as a graph track in the trace viewer.
+
+        Args:
+            name (str): The name of the counter track. "queue"
+            values (dict): The values at this time. {"pending_writes": 12}
+
+        """
+        if self.enabled:
+            self._events.append(("C", name, "counter", time.perf_counter_ns(), 0, threading.get_ident(), values))
+
+    def clear(self):
+        """
+        Removes all recorded events.
+        """
+        self._events.clear()
+
+    def to_chrome_trace(self):
+        """
+        Converts the recorded events into the Chrome trace-event format.
+
+        Returns:
+            dict: {"traceEvents": [...], "displayTimeUnit": "ms"}
+
+        """
+        pid = os.getpid()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        trace_events = []
+        thread_ids = set()
+        for phase, name, category, start, duration, tid, args in list(self._events):
+            event = {"name": name, "cat": category, "ph": phase, "ts": start / 1000, "pid": pid, "tid": tid}
+            if phase == "X":
+                event["dur"] = duration / 1000
+            elif phase == "i":
+                event["s"] = "t"
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+            thread_ids.add(tid)
+
+        for tid in thread_ids:
+            name = thread_names.get(tid, f"Thread {tid}")
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def dump(self, path : str):
+        """
+        Writes the recorded events to a Chrome trace-event JSON file.
+
+        Args:
+            path (str): The file to write.
+
+        Returns:
+            int: The number of events written.
+
+        """
+        trace = self.to_chrome_trace()
+        with open(path, "w") as f:
+            json.dump(trace, f)
+        return len(trace["traceEvents"])
+
+
+_tracer = Tracer()
+
+def get_tracer():
+    """
+    Returns the tracer shared by the bridge and its subscribers.
+    """
+    return _tracer
@@ -0,0 +1,112 @@
+'''
+  File: **trigger.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import time
+
+from .flat_data import ReadIndex, FlatSnapshot
+from .symbol_index import is_pattern
+
+# The group is read when the trigger goes from FALSE to TRUE
+RISING_EDGE = "rising_edge"
+# The group is read whenever the value of the trigger changes, e.g. a counter the PLC increments
+CHANGE = "change"
+TRIGGER_MODES = (RISING_EDGE, CHANGE)
+
+# Seconds to wait before a group whose read failed is read again
+DEFAULT_RETRY_INTERVAL = 1.0
+
+
+class TriggeredGroup():
+    """
+    A group of variables that is only read when a trigger variable fires, instead of every cycle.
+
+    The trigger is read with the cyclic variables. In the cycle in which it fires, the group is read once, right
+    after the cyclic read, so its data is as new as the trigger. If that read fails, e.g. because a variable is
+    misspelled, the error is kept in error, and the trigger is not consumed: the group is read again once
+    retry_interval has passed.
+
+    The first trigger value seen only sets the reference, so a flag that is already TRUE, or a counter that is
+    already counting, does not fire. A flag pulse shorter than the bridge cycle can be missed: the PLC should hold
+    the flag until it is acknowledged, or use a CHANGE counter, which fires once even if it counted several times.
+
+    Args:
+        name (str): The name of the group, used in the events.
+        trigger (str): The name of the trigger variable on the PLC. "MAIN.recipe_ready"
+        variables (list[str]): The names of the variables to read. ["MAIN.recipe", "MAIN.batch_report"]
+        mode (str, optional): RISING_EDGE or CHANGE.
+        retry_interval (float, optional): Seconds to wait before a failed read is repeated.
+
+    Attributes:
+        error (str): The error of the last read, or None if it succeeded.
+
+    """
+
+    def __init__(self, name : str, trigger : str, variables : list, mode : str = RISING_EDGE, retry_interval : float = DEFAULT_RETRY_INTERVAL):
+        if mode not in TRIGGER_MODES:
+            raise ValueError(f"Unknown trigger mode: {mode}")
+        if any(is_pattern(variable) for variable in variables):
+            raise ValueError(f"The variables of group {name} cannot contain wildcards")
+        self.name = name
+        self.trigger = trigger
+        self.mode = mode
+        self.index = ReadIndex(list(variables))
+        self.retry_interval = retry_interval
+        self.error = None
+        self._last = None
+        self._retry_time = 0.0
+
+    def reset(self):
+        """
+        Forgets the last trigger value, so the next one only sets the reference again.
+        """
+        self._last = None
+
+    def fired(self, value):
+        """
+        Returns True if the trigger fires with value, compared to the last consumed value.
+        """
+        if value is None or self._last is None:
+            return False
+        if self.mode == RISING_EDGE:
+            return bool(value) and not bool(self._last)
+        return value != self._last
+
+    def poll(self, value, driver):
+        """
+        Reads the group if the trigger fired.
+
+        Args:
+            value: The current value of the trigger.
+            driver: The driver, with read_values(names).
+
+        Returns:
+            FlatSnapshot: The values of the group, or None if the trigger did not fire, or a failed read is not
+            repeated yet.
+
+        Raises:
+            Exception: The error of the driver, if the read failed.
+
+        """
+        snapshot = None
+        if self.fired(value):
+            if time.monotonic() < self._retry_time:
+                # Keep the trigger until the read is repeated
+                return None
+            try:
+                values = driver.read_values(self.index.names)
+            except Exception as e:
+                # Raises before the trigger is consumed, so the read is repeated after the retry interval
+                self.error = str(e)
+                self._retry_time = time.monotonic() + self.retry_interval
+                raise
+            self.error = None
+            snapshot = FlatSnapshot(self.index, values)
+        if value is not None:
+            self._last = value
+        return snapshot
@@ -9,57 +9,44 @@
 #
 
 import omni.ui as ui
+import omni.kit.app
 import omni.timeline
 
-from carb.settings import get_settings
+import json
+import os
+import tempfile
 
-from .ads_driver import AdsDriver
 
-from .global_variables import EXTENSION_NAME
-from .BeckhoffBridge import EVENT_TYPE_DATA_READ, EVENT_TYPE_DATA_READ_REQ, EVENT_TYPE_DATA_WRITE_REQ, EVENT_TYPE_DATA_INIT
+class UIBuilder:
+    """
+    The settings window of the bridge. It only displays and edits the state of a BridgeService,
+    which does all of the communication and also runs without this window.
 
-import threading
-from threading import RLock
+    Args:
+        service (BridgeService): The service to display.
+        binding_engine (UsdBindingEngine, optional): The PLC-to-USD binding engine, for the bindings file setting.
 
-import json
+    """
 
-import time
- 
-class UIBuilder:
-    def __init__(self):
+    def __init__(self, service, binding_engine = None):
         # UI elements created using a UIElementWrapper instance
         self.wrapped_ui_elements = []
 
         # Get access to the timeline to control stop/pause/play programmatically
         self._timeline = omni.timeline.get_timeline_interface()
 
-        # Get the settings interface
-        self.settings_interface = get_settings()
-         
-        # Internal status flags. 
-        self._thread_is_alive = True   
-        self._communication_initialized = False
+        self._service = service
+        self._binding_engine = binding_engine
+        self._tracer = service.tracer
         self._ui_initialized = False
+        self._update_sub = None
+        self._monitor_cycle_count = -1
 
-        # Configuration parameters for the extension.
-        # These are exposed on the UI. 
-        self._enable_communication = self.get_setting( 'ENABLE_COMMUNICATION', False ) 
-        self._refresh_rate = self.get_setting( 'REFRESH_RATE', 20 )
-
-        # Data stream where the extension will dump the data that it reads from the PLC.
-        self._event_stream = omni.kit.app.get_app().get_message_bus_event_stream()
-
-        self._ads_connector = AdsDriver(self.get_setting( 'PLC_AMS_NET_ID', '127.0.0.1.1.1'))
-        
-        self.write_queue = dict()
-        self.write_lock = RLock()
-
-        self.read_req = self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_READ_REQ, self.on_read_req_event)
-        self.write_req = self._event_stream.create_subscription_to_push_by_type(EVENT_TYPE_DATA_WRITE_REQ, self.on_write_req_event)
-        self._event_stream.push(event_type=EVENT_TYPE_DATA_INIT, payload={'data': {}})
-
-        self._thread = threading.Thread(target=self._update_plc_data)
-        self._thread.start()
+        # Settings that are only used by the UI
+        self._trace_file = self.get_setting( 'TRACE_FILE', os.path.join(tempfile.gettempdir(), 'beckhoff_bridge_trace.json') )
+        self._bindings_file = self.get_setting( 'BINDINGS_FILE', '' )
+        self._trend_variable = self.get_setting( 'TREND_VARIABLE', '' )
+        self._trend_window = self.get_setting( 'TREND_WINDOW', 10.0 )
 
     ###################################################################################
     #           The Functions Below Are Called Automatically By extension.py
@@ -69,12 +56,7 @@ class UIBuilder:
         """Callback for when the UI is opened from the toolbar. 
         This is called directly after build_ui().
         """
-        self._event_stream.push(event_type=EVENT_TYPE_DATA_INIT, payload={'data': {}})
-
-        if(not self._thread_is_alive):
-            self._thread_is_alive = True
-            self._thread = threading.Thread(target=self._update_plc_data)
-            self._thread.start()
+        self._service.start()
 
     def on_timeline_event(self, event):
         """Callback for Timeline events (Play, Pause, Stop)
@@ -102,10 +84,8 @@ class UIBuilder:
         Called when the stage is closed or the extension is hot reloaded.
         Perform any necessary cleanup such as removing active callback functions
         """
-        self.read_req.unsubscribe()
-        self.write_req.unsubscribe()    
-        self._thread_is_alive = False
-        self._thread.join()
+        self._update_sub = None
+        self._ui_initialized = False
 
     def build_ui(self):
         """
@@ -117,21 +97,31 @@ class UIBuilder:
 
                 with ui.HStack(spacing=5, height=0):
                     ui.Label("Enable ADS Client")
-                    self._enable_communication_checkbox = ui.CheckBox(ui.SimpleBoolModel(self._enable_communication))
+                    self._enable_communication_checkbox = ui.CheckBox(ui.SimpleBoolModel(self._service.enable_communication))
                     self._enable_communication_checkbox.model.add_value_changed_fn(self._toggle_communication_enable)
                 
                 with ui.HStack(spacing=5, height=0):
                     ui.Label("Refresh Rate (ms)")
-                    self._refresh_rate_field = ui.IntField(ui.SimpleIntModel(self._refresh_rate))
+                    self._refresh_rate_field = ui.IntField(ui.SimpleIntModel(self._service.refresh_rate))
                     self._refresh_rate_field.model.set_min(10)
                     self._refresh_rate_field.model.set_max(10000)
                     self._refresh_rate_field.model.add_value_changed_fn(self._on_refresh_rate_changed)
+
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Adaptive Rate")
+                    self._adaptive_rate_checkbox = ui.CheckBox(ui.SimpleBoolModel(self._service.adaptive_rate))
+                    self._adaptive_rate_checkbox.model.add_value_changed_fn(self._toggle_adaptive_rate)
                                    
                 with ui.HStack(spacing=5, height=0):
                     ui.Label("PLC AMS Net Id")
-                    self._plc_ams_net_id_field = ui.StringField(ui.SimpleStringModel(self._ads_connector.ams_net_id))
+                    self._plc_ams_net_id_field = ui.StringField(ui.SimpleStringModel(self._service.ams_net_id))
                     self._plc_ams_net_id_field.model.add_value_changed_fn(self._on_plc_ams_net_id_changed)
 
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("USD Bindings File")
+                    self._bindings_file_field = ui.StringField(ui.SimpleStringModel(self._bindings_file))
+                    self._bindings_file_field.model.add_end_edit_fn(self._on_bindings_file_changed)
+
                 with ui.HStack(spacing=5, height=0):
                     ui.Label("Settings")
                     ui.Button("Load", clicked_fn=self.load_settings)
@@ -143,12 +133,71 @@ class UIBuilder:
                     ui.Label("Status")
                     self._status_field = ui.StringField(ui.SimpleStringModel("n/a"), read_only=True)
 
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Effective Rate")
+                    self._effective_rate_field = ui.StringField(ui.SimpleStringModel(""), read_only=True)
+
+        with ui.CollapsableFrame("Diagnostics", collapsed=True):
+            with ui.VStack(spacing=5, height=0):
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Record Trace")
+                    self._trace_enabled_checkbox = ui.CheckBox(ui.SimpleBoolModel(self._tracer.enabled))
+                    self._trace_enabled_checkbox.model.add_value_changed_fn(self._toggle_trace_enable)
+
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Trace File")
+                    self._trace_file_field = ui.StringField(ui.SimpleStringModel(self._trace_file))
+                    self._trace_file_field.model.add_value_changed_fn(self._on_trace_file_changed)
+
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Trace")
+                    ui.Button("Dump", clicked_fn=self.dump_trace)
+                    ui.Button("Clear", clicked_fn=self._tracer.clear)
+
+                with ui.HStack(spacing=5, height=60):
+                    ui.Label("Subscribers")
+                    self._subscribers_field = ui.StringField(ui.SimpleStringModel(""), multiline=True, read_only=True)
+
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Latency Probe")
+                    self._latency_probe_checkbox = ui.CheckBox(ui.SimpleBoolModel(False))
+                    self._latency_probe_checkbox.model.add_value_changed_fn(self._toggle_latency_probe)
+
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Probe Variable")
+                    self._probe_variable_field = ui.StringField(ui.SimpleStringModel(self.get_setting('LATENCY_PROBE_WRITE_VARIABLE', '')))
+                    self._probe_variable_field.model.add_value_changed_fn(
+                        lambda value: self.set_setting('LATENCY_PROBE_WRITE_VARIABLE', value.get_value_as_string()))
+
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Echo Variable")
+                    self._echo_variable_field = ui.StringField(ui.SimpleStringModel(self.get_setting('LATENCY_PROBE_ECHO_VARIABLE', '')))
+                    self._echo_variable_field.model.add_value_changed_fn(
+                        lambda value: self.set_setting('LATENCY_PROBE_ECHO_VARIABLE', value.get_value_as_string()))
+
+                with ui.HStack(spacing=5, height=60):
+                    ui.Label("Latency")
+                    self._latency_field = ui.StringField(ui.SimpleStringModel(""), multiline=True, read_only=True)
+
         with ui.CollapsableFrame("Monitor", collapsed=False):
             with ui.VStack(spacing=5, height=0):
                 with ui.HStack(spacing=5, height=100):
                     ui.Label("Variables")
                     self._monitor_field = ui.StringField(ui.SimpleStringModel("{}"), multiline=True, read_only=True)
 
+                with ui.HStack(spacing=5, height=0):
+                    ui.Label("Trend Variable")
+                    self._trend_variable_field = ui.StringField(ui.SimpleStringModel(self._trend_variable))
+                    self._trend_variable_field.model.add_end_edit_fn(self._on_trend_variable_changed)
+
+                with ui.HStack(spacing=5, height=80):
+                    ui.Label("Trend")
+                    self._trend_plot = ui.Plot(ui.Type.LINE, 0.0, 1.0, 0.0, height=80)
+
+        # The fields are refreshed from the service on the main thread, once per frame
+        self._monitor_cycle_count = -1
+        self._start_trend()
+        self._update_sub = omni.kit.app.get_app().get_update_event_stream().create_subscription_to_pop(self._on_update)
         self._ui_initialized = True
 
     ####################################
@@ -157,88 +206,78 @@ class UIBuilder:
     ####################################
     ####################################
 
-    def on_read_req_event(self, event ):
-        event_data = event.payload
-        variables : list = event_data['variables'] 
-        for name in variables:
-            self._ads_connector.add_read(name)
-
-    def on_write_req_event(self, event ):
-        variables = event.payload["variables"]
-        for variable in variables:
-            self.queue_write(variable['name'], variable['value'])
-
-    def queue_write(self, name, value):
-        with self.write_lock:
-            self.write_queue[name] = value
-
-    def _update_plc_data(self):
-
-        thread_start_time = time.time()
-        status_update_time = time.time()
-
-        while self._thread_is_alive:
-
-            # Sleep for the refresh rate
-            sleepy_time = self._refresh_rate/1000 - (time.time() - thread_start_time)
-            if sleepy_time > 0:
-                time.sleep(sleepy_time)
-            else:
-                time.sleep(0.1)
-
-            thread_start_time = time.time()
-
-            # Check if the communication is enabled
-            if not self._enable_communication:
-                if self._ui_initialized:
-                    self._status_field.model.set_value("Disabled")
-                    self._monitor_field.model.set_value("{}")
-                continue
-
-            # Catch exceptions and log them to the status field
-            try:
-                # Start the communication if it is not initialized
-                if (not self._communication_initialized) and (self._enable_communication):
-                    self._ads_connector.connect()
-                    self._communication_initialized = True
-                elif (self._communication_initialized) and (not self._ads_connector.is_connected()):
-                    self._ads_connector.disconnect()
-
-                if status_update_time < time.time():
-                    if self._ads_connector.is_connected():
-                        self._status_field.model.set_value("Connected")
-                    else:
-                        self._status_field.model.set_value("Attempting to connect...")
-
-                # Write data to the PLC if there is data to write
-                # If there is an exception, log it to the status field but continue reading data
-                try:
-                    if self.write_queue:                                             
-                        with self.write_lock:
-                            values = self.write_queue
-                            self.write_queue = dict()
-                        self._ads_connector.write_data(values)
-                except Exception as e:
-                    if self._ui_initialized:
-                        self._status_field.model.set_value(f"Error writing data to PLC: {e}")
-                        status_update_time = time.time() + 1
-
-                # Read data from the PLC
-                self._data = self._ads_connector.read_data()
-
-                # Push the data to the event stream
-                self._event_stream.push(event_type=EVENT_TYPE_DATA_READ, payload={'data': self._data})
-
-                # Update the monitor field
-                if self._ui_initialized:
-                    json_formatted_str = json.dumps(self._data, indent=4)
-                    self._monitor_field.model.set_value(json_formatted_str)
-
-            except Exception as e:
-                if self._ui_initialized:
-                    self._status_field.model.set_value(f"Error reading data from PLC: {e}")
-                    status_update_time = time.time() + 1
-                time.sleep(1)
+    def _on_update(self, event):
+        status = self._service.status
+        if self._status_field.model.get_value_as_string() != status:
+            self._status_field.model.set_value(status)
+
+        # Only format the monitor text when a new cycle was read
+        cycle_count = self._service.cycle_count
+        if not self._service.enable_communication:
+            cycle_count = -1
+        if cycle_count != self._monitor_cycle_count:
+            self._monitor_cycle_count = cycle_count
+            with self._tracer.span("ui_update", "ui"):
+                data = self._service.data if cycle_count >= 0 else {}
+                self._monitor_field.model.set_value(json.dumps(data, indent=4))
+                self._effective_rate_field.model.set_value(self._format_effective_rate())
+                self._subscribers_field.model.set_value(self._format_subscriber_stats())
+                self._latency_field.model.set_value(self._format_latency_stats())
+                self._update_trend()
+
+    def _format_latency_stats(self):
+        probe = self._service.latency_probe
+        if probe is None:
+            return ""
+        stats = probe.stats()
+        round_trip = stats['round_trip']
+        lines = [f"Round trip: p50 {round_trip['p50']:.1f} ms, p90 {round_trip['p90']:.1f} ms, "
+                 f"p99 {round_trip['p99']:.1f} ms, max {round_trip['max']:.1f} ms ({stats['samples']} samples, {stats['lost']} lost)"]
+        for stage, values in stats['stages'].items():
+            lines.append(f"{stage}: p50 {values['p50']:.2f} ms, p99 {values['p99']:.2f} ms")
+        return "\n".join(lines)
+
+    def _toggle_latency_probe(self, state):
+        if not state.get_value_as_bool():
+            self._service.stop_latency_probe()
+            return
+        try:
+            self._service.start_latency_probe()
+        except ValueError as e:
+            self._status_field.model.set_value(f"Error starting latency probe: {e}")
+            self._latency_probe_checkbox.model.set_value(False)
+
+    def _start_trend(self, previous : str = None):
+        # Trend variables are read on their own, so a typo neither fails the cyclic read nor stays in it
+        if previous and previous != self._trend_variable:
+            self._service.remove_history([previous])
+        if self._trend_variable:
+            self._service.add_history([self._trend_variable], cyclic=False)
+
+    def _update_trend(self):
+        if not self._trend_variable:
+            return
+        try:
+            times, values = self._service.get_history(self._trend_variable, self._trend_window)
+        except KeyError:
+            return
+        if len(values) == 0:
+            return
+        low = float(values.min())
+        high = float(values.max())
+        if low == high:
+            low -= 0.5
+            high += 0.5
+        self._trend_plot.scale_min = low
+        self._trend_plot.scale_max = high
+        self._trend_plot.set_data(*values.tolist())
+
+    def _format_subscriber_stats(self):
+        lines = []
+        for stats in self._service.subscriber_stats():
+            lines.append(f"{stats['name']}: {stats['delivered']} delivered, {stats['dropped']} dropped, "
+                         f"latency {stats['mean_latency_ms']:.2f} ms (max {stats['max_latency_ms']:.2f} ms)")
+        return "\n".join(lines)
 
     ####################################
     ####################################
@@ -247,39 +286,81 @@ class UIBuilder:
     ####################################
 
     def get_setting(self, name, default_value=None ):
-        setting = self.settings_interface.get("/persistent/" + EXTENSION_NAME + "/" + name)
-        if setting is None:
-            setting = default_value
-            self.settings_interface.set("/persistent/" + EXTENSION_NAME + "/" + name, setting)
-        return setting
+        return self._service.settings.get(name, default_value)
 
     def set_setting(self, name, value ):
-        self.settings_interface.set("/persistent/" + EXTENSION_NAME + "/" + name, value)
+        self._service.settings.set(name, value)
 
     def _on_plc_ams_net_id_changed(self, value):
-        self._ads_connector.ams_net_id = value.get_value_as_string()
-        self._communication_initialized = False
+        self._service.ams_net_id = value.get_value_as_string()
+
+    def _toggle_trace_enable(self, state):
+        self._tracer.enabled = state.get_value_as_bool()
+
+    def _on_trace_file_changed(self, value):
+        self._trace_file = value.get_value_as_string()
+
+    def dump_trace(self):
+        try:
+            count = self._tracer.dump(self._trace_file)
+            self._status_field.model.set_value(f"Wrote {count} trace events to {self._trace_file}")
+        except Exception as e:
+            self._status_field.model.set_value(f"Error writing trace: {e}")
+
+    def _load_bindings_file(self):
+        if self._binding_engine is None or not self._bindings_file:
+            return
+        try:
+            self._binding_engine.load_bindings_file(self._bindings_file)
+        except Exception as e:
+            if self._ui_initialized:
+                self._status_field.model.set_value(f"Error loading bindings file: {e}")
+
+    def _on_bindings_file_changed(self, value):
+        self._bindings_file = value.get_value_as_string()
+        self._load_bindings_file()
+
+    def _on_trend_variable_changed(self, value):
+        previous = self._trend_variable
+        self._trend_variable = value.get_value_as_string().strip()
+        self._start_trend(previous)
+        self._trend_plot.set_data(0.0)
 
     def _on_refresh_rate_changed(self, value):
-        self._refresh_rate = value.get_value_as_int()
+        self._service.refresh_rate = value.get_value_as_int()
+
+    def _toggle_adaptive_rate(self, state):
+        self._service.adaptive_rate = state.get_value_as_bool()
+
+    def _format_effective_rate(self):
+        text = f"{self._service.effective_rate:.0f} ms, cycle {self._service.cycle_cost:.1f} ms"
+        if self._service.adaptive_rate:
+            text += ", paused" if self._service.paused else ", adaptive"
+        return text
 
     def _toggle_communication_enable(self, state):
-        self._enable_communication = state.get_value_as_bool()
-        if not self._enable_communication:
-            self._communication_initialized = False
+        self._service.enable_communication = state.get_value_as_bool()
 
     def save_settings(self):
-        self.set_setting('REFRESH_RATE', self._refresh_rate)
-        self.set_setting('PLC_AMS_NET_ID', self._ads_connector.ams_net_id)
-        self.set_setting('ENABLE_COMMUNICATION', self._enable_communication)
+        self._service.save_settings()
+        self.set_setting('BINDINGS_FILE', self._bindings_file)
+        self.set_setting('TRACE_FILE', self._trace_file)
+        self.set_setting('TREND_VARIABLE', self._trend_variable)
 
     def load_settings(self):
-        self._refresh_rate = self.get_setting('REFRESH_RATE')
-        self._ads_connector.ams_net_id = self.get_setting('PLC_AMS_NET_ID')
-        self._enable_communication = self.get_setting('ENABLE_COMMUNICATION')
-
-        self._refresh_rate_field.model.set_value(self._refresh_rate)
-        self._plc_ams_net_id_field.model.set_value(self._ads_connector.ams_net_id)
-        self._enable_communication_checkbox.model.set_value(self._enable_communication)
-        self._communication_initialized = False
-
+        self._service.load_settings()
+        self._bindings_file = self.get_setting('BINDINGS_FILE', '')
+        self._trace_file = self.get_setting('TRACE_FILE', self._trace_file)
+        previous_trend = self._trend_variable
+        self._trend_variable = self.get_setting('TREND_VARIABLE', '')
+
+        self._refresh_rate_field.model.set_value(self._service.refresh_rate)
+        self._plc_ams_net_id_field.model.set_value(self._service.ams_net_id)
+        self._enable_communication_checkbox.model.set_value(self._service.enable_communication)
+        self._adaptive_rate_checkbox.model.set_value(self._service.adaptive_rate)
+        self._bindings_file_field.model.set_value(self._bindings_file)
+        self._trace_enabled_checkbox.model.set_value(self._tracer.enabled)
+        self._trace_file_field.model.set_value(self._trace_file)
+        self._trend_variable_field.model.set_value(self._trend_variable)
+        self._load_bindings_file()
+        self._start_trend(previous_trend)
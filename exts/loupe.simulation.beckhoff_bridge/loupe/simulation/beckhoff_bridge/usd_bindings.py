@@ -0,0 +1,512 @@
+'''
+  File: **usd_bindings.py**
+  Copyright (c) 2024 Loupe
+  https://loupe.team
+
+  This file is part of Omniverse_Beckhoff_Bridge_Extension, licensed under the MIT License.
+
+'''
+
+import json
+import time
+from threading import RLock
+
+import carb
+import omni.kit.app
+import omni.usd
+from pxr import Sdf, Tf, Usd
+
+from .ads_driver import split_plc_var_name, lookup_plc_var
+from .BeckhoffBridge import Manager
+from .interpolation import INTERPOLATION_MODES
+
+# Key in the root layer's customLayerData that holds the binding configuration
+STAGE_METADATA_KEY = "loupe:beckhoff_bridge:bindings"
+
+# Short names accepted in place of full attribute names
+ATTRIBUTE_ALIASES = {
+    "translate": "xformOp:translate",
+    "rotate": "xformOp:rotateXYZ",
+    "orient": "xformOp:orient",
+    "scale": "xformOp:scale",
+    "visibility": "visibility",
+}
+
+class Binding():
+    """
+    Maps one PLC variable onto a USD prim attribute, or onto one component of a vector attribute.
+
+    The value written to USD is `plc_value * scale + offset`. Integers stay integers as long as the result is whole,
+    and values pass through unchanged with the default scale and offset. For the `visibility` attribute the PLC
+    value is interpreted as a boolean, and scale/offset are ignored.
+
+    Bindings with an interpolation mode are evaluated at the time of every frame from the newest read cycles,
+    instead of being set once per read cycle.
+
+    Args:
+        variable (str): The PLC variable name. "MAIN.axis[0].position"
+        prim (str): The path of the target prim. "/World/Axis"
+        attribute (str): The attribute name, or one of the ATTRIBUTE_ALIASES. "translate"
+        component (int, optional): Index into a vector attribute. If None the whole attribute is written.
+        scale (float, optional): Factor applied to the PLC value.
+        offset (float, optional): Offset added after scaling.
+        interpolation (str, optional): "linear" or "hold" to evaluate the binding at frame time. See Manager.add_interpolation().
+
+    """
+
+    __slots__ = ("variable", "prim", "attribute", "component", "scale", "offset", "interpolation", "keys")
+
+    def __init__(self, variable : str, prim : str, attribute : str, component : int = None, scale : float = 1.0, offset : float = 0.0,
+                 interpolation : str = None):
+        if interpolation is not None and interpolation not in INTERPOLATION_MODES:
+            raise ValueError(f"Unknown interpolation mode of {variable}: {interpolation}")
+        self.variable = variable
+        self.prim = prim
+        self.attribute = ATTRIBUTE_ALIASES.get(attribute, attribute)
+        self.component = None if component is None else int(component)
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.interpolation = interpolation
+        self.keys = split_plc_var_name(variable)
+
+    @classmethod
+    def from_dict(cls, definition : dict):
+        """
+        Creates a binding from its dictionary form, as stored in stage metadata or a JSON file.
+
+        Args:
+            definition (dict): {"variable": ..., "prim": ..., "attribute": ..., "component": ..., "scale": ..., "offset": ..., "interpolation": ...}
+
+        Returns:
+            Binding: The new binding.
+
+        """
+        return cls(definition["variable"],
+                   definition["prim"],
+                   definition["attribute"],
+                   definition.get("component"),
+                   definition.get("scale", 1.0),
+                   definition.get("offset", 0.0),
+                   definition.get("interpolation"))
+
+    @property
+    def attribute_path(self):
+        return self.prim + "." + self.attribute
+
+    def _scale(self, value):
+        """
+        Applies scale and offset to one number, keeping integers (e.g. DINT variables) integers when the result is whole.
+        """
+        if self.scale == 1.0 and self.offset == 0.0:
+            return value
+        result = value * self.scale + self.offset
+        if isinstance(value, int) and not isinstance(value, bool) and result.is_integer():
+            return int(result)
+        return result
+
+    def transform(self, value):
+        """
+        Converts a PLC value into the value written to USD.
+        """
+        if self.attribute == "visibility":
+            return "inherited" if value else "invisible"
+        if isinstance(value, (list, tuple)):
+            return [self._scale(v) for v in value]
+        return self._scale(value)
+
+
+class OutputBinding(Binding):
+    """
+    Maps a USD prim attribute, or one component of a vector attribute, onto one PLC variable.
+
+    The value written to the PLC is `usd_value * scale + offset`. Boolean attributes are written as booleans, integer
+    attributes as integers as long as the result is whole, and for the `visibility` attribute the PLC variable is
+    True unless the prim is invisible.
+
+    Args:
+        variable (str): The PLC variable name. "MAIN.sensors[3].blocked"
+        prim (str): The path of the source prim. "/World/Sensor_3"
+        attribute (str): The attribute name, or one of the ATTRIBUTE_ALIASES. "physxTrigger:triggered"
+        component (int, optional): Index into a vector attribute. If None the whole attribute is written.
+        scale (float, optional): Factor applied to the USD value.
+        offset (float, optional): Offset added after scaling.
+
+    """
+
+    __slots__ = ()
+
+    def transform(self, value):
+        """
+        Converts a USD value into the value written to the PLC.
+        """
+        if self.attribute == "visibility":
+            return value != "invisible"
+        if self.component is not None:
+            value = value[self.component]
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            return self._scale(value)
+        return [self._scale(v) for v in value]
+
+
+def _binding_definitions(config, section : str):
+    if isinstance(config, str):
+        config = json.loads(config)
+    if isinstance(config, dict) and ("bindings" in config or "outputs" in config):
+        config = config.get(section, [])
+    elif section != "bindings":
+        # The list and keyed-by-name forms only hold PLC-to-USD bindings
+        config = []
+    if isinstance(config, dict):
+        config = list(config.values())
+    return [dict(definition) for definition in config]
+
+def parse_bindings(config):
+    """
+    Parses a binding configuration into a list of Binding objects.
+
+    The configuration can be a JSON string, a list of binding dictionaries, or a dictionary with either a
+    "bindings" list or binding dictionaries keyed by name (the form that can be stored in USD layer metadata).
+
+    Args:
+        config (str | list | dict): The binding configuration.
+
+    Returns:
+        list[Binding]: The parsed bindings.
+
+    """
+    return [Binding.from_dict(definition) for definition in _binding_definitions(config, "bindings")]
+
+def parse_output_bindings(config):
+    """
+    Parses the USD-to-PLC part of a binding configuration into a list of OutputBinding objects.
+
+    Output bindings are listed under the "outputs" key of the configuration, as a list or keyed by name.
+    The other forms accepted by parse_bindings() have no output bindings.
+
+    Args:
+        config (str | list | dict): The binding configuration.
+
+    Returns:
+        list[OutputBinding]: The parsed output bindings.
+
+    """
+    return [OutputBinding.from_dict(definition) for definition in _binding_definitions(config, "outputs")]
+
+
+class UsdBindingEngine():
+    """
+    Applies PLC values to USD attributes based on a set of declarative bindings.
+
+    Values arriving on the bridge thread are only converted and compared against the last applied value there.
+    All changed attributes are then written once per Kit frame on the main thread, inside a single Sdf.ChangeBlock.
+    Bindings with an interpolation mode are instead evaluated at the time of each frame, on the main thread.
+
+    Output bindings go the other way. The engine listens for Usd.Notice.ObjectsChanged on the stage and marks
+    only the bound attributes that changed as dirty. Once per frame, the dirty attributes are read, and the values
+    that differ from the last ones sent are queued as one batched write.
+
+    Bindings are loaded from the `loupe:beckhoff_bridge:bindings` entry of the root layer's customLayerData when a
+    stage is opened, or from a JSON file with load_bindings_file().
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._bindings = []
+        self._attributes = dict()
+        self._pending = dict()
+        self._applied = dict()
+        self._bindings_file = None
+
+        self._outputs = dict()
+        self._dirty = set()
+        self._sent = dict()
+        self._objects_changed_listener = None
+
+        self._bridge = Manager()
+        self._bridge.register_init_callback(self._on_bridge_init)
+        self._bridge.register_data_callback(self._on_data)
+
+        self._usd_context = omni.usd.get_context()
+        self._stage_event_sub = self._usd_context.get_stage_event_stream().create_subscription_to_pop(self._on_stage_event)
+        self._update_sub = omni.kit.app.get_app().get_update_event_stream().create_subscription_to_pop(self._on_update)
+
+        self.load_stage_bindings()
+
+    def cleanup(self):
+        """
+        Removes the stage, update and bridge subscriptions.
+        """
+        self._stage_event_sub = None
+        self._update_sub = None
+        self._bridge = None
+        self._revoke_objects_changed()
+
+    @property
+    def bindings(self):
+        return list(self._bindings)
+
+    def set_bindings(self, bindings : list):
+        """
+        Replaces the active bindings and subscribes to their PLC variables.
+
+        Args:
+            bindings (list[Binding]): The new bindings.
+
+        """
+        with self._lock:
+            self._bindings = list(bindings)
+            self._attributes = dict()
+            self._pending = dict()
+            self._applied = dict()
+        self._on_bridge_init(None)
+
+    @property
+    def output_bindings(self):
+        return [binding for bindings in self._outputs.values() for binding in bindings]
+
+    def set_output_bindings(self, bindings : list):
+        """
+        Replaces the active output bindings. Their current values are sent to the PLC in the next frame.
+
+        Args:
+            bindings (list[OutputBinding]): The new output bindings.
+
+        """
+        outputs = dict()
+        for binding in bindings:
+            outputs.setdefault(Sdf.Path(binding.attribute_path), []).append(binding)
+        self._outputs = outputs
+        self._dirty = set(outputs)
+        self._sent = dict()
+        self._register_objects_changed()
+
+    def load_bindings_file(self, path : str):
+        """
+        Loads bindings and output bindings from a JSON file, replacing the active ones.
+        The file is remembered and reloaded whenever a new stage is opened.
+
+        Args:
+            path (str): Path to a JSON file in any form accepted by parse_bindings().
+
+        """
+        with open(path, "r") as f:
+            config = json.load(f)
+        bindings = parse_bindings(config)
+        outputs = parse_output_bindings(config)
+        self._bindings_file = path
+        self.set_bindings(bindings)
+        self.set_output_bindings(outputs)
+
+    def load_stage_bindings(self):
+        """
+        Loads bindings from the metadata of the current stage's root layer, if there are any.
+        Bindings from a JSON file take precedence over stage metadata.
+        """
+        if self._bindings_file is not None:
+            self.load_bindings_file(self._bindings_file)
+            return
+
+        stage = self._usd_context.get_stage()
+        if stage is None:
+            self.set_bindings([])
+            self.set_output_bindings([])
+            return
+
+        config = stage.GetRootLayer().customLayerData.get(STAGE_METADATA_KEY)
+        try:
+            self.set_bindings(parse_bindings(config) if config else [])
+            self.set_output_bindings(parse_output_bindings(config) if config else [])
+        except (KeyError, TypeError, ValueError) as e:
+            carb.log_error(f"Invalid Beckhoff Bridge bindings in stage metadata: {e}")
+            self.set_bindings([])
+            self.set_output_bindings([])
+
+    ####################################
+    # Bridge thread
+    ####################################
+
+    def _on_bridge_init(self, event):
+        if self._bridge is None:
+            return
+        variables = [binding.variable for binding in self._bindings if binding.interpolation is None]
+        if variables:
+            self._bridge.add_cyclic_read_variables(variables)
+        modes = dict()
+        for binding in self._bindings:
+            if binding.interpolation is not None:
+                modes.setdefault(binding.interpolation, []).append(binding.variable)
+        for mode, variables in modes.items():
+            try:
+                self._bridge.add_interpolation(variables, mode)
+            except RuntimeError:
+                # The bridge is not running yet, its DATA_INIT event adds them
+                pass
+
+    def _on_data(self, event):
+        data = event.payload['data']
+        with self._lock:
+            for binding in self._bindings:
+                if binding.interpolation is not None:
+                    continue
+                value = lookup_plc_var(data, binding.keys)
+                if value is None:
+                    continue
+                value = binding.transform(value)
+                key = (binding.attribute_path, binding.component)
+                if self._applied.get(key) != value:
+                    self._pending[key] = value
+                else:
+                    # Drop a change that was reverted before it reached USD
+                    self._pending.pop(key, None)
+
+    ####################################
+    # Main thread
+    ####################################
+
+    def _on_stage_event(self, event):
+        if event.type == int(omni.usd.StageEventType.OPENED):
+            self.load_stage_bindings()
+        elif event.type == int(omni.usd.StageEventType.CLOSED):
+            self._revoke_objects_changed()
+            with self._lock:
+                self._attributes = dict()
+                self._pending = dict()
+                self._applied = dict()
+            self._dirty = set()
+
+    def _get_attribute(self, stage, attribute_path):
+        attribute = self._attributes.get(attribute_path)
+        if attribute is None or not attribute.IsValid():
+            missing = attribute is not None
+            attribute = stage.GetAttributeAtPath(attribute_path)
+            if not attribute.IsValid() and not missing:
+                carb.log_warn(f"Beckhoff Bridge binding target does not exist: {attribute_path}")
+            self._attributes[attribute_path] = attribute
+        return attribute
+
+    def _register_objects_changed(self):
+        self._revoke_objects_changed()
+        stage = self._usd_context.get_stage()
+        if self._outputs and stage is not None:
+            self._objects_changed_listener = Tf.Notice.Register(Usd.Notice.ObjectsChanged, self._on_objects_changed, stage)
+
+    def _revoke_objects_changed(self):
+        if self._objects_changed_listener is not None:
+            self._objects_changed_listener.Revoke()
+            self._objects_changed_listener = None
+
+    def _on_objects_changed(self, notice, stage):
+        # Only mark bound attributes as dirty here, they are read once per frame in _on_update()
+        outputs = self._outputs
+        for path in notice.GetChangedInfoOnlyPaths():
+            if path in outputs:
+                self._dirty.add(path)
+        for path in notice.GetResyncedPaths():
+            if path in outputs:
+                self._dirty.add(path)
+            elif path.IsPrimPath() or path.IsAbsoluteRootPath():
+                self._dirty.update(attribute_path for attribute_path in outputs if attribute_path.HasPrefix(path))
+
+    def _send_outputs(self, stage):
+        dirty = self._dirty
+        self._dirty = set()
+
+        values = dict()
+        for attribute_path in dirty:
+            attribute = self._get_attribute(stage, str(attribute_path))
+            if not attribute.IsValid():
+                continue
+            value = attribute.Get()
+            if value is None:
+                continue
+            for binding in self._outputs.get(attribute_path, ()):
+                try:
+                    plc_value = binding.transform(value)
+                except (TypeError, IndexError) as e:
+                    carb.log_warn(f"Beckhoff Bridge could not convert {attribute_path} for {binding.variable}: {e}")
+                    continue
+                if self._sent.get(binding.variable) != plc_value:
+                    self._sent[binding.variable] = plc_value
+                    values[binding.variable] = plc_value
+
+        if values and self._bridge is not None:
+            self._bridge.write_variables(values)
+
+    def _interpolate(self):
+        """
+        Evaluates the interpolated bindings at the time of this frame, and queues the values that changed.
+        """
+        bindings = [binding for binding in self._bindings if binding.interpolation is not None]
+        if not bindings or self._bridge is None:
+            return
+        try:
+            values = self._bridge.get_interpolated([binding.variable for binding in bindings], time.time())
+        except (KeyError, RuntimeError):
+            # Not added to the bridge yet
+            return
+        with self._lock:
+            for binding in bindings:
+                value = values.get(binding.variable)
+                if value is None:
+                    continue
+                value = binding.transform(value)
+                key = (binding.attribute_path, binding.component)
+                if self._applied.get(key) != value:
+                    self._pending[key] = value
+                else:
+                    # Drop a change that was reverted before it reached USD
+                    self._pending.pop(key, None)
+
+    def _on_update(self, event):
+        self._interpolate()
+        if not self._pending and not self._dirty:
+            return
+
+        stage = self._usd_context.get_stage()
+        if stage is None:
+            return
+
+        if self._dirty:
+            self._send_outputs(stage)
+        if not self._pending:
+            return
+
+        with self._lock:
+            pending = self._pending
+            self._pending = dict()
+
+        # Merge components into one value per attribute before touching USD
+        updates = dict()
+        for (attribute_path, component), value in pending.items():
+            updates.setdefault(attribute_path, []).append((component, value))
+
+        # Only values that were written are applied, the others are queued again by the next data
+        applied = dict()
+        with Sdf.ChangeBlock():
+            for attribute_path, values in updates.items():
+                attribute = self._get_attribute(stage, attribute_path)
+                if not attribute.IsValid():
+                    continue
+                try:
+                    attribute.Set(self._merge_components(attribute, values))
+                except Exception as e:
+                    carb.log_warn(f"Beckhoff Bridge could not set {attribute_path}: {e}")
+                    continue
+                for component, value in values:
+                    applied[(attribute_path, component)] = value
+
+        with self._lock:
+            self._applied.update(applied)
+
+    def _merge_components(self, attribute, values):
+        whole = [value for component, value in values if component is None]
+        if whole:
+            return whole[-1]
+
+        current = attribute.Get()
+        components = list(current)
+        for component, value in values:
+            components[component] = value
+        return type(current)(*components)